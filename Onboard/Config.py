@@ -284,6 +284,11 @@ class Config(ConfigObject):
                   action="store_true", dest="log_learn", default=False,
                   help="log all learned text; off by default")
 
+        group.add_option("", "--latency-trace", type="str",
+                  dest="latency_trace_file", metavar="FILE",
+                  help="Trace keystroke latencies and write them as Chrome "
+                       "trace JSON to FILE, histograms to FILE.hist")
+
         parser.add_option_group(group)
 
 
@@ -636,6 +641,7 @@ class Config(ConfigObject):
         self.add_key("xembed-background-color", "#0000007F")
         self.add_key("xembed-background-image-enabled", True)
         self.add_key("xembed-unity-greeter-offset-x", 85.0)
+        self.add_key("latency-trace-file", "")
 
         self.keyboard          = ConfigKeyboard()
         self.window            = ConfigWindow()
@@ -1043,6 +1049,9 @@ class Config(ConfigObject):
     def get_user_model_dir(self):
         return os.path.join(self.user_dir, "models")
 
+    def get_user_spell_cache_dir(self):
+        return os.path.join(self.user_dir, "spellcheck")
+
     def get_system_model_dir(self):
         return os.path.join(self.install_dir, "models")
 
@@ -2066,6 +2075,8 @@ class ConfigTypingAssistance(ConfigObject):
         self.add_key("spell-check-backend", self.DEFAULT_BACKEND,
                                                      enum={"hunspell" : 0,
                                                            "aspell"   : 1})
+        self.add_key("async-spell-check", False)
+        self.add_key("spell-check-cache", False)
         self.add_key("auto-capitalization", False)
         self.add_key("auto-correction", False)
 
@@ -2100,6 +2111,9 @@ class ConfigWordSuggestions(ConfigObject):
         self.add_key("auto-learn", True)
         self.add_key("punctuation-assistance", True)
         self.add_key("delayed-word-separators-enabled", False)
+        self.add_key("async-prediction", False)
+        self.add_key("compact-system-models", False)
+        self.add_key("max-user-model-ngrams", 1000000)
         self.add_key("accent-insensitive", True)
         self.add_key("max-word-choices", 5)
         self.add_key("spelling-suggestions-enabled", True)
@@ -33,8 +33,9 @@ from gi.repository import GLib, Gdk, Pango, PangoCairo, GdkPixbuf
 
 from Onboard.KeyCommon   import *
 from Onboard.WindowUtils import DwellProgress
+from Onboard.SurfaceCache import SurfaceCache
 from Onboard.utils       import brighten, unicode_str, \
-                                gradient_line, drop_shadow, \
+                                gradient_line, blur_image_surface, \
                                 roundrect_curve, rounded_path, \
                                 rounded_polygon_path_to_cairo_path
 
@@ -57,7 +58,9 @@ class Key(KeyCommon):
 
     _shadow_steps  = 0
     _shadow_alpha  = 0
-    _shadow_presets = ((1, 0.015), (4, 0.005)) # quality presets (steps, alpha)
+    # Quality presets (steps, alpha). Steps is the number of box blur
+    # passes, more passes come closer to a gaussian.
+    _shadow_presets = ((1, 0.015), (4, 0.005))
 
     def __init__(self):
         KeyCommon.__init__(self)
@@ -112,13 +115,21 @@ class RectKey(Key, RectKeyCommon, DwellProgress):
 
     _image_pixbuf = None
     _requested_image_size = None
-    _shadow_surface = None
+    _shadow = None      # (shadow key, clip rect) until invalidated
+
+    # Rendered key faces, i.e. key backgrounds without labels and images.
+    # Shared by all keys, keys that look the same share a face.
+    _face_cache = SurfaceCache("key faces", 16 * 1024 * 1024)
+    _FACE_KEY_RESOLUTION = 4   # face positions snap to 1/4 pixel
+
+    # Shadow masks, shared by all keys of the same shape and size.
+    _shadow_cache = SurfaceCache("key shadows", 8 * 1024 * 1024)
 
     def __init__(self, id = "", border_rect = None):
         Key.__init__(self)
         RectKeyCommon.__init__(self, id, border_rect)
 
-        self._key_surfaces = {}
+        self._face = None   # (face key, clip rect) until invalidated
 
     def is_key(self):
         """ Is this a key item? """
@@ -132,7 +143,15 @@ class RectKey(Key, RectKeyCommon, DwellProgress):
         self.invalidate_shadow()
 
     def invalidate_key(self):
-        self._key_surfaces = {}
+        self._face = None
+
+    @staticmethod
+    def get_face_cache():
+        return RectKey._face_cache
+
+    @staticmethod
+    def get_shadow_cache():
+        return RectKey._shadow_cache
 
     def invalidate_image(self):
         """
@@ -143,7 +162,7 @@ class RectKey(Key, RectKeyCommon, DwellProgress):
         self._requested_image_size = {}
 
     def invalidate_shadow(self):
-        self._shadow_surface = None
+        self._shadow = None
 
     def set_border_rect(self, rect):
         """
@@ -155,21 +174,143 @@ class RectKey(Key, RectKeyCommon, DwellProgress):
             self.invalidate_caches()
 
     def draw_cached(self, cr):
-        key = (self.label, self.font_size >> 8)
-        entry = self._key_surfaces.get(key)
-        if entry is None:
-            if self.font_size:
-                entry = self._create_key_surface(cr)
-                self._key_surfaces[key] = entry
+        """
+        Paint the shared rendering of the key face,
+        then draw image and label on top.
+        """
+        # Hidden keys and keys with bad size groups may have
+        # font size 0, skip them like draw_label does.
+        if not self.font_size:
+            return
 
-        if entry:
-            surface, rect = entry
-            cr.set_source_surface(surface, rect.x, rect.y)
+        if self._face is None:
+            self._face = self._get_face()
+
+        face_key, clip_rect = self._face
+        surface = self._get_face_surface(cr, face_key, clip_rect)
+        if surface:
+            cr.set_source_surface(surface, clip_rect.x, clip_rect.y)
             cr.paint()
 
-    def _create_key_surface(self, base_context):
+        self.draw_image(cr, LOD.FULL)
+        self.draw_label(cr, LOD.FULL)
+
+    def _get_face_surface(self, cr, face_key, clip_rect):
+        if face_key is None:
+            return None
+        return self._face_cache.get(face_key,
+                            lambda: self._create_face_surface(cr, clip_rect))
+
+    def prerender(self, context, **state):
+        """
+        Render face and shadow into the shared caches without painting
+        them. Keyword arguments temporarily change key attributes,
+        e.g. pressed=True renders the face of the pressed key.
+        """
+        if not self.font_size:
+            return
+
+        saved_state = dict((name, getattr(self, name)) for name in state)
+        for name, value in state.items():
+            setattr(self, name, value)
+        try:
+            face_key, clip_rect = self._get_face()
+            self._get_face_surface(context, face_key, clip_rect)
+        finally:
+            for name, value in saved_state.items():
+                setattr(self, name, value)
+
+        if config.theme_settings.key_shadow_strength:
+            shadow_key, clip_rect = self.get_shadow_key(self._shadow_steps,
+                                                        self._shadow_alpha)
+            self._get_shadow_surface(context, shadow_key)
+
+    def prerender_labels(self, mod_masks):
+        """
+        Measure the labels of other modifier states in advance,
+        update_labels() needs them when modifiers change.
+        """
+        saved_state = (self.label, self.secondary_label, self.ignore_group)
+        for mod_mask in mod_masks:
+            if mod_mask not in self._label_extents:
+                self.configure_label(mod_mask)
+                self.get_label_base_extents(mod_mask)
+        self.label, self.secondary_label, self.ignore_group = saved_state
+
+    def _get_face(self):
         rect = self.get_canvas_rect()
         clip_rect = rect.inflate(*self.get_extra_render_size()).int()
+        if not self.has_face() or \
+           clip_rect.w <= 0 or clip_rect.h <= 0:
+            return None, clip_rect
+        return self.get_face_key(rect, clip_rect), clip_rect
+
+    def get_face_key(self, rect, clip_rect):
+        """
+        Everything the key face depends on. Keys with equal face keys
+        share a single rendering. Positions are relative to clip_rect
+        and snap to fractions of a pixel, so that keys at slightly
+        different subpixel offsets look the same, too.
+        """
+        root = self.get_layout_root()
+        theme_settings = config.theme_settings
+        return self._get_shape_key(rect, clip_rect) + \
+               (self.get_style(),
+                self.show_face, self.show_border,
+                self.pressed,
+                self.id == "SPCE",   # dish style, convex space bar
+                tuple(self.get_fill_color()),
+                tuple(self.get_stroke_color()),
+                self.get_stroke_width(),
+                self.get_stroke_gradient(),
+                self.get_light_direction(),
+                tuple(root.context.scale_log_to_canvas((1.0, 1.0))),
+                theme_settings.key_fill_gradient,
+                theme_settings.key_size,
+               )
+
+    def _get_shape_key(self, rect, clip_rect):
+        """
+        Position, size and outline of the key relative to clip_rect,
+        snapped to fractions of a pixel.
+        """
+        q = self._FACE_KEY_RESOLUTION
+        x0 = rect.x - clip_rect.x
+        y0 = rect.y - clip_rect.y
+
+        shape = None
+        if self.geometry:
+            shape = []
+            for op, coords in self.get_canvas_path().segments:
+                shape.append((op, tuple(
+                    int(round((c - (rect.x if i % 2 == 0 else rect.y)) * q))
+                    for i, c in enumerate(coords))))
+            shape = tuple(shape)
+
+        return (int(round(x0 * q)), int(round(y0 * q)),
+                int(round(rect.w * q)), int(round(rect.h * q)),
+                clip_rect.w, clip_rect.h,
+                shape,
+                round(self.get_chamfer_size(), 3),
+                tuple(self.context.scale_log_to_canvas((1.0, 1.0))),
+                config.theme_settings.roundrect_radius,
+               )
+
+    def _get_snap_offset(self, rect, clip_rect):
+        """
+        Translation that moves rect to its snapped position
+        relative to clip_rect, see _get_shape_key().
+        """
+        q = self._FACE_KEY_RESOLUTION
+        dx = round((rect.x - clip_rect.x) * q) / q - rect.x
+        dy = round((rect.y - clip_rect.y) * q) / q - rect.y
+        return dx, dy
+
+    def _create_face_surface(self, base_context, clip_rect):
+        # Place the face at its snapped offset, where all keys
+        # sharing this face expect it.
+        rect = self.get_canvas_rect()
+        dx, dy = self._get_snap_offset(rect, clip_rect)
 
         # create caching surface
         target = base_context.get_target()
@@ -178,20 +319,30 @@ class RectKey(Key, RectKeyCommon, DwellProgress):
         cr = cairo.Context(surface)
 
         cr.save()
-        cr.translate(-clip_rect.x, -clip_rect.y)
-        self.draw(cr)
+        cr.translate(dx, dy)
+        self.draw_face(cr, LOD.FULL)
         cr.restore()
 
         Gdk.flush()   # else artefacts in labels and images
                       # on Nexus 7, Raring
 
-        return surface, clip_rect
+        return surface, \
+               SurfaceCache.get_surface_size(clip_rect.w, clip_rect.h)
 
     def draw(self, cr, lod = LOD.FULL):
-        self.draw_geometry(cr, lod)
+        if self.has_face():
+            self.draw_face(cr, lod)
         self.draw_image(cr, lod)
         self.draw_label(cr, lod)
 
+    def has_face(self):
+        """ Is there a key background to draw? """
+        return self.show_face or self.show_border
+
+    def draw_face(self, cr, lod):
+        """ Draw the key background, without image and label. """
+        self.draw_geometry(cr, lod)
+
     def draw_geometry(self, cr, lod):
         if not self.show_face and not self.show_border:
             return
@@ -638,26 +789,47 @@ class RectKey(Key, RectKeyCommon, DwellProgress):
             pixbuf.draw(context, rect.offset(xalign + dx, yalign + dy), rgba)
 
     def draw_shadow_cached(self, context):
-        entry = self._shadow_surface
-        if entry is None:
-            if config.theme_settings.key_shadow_strength:
-                entry = self.create_shadow_surface(context,
-                                              self._shadow_steps,
-                                              self._shadow_alpha)
-                self._shadow_surface = entry
-
-        if entry:
-            surface, rect = entry
+        """
+        Paint the shadow mask, shared with all keys
+        of the same shape and size.
+        """
+        if not config.theme_settings.key_shadow_strength:
+            return
+
+        if self._shadow is None:
+            self._shadow = self.get_shadow_key(self._shadow_steps,
+                                               self._shadow_alpha)
+
+        shadow_key, clip_rect = self._shadow
+        surface = self._get_shadow_surface(context, shadow_key)
+        if surface:
             context.set_source_rgba(0.0, 0.0, 0.0, 1.0)
-            context.mask_surface(surface, rect.x, rect.y)
+            context.mask_surface(surface, clip_rect.x, clip_rect.y)
 
-    def create_shadow_surface(self, base_context, shadow_steps, shadow_alpha):
+    def _get_shadow_surface(self, context, shadow_key):
+        if shadow_key is None:
+            return None
+        return self._shadow_cache.get(shadow_key,
+                      lambda: self._create_cached_shadow_surface(
+                                  context,
+                                  self._shadow_steps,
+                                  self._shadow_alpha))
+
+    def get_shadow_key(self, shadow_steps, shadow_alpha):
         """
-        Draw shadow and shaded halo.
-        Somewhat slow, make sure to cache the result.
-        Glitchy, if the clip-rect covers only a single button (Precise),
-        therefore, draw only with unrestricted clipping rect.
+        Everything the shadow mask depends on, and its clip rect.
+        Keys with equal shadow keys share a single shadow mask.
         """
+        params = self._get_shadow_params(shadow_steps, shadow_alpha)
+        if params is None:
+            return None, None
+
+        rect, clip_rect = params[:2]
+        return self._get_shape_key(rect, clip_rect) + \
+               (shadow_steps,) + params[2:], \
+               clip_rect
+
+    def _get_shadow_params(self, shadow_steps, shadow_alpha):
         rect = self.get_canvas_rect()
         root = self.get_layout_root()
 
@@ -686,43 +858,84 @@ class RectKey(Key, RectKeyCommon, DwellProgress):
             clip_rect = clip_rect.inflate(shadow_radius * 1.3)
         clip_rect = clip_rect.int()
 
-        # create caching surface
-        target = base_context.get_target()
-        surface = target.create_similar(cairo.CONTENT_ALPHA,
-                                        clip_rect.w, clip_rect.h)
-        context = cairo.Context(surface)
+        return (rect, clip_rect,
+                shadow_opacity, shadow_radius, shadow_offset,
+                has_halo, halo_opacity, halo_radius)
 
-        # paint the surface
-        context.save()
-        context.translate(-clip_rect.x, -clip_rect.y)
+    def _create_cached_shadow_surface(self, base_context,
+                                      shadow_steps, shadow_alpha):
+        entry = self.create_shadow_surface(base_context,
+                                           shadow_steps, shadow_alpha)
+        if entry is None:
+            return None
+        surface, clip_rect = entry
+        return surface, \
+               SurfaceCache.get_surface_size(clip_rect.w, clip_rect.h, 1)
 
-        context.rectangle(*clip_rect)
-        context.clip()
+    def create_shadow_surface(self, base_context, shadow_steps, shadow_alpha):
+        """
+        Draw shadow and shaded halo.
+        The key shape is blurred with separable box blurs, at a cost
+        that depends on the surface size, but not the blur radius.
+        Still, make sure to cache the result.
+        """
+        params = self._get_shadow_params(shadow_steps, shadow_alpha)
+        if params is None:
+            return None
 
-        context.push_group_with_content(cairo.CONTENT_ALPHA)
-        self._build_canvas_path(context, rect)
-        context.set_source_rgba(0.0, 0.0, 0.0, 1.0)
-        context.fill()
-        shape = context.pop_group()
+        rect, clip_rect, \
+        shadow_opacity, shadow_radius, shadow_offset, \
+        has_halo, halo_opacity, halo_radius = params
+
+        # Place the key at its snapped offset, where all keys
+        # sharing this shadow expect it.
+        snap_offset = self._get_snap_offset(rect, clip_rect)
 
         # shadow
-        drop_shadow(context, shape, rect,
-                    shadow_radius, shadow_offset, shadow_opacity, shadow_steps)
+        surface = self._create_blurred_shape(rect, clip_rect, snap_offset,
+                                             shadow_offset, shadow_opacity,
+                                             shadow_radius, shadow_steps)
+        context = cairo.Context(surface)
+
         # halo
         if has_halo:
-            drop_shadow(context, shape, rect,
-                        halo_radius, shadow_offset, halo_opacity, shadow_steps)
+            halo = self._create_blurred_shape(rect, clip_rect, snap_offset,
+                                              shadow_offset, halo_opacity,
+                                              halo_radius, shadow_steps)
+            context.set_source_surface(halo, 0, 0)
+            context.paint()
 
         # cut out the key area, the key may be transparent
+        context.translate(*snap_offset)
         context.set_operator(cairo.OPERATOR_CLEAR)
         context.set_source_rgba(0.0, 0.0, 0.0, 1.0)
         self._build_canvas_path(context, rect)
         context.fill()
 
-        context.restore()
-
+        surface.flush()
         return surface, clip_rect
 
+    def _create_blurred_shape(self, rect, clip_rect, snap_offset, offset,
+                              opacity, blur_radius, steps):
+        """
+        Alpha mask of the key shape, displaced by offset and blurred
+        in as many box blur passes as there are steps. The shape is as
+        opaque as the stacked masks of drop_shadow() with the same
+        number of steps and opacity.
+        """
+        surface = cairo.ImageSurface(cairo.FORMAT_A8,
+                                     clip_rect.w, clip_rect.h)
+        context = cairo.Context(surface)
+        context.translate(snap_offset[0] + offset[0],
+                          snap_offset[1] + offset[1])
+        self._build_canvas_path(context, rect)
+        context.set_source_rgba(0.0, 0.0, 0.0,
+                                1.0 - (1.0 - opacity) ** steps)
+        context.fill()
+
+        blur_image_surface(surface, blur_radius / 2.0, steps)
+        return surface
+
     def _build_canvas_path(self, cr, rect = None, path = None):
         """ Build cairo path of the key geometry. """
         if self.geometry:
@@ -965,12 +1178,9 @@ class BarKey(FullSizeKey):
     def __init__(self, id = "", border_rect = None):
         super(BarKey, self).__init__(id, border_rect)
 
-    def draw(self, context, lod = LOD.FULL):
+    def has_face(self):
         # draw only when pressed, to blend in with the word list bar
-        if self.pressed or self.active or self.scanned:
-            self.draw_geometry(context, lod)
-        self.draw_image(context, lod)
-        self.draw_label(context, lod)
+        return self.pressed or self.active or self.scanned
 
     def can_show_label_popup(self):
         return False
@@ -56,6 +56,7 @@ from Onboard.AutoShow              import AutoShow
 from Onboard.AutoHide              import AutoHide
 from Onboard.WordSuggestions       import WordSuggestions
 from Onboard.canonical_equivalents import canonical_equivalents
+from Onboard.LatencyTrace          import LatencyTrace, Stage
 
 import Onboard.osk as osk
 
@@ -1062,6 +1063,7 @@ class Keyboard(WordSuggestions):
         """ Does key actually insert any characters (not a navigation key)? """
         return key and key.is_text_changing()
 
+    @LatencyTrace.traced(Stage.KEY_SYNTH)
     def key_down(self, key, view=None, sequence=None, action=True):
         """
         Press down on one of Onboard's key representations.
@@ -1123,6 +1125,7 @@ class Keyboard(WordSuggestions):
             if key not in self._pressed_keys:
                 self._pressed_keys.append(key)
 
+    @LatencyTrace.traced(Stage.KEY_SYNTH)
     def key_up(self, key, view=None, sequence=None, action=True):
         """ Release one of Onboard's key representations. """
         if sequence:
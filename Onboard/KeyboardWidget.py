@@ -397,7 +397,7 @@ class KeyboardWidget(Gtk.DrawingArea, WindowManipulatorAspectRatio,
         """ Override deprecated Gtk function of the same name """
         if self._opacity != opacity:
             self._opacity = opacity
-            self.redraw()
+            self.redraw(damage_backings=False)  # applied when blitting
 
     def get_opacity(self):
         """ Override deprecated Gtk function of the same name """
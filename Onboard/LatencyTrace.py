@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2026 marmuta <marmvta@gmail.com>
+#
+# This file is part of Onboard.
+#
+# Onboard is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Onboard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Opt-in tracing of keystroke latencies.
+
+Each keystroke starts with an input event and ends with the next
+redraw of the keyboard. The time spent in the stages in between is
+collected into histograms and, optionally, written as Chrome trace
+JSON, viewable in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from functools import wraps
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """ Traced stages of a keystroke """
+    INPUT         = "input"
+    KEY_SYNTH     = "key-synthesis"
+    TEXT_CONTEXT  = "text-context"
+    PREDICT       = "predict"
+    SPELL_CHECK   = "spell-check"
+    REDRAW        = "redraw"
+    KEYSTROKE     = "keystroke"     # input to end of the next redraw
+
+    # report order
+    ALL = [KEYSTROKE, INPUT, KEY_SYNTH, TEXT_CONTEXT,
+           PREDICT, SPELL_CHECK, REDRAW]
+
+
+class LatencyHistogram(object):
+    """
+    Durations in exponentially growing buckets of milliseconds.
+
+    Doctests:
+    >>> h = LatencyHistogram()
+    >>> for ms in [0.1, 0.7, 0.9, 3.0, 5000.0]:
+    ...     h.add(ms)
+    >>> h.count, h.max
+    (5, 5000.0)
+    >>> [n for n in h.buckets if n]
+    [1, 2, 1, 1]
+    >>> h.get_bucket_index(0.25), h.get_bucket_index(0.26)
+    (0, 1)
+    >>> print(h.format("predict"))
+    predict: count=5 mean=1000.94ms max=5000.00ms
+        <=    0.25ms      1  20.0%  ####
+        <=    1.00ms      2  40.0%  ########
+        <=    4.00ms      1  20.0%  ####
+         > 1024.00ms      1  20.0%  ####
+    """
+
+    # upper bounds of the buckets in ms, the last bucket is open ended
+    BOUNDS = [0.25 * 2**i for i in range(13)]     # up to 1024ms
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.buckets[self.get_bucket_index(ms)] += 1
+        self.count += 1
+        self.sum += ms
+        self.max = max(self.max, ms)
+
+    def get_bucket_index(self, ms):
+        for i, bound in enumerate(self.BOUNDS):
+            if ms <= bound:
+                return i
+        return len(self.BOUNDS)
+
+    def get_mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def format(self, name, bar_width=20):
+        lines = ["{}: count={} mean={:.2f}ms max={:.2f}ms"
+                 .format(name, self.count, self.get_mean(), self.max)]
+        for i, n in enumerate(self.buckets):
+            if n:
+                if i < len(self.BOUNDS):
+                    bound = "<={:8.2f}ms".format(self.BOUNDS[i])
+                else:
+                    bound = " >{:8.2f}ms".format(self.BOUNDS[-1])
+                fraction = n / self.count
+                lines.append("    {} {:6} {:5.1f}%  {}"
+                             .format(bound, n, fraction * 100,
+                                     "#" * int(round(fraction * bar_width))))
+        return "\n".join(lines)
+
+
+class _NoTrace(object):
+    """ Do-nothing context manager while tracing is disabled. """
+    def __enter__(self):
+        pass
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+_no_trace = _NoTrace()
+
+
+class _StageTrace(object):
+    """ Context manager timing a single stage. """
+    def __init__(self, trace, stage):
+        self._trace = trace
+        self._stage = stage
+        self._begin = 0.0
+
+    def __enter__(self):
+        self._begin = time.perf_counter()
+
+    def __exit__(self, type, value, traceback):
+        self._trace.add_stage(self._stage, self._begin,
+                              time.perf_counter())
+        return False
+
+
+class LatencyTrace(object):
+    """
+    Singleton collecting per-stage timings of keystrokes.
+
+    Tracing is off by default and costs next to nothing then. Use
+    stage() or the traced() decorator to time a stage, and
+    begin_keystroke() when an input event starts a new keystroke.
+    """
+
+    # Limit the memory use of long running traces,
+    # the oldest trace events are dropped first.
+    MAX_TRACE_EVENTS = 200000
+
+    def __new__(cls, *args, **kwargs):
+        """
+        Singleton magic.
+        """
+        if not hasattr(cls, "self"):
+            cls.self = object.__new__(cls, *args, **kwargs)
+            cls.self.construct()
+        return cls.self
+
+    def __init__(self):
+        """
+        Called multiple times, do not use.
+        """
+        pass
+
+    def construct(self):
+        self.enabled = False
+        self._filename = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._reset()
+
+    def _reset(self):
+        self._histograms = {}
+        self._events = deque(maxlen=self.MAX_TRACE_EVENTS)
+        self._keystroke_id = 0
+        self._keystroke_begin = None    # begin time of pending keystroke
+
+    def enable(self, filename=None):
+        """
+        Start tracing. With filename, the Chrome trace is written there
+        on save(), and the histograms to filename + ".hist".
+        """
+        with self._lock:
+            self._reset()
+            self._filename = filename
+            self.enabled = True
+        _logger.info("latency tracing enabled, trace file '{}'"
+                     .format(filename))
+
+    def disable(self):
+        self.enabled = False
+
+    def stage(self, stage):
+        """
+        Context manager timing the code in its with-block.
+        """
+        if not self.enabled:
+            return _no_trace
+        return _StageTrace(self, stage)
+
+    @staticmethod
+    def traced(stage):
+        """
+        Decorator timing each call of a function or method.
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                trace = LatencyTrace()
+                if not trace.enabled:
+                    return func(*args, **kwargs)
+                with _StageTrace(trace, stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def begin_keystroke(self):
+        """
+        An input event starts a new keystroke. A previous keystroke
+        that hasn't seen a redraw yet is abandoned.
+        """
+        if self.enabled:
+            with self._lock:
+                self._keystroke_id += 1
+                self._keystroke_begin = time.perf_counter()
+
+    def add_stage(self, stage, begin, end):
+        """
+        Record a stage, times in seconds as returned by
+        time.perf_counter(), which clock adjustments don't affect.
+        """
+        with self._lock:
+            if not self.enabled:
+                return
+            self._add_duration(stage, begin, end)
+
+            # The first redraw completes the keystroke.
+            if stage == Stage.REDRAW and \
+               self._keystroke_begin is not None:
+                self._add_duration(Stage.KEYSTROKE,
+                                   self._keystroke_begin, end)
+                self._keystroke_begin = None
+
+    def _add_duration(self, stage, begin, end):
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self._histograms[stage] = histogram
+        histogram.add((end - begin) * 1000.0)
+
+        if self._filename:
+            self._events.append({"name" : stage,
+                                 "cat" : "latency",
+                                 "ph" : "X",
+                                 "ts" : int(begin * 1e6),
+                                 "dur" : int((end - begin) * 1e6),
+                                 "pid" : self._pid,
+                                 "tid" : threading.current_thread().ident,
+                                 "args" : {"keystroke" : self._keystroke_id},
+                                 })
+
+    def get_histograms(self):
+        with self._lock:
+            return dict(self._histograms)
+
+    def format_histograms(self):
+        """ Histograms of all stages as text. """
+        histograms = self.get_histograms()
+        names = [name for name in Stage.ALL if name in histograms]
+        return "\n\n".join(histograms[name].format(name) for name in names)
+
+    def save(self):
+        """ Write trace and histogram files. """
+        if not self.enabled or not self._filename:
+            return
+
+        with self._lock:
+            events = list(self._events)
+
+        hist_filename = self._filename + ".hist"
+        try:
+            with open(self._filename, "w") as f:
+                json.dump({"traceEvents" : events,
+                           "displayTimeUnit" : "ms"}, f)
+            with open(hist_filename, "w") as f:
+                f.write(self.format_histograms() + "\n")
+        except (IOError, OSError) as ex:
+            _logger.error("failed to write latency trace: {}"
+                          .format(ex))
+        else:
+            _logger.info("wrote latency trace '{}' and histograms '{}'"
+                         .format(self._filename, hist_filename))
@@ -161,6 +161,7 @@ class LayoutRoot:
     """
     def __init__(self, item):
         self.__dict__['_item'] = item    # item to decorate
+        self.__dict__['_visible_layer_ids'] = None
         self.invalidate_caches()
         self.init_chamfer_sizes()
 
@@ -212,6 +213,11 @@ class LayoutRoot:
         """
         self.invalidate_caches()
         self._item.set_visible_layers(layer_ids)
+        self.__dict__['_visible_layer_ids'] = tuple(layer_ids)
+
+    def get_visible_layer_ids(self):
+        """ Layers shown by the last call to set_visible_layers. """
+        return self._visible_layer_ids
 
     def set_item_visible(self, item, visible):
         if item.visible != visible:
@@ -22,21 +22,24 @@
 from __future__ import division, print_function, unicode_literals
 
 import time
-from math import pi
+from math import pi, floor, ceil
 
 import cairo
 from Onboard.Version import require_gi_versions
 require_gi_versions()
 from gi.repository         import Gtk, Gdk, GdkPixbuf
 
-from Onboard.utils         import Rect, \
+from Onboard.utils         import Rect, Modifiers, \
                                   roundrect_arc, roundrect_curve, \
                                   gradient_line, brighten, \
                                   unicode_str
 from Onboard.WindowUtils   import get_monitor_dimensions
-from Onboard.KeyGtk        import Key
+from Onboard.SurfaceCache  import SurfaceCache
+from Onboard.Timer         import IdleTimer
+from Onboard.KeyGtk        import Key, RectKey
 from Onboard.KeyCommon     import LOD
 from Onboard.definitions   import UIMask
+from Onboard.LatencyTrace  import LatencyTrace, Stage
 
 
 ### Logging ###
@@ -49,11 +52,33 @@ from Onboard.Config import Config
 config = Config()
 ########################
 
+class LayerBacking(object):
+    """
+    Composited layer backgrounds, shadows and idle keys for one
+    combination of visible layers and modifier state. Pressed,
+    latched, locked, scanned and dwelling keys are left out and
+    painted on top when exposing.
+    """
+    def __init__(self, surface, serial):
+        self.surface = surface
+        self.serial = serial        # damage log position it is current with
+        self.dynamic_keys = set()   # keys left out of the surface
+
+
 class LayoutView:
     """
     Viewer for a tree of layout items.
     """
 
+    # Rects redrawn since the oldest backing was rendered. Backings
+    # lagging further behind are rendered again in full.
+    MAX_BACKING_DAMAGE = 256
+
+    # Modifier states whose labels are measured ahead of time.
+    PRERENDER_MOD_MASKS = (0, Modifiers.SHIFT, Modifiers.CAPS,
+                           Modifiers.ALTGR, Modifiers.SHIFT | Modifiers.ALTGR)
+    PRERENDER_SLICE = 0.005   # max. time per idle callback [s]
+
     def __init__(self, keyboard):
         self.keyboard = keyboard
         self.supports_alpha = False
@@ -66,6 +91,15 @@ class LayoutView:
         self._starting_up = True
         self._keys_pre_rendered = False
 
+        self._backings = SurfaceCache("layer backings", 32 * 1024 * 1024)
+        self._backing_layout = None
+        self._backing_damage = []       # damaged canvas rects, oldest first
+        self._backing_damage_base = 0   # serial of _backing_damage[0]
+
+        self._prerender_timer = IdleTimer()
+        self._prerender_jobs = None
+        self._prerender_pending = True  # start after the next full frame
+
         self.keyboard.register_view(self)
 
     def cleanup(self):
@@ -74,6 +108,8 @@ class LayoutView:
         # free xserver memory
         self.invalidate_keys()
         self.invalidate_shadows()
+        self._backing_layout = None
+        self.stop_prerendering()
 
     def handle_realize_event(self):
         self.update_touch_input_mode()
@@ -82,6 +118,7 @@ class LayoutView:
     def on_layout_loaded(self):
         """ Layout has been loaded. """
         self.invalidate_shadow_quality()
+        self.invalidate_backings()
 
     def get_layout(self):
         return self.keyboard.layout
@@ -102,16 +139,21 @@ class LayoutView:
         Update font_sizes at the next possible chance.
         """
         self._font_sizes_valid = False
+        self.invalidate_backings()
 
     def invalidate_keys(self):
         """
-        Clear cached key surfaces, e.g. after resizing,
-        change of theme settings.
+        Have keys look up their cached faces again, e.g. after
+        resizing, change of theme settings.
         """
         layout = self.get_layout()
         if layout:
             for item in layout.iter_keys():
                 item.invalidate_key()
+        self.invalidate_backings()
+
+        # Key faces are shared, they stay cached until evicted.
+        _logger.debug(RectKey.get_face_cache().format_stats())
 
     def invalidate_images(self):
         """
@@ -121,6 +163,7 @@ class LayoutView:
         if layout:
             for item in layout.iter_keys():
                 item.invalidate_image()
+        self.invalidate_backings()
 
     def invalidate_shadows(self):
         """
@@ -131,6 +174,10 @@ class LayoutView:
         if layout:
             for item in layout.iter_keys():
                 item.invalidate_shadow()
+        self.invalidate_backings()
+
+        # Shadow masks are shared, they stay cached until evicted.
+        _logger.debug(RectKey.get_shadow_cache().format_stats())
 
     def invalidate_shadow_quality(self):
         self._shadow_quality_valid = False
@@ -144,6 +191,20 @@ class LayoutView:
         if layout:
             for item in layout.iter_keys():
                 item.invalidate_label_extents()
+        self.invalidate_backings()
+
+    def invalidate_backings(self):
+        """
+        Discard the composited layer surfaces, e.g. when all keys
+        have to be rendered again.
+        """
+        self._backings.clear()
+        self._backing_damage_base += len(self._backing_damage)
+        self._backing_damage = []
+
+        # cached key surfaces are likely outdated too
+        self.stop_prerendering()
+        self._prerender_pending = True
 
     def reset_lod(self):
         """ Reset to full level of detail """
@@ -166,11 +227,19 @@ class LayoutView:
     def raise_to_top(self):
         pass
 
-    def redraw(self, items=None, invalidate=True):
+    def redraw(self, items=None, invalidate=True, damage_backings=True):
         """
         Queue redrawing for individual keys or the whole keyboard.
+        Without damage_backings, only the composition of the cached
+        layer surfaces changed, e.g. the window's opacity.
         """
         if items is None:
+            # Keys may have changed anywhere, e.g. suggestions
+            # updated along with the visible layers.
+            if damage_backings:
+                self._add_backing_damage(
+                    Rect(0, 0, self.get_allocated_width(),
+                               self.get_allocated_height()))
             self.queue_draw()
 
         elif len(items) == 0:
@@ -193,10 +262,15 @@ class LayoutView:
                 extra_size = items[0].get_extra_render_size()
                 area = area.inflate(*extra_size)
 
+            if damage_backings:
+                self._add_backing_damage(area)
+
             self.queue_draw_area(*area)
 
     def redraw_labels(self, invalidate=True):
-        self.redraw(self.update_labels(), invalidate)
+        # Labels follow the modifier state, which has its own
+        # backings. No need to render the relabeled keys into them.
+        self.redraw(self.update_labels(), invalidate, False)
 
     def update_transparency(self):
         pass
@@ -270,6 +344,7 @@ class LayoutView:
         return (lod == LOD.FULL) and \
                (not self._starting_up or self._keys_pre_rendered)
 
+    @LatencyTrace.traced(Stage.REDRAW)
     def draw(self, widget, context):
         if not Gtk.cairo_should_draw_window(context, widget.get_window()):
             return
@@ -290,6 +365,97 @@ class LayoutView:
         if not layout:
             return
 
+        backing = None
+        if draw_cached:
+            backing = self._get_backing(context, decorated)
+
+        if backing:
+            # blit idle keys, paint the remaining ones on top
+            context.set_source_surface(backing.surface, 0, 0)
+            context.paint()
+            for key in backing.dynamic_keys:
+                if draw_rect.intersects(key.get_canvas_border_rect()):
+                    key.draw_cached(context)
+        else:
+            self._draw_layers(context, draw_rect, decorated, lod, draw_cached)
+
+        self._starting_up = False
+
+        if self._prerender_pending and draw_cached:
+            self.start_prerendering()
+
+        return decorated
+
+    def start_prerendering(self):
+        """
+        Warm the key caches for all layers and common modifier states
+        while the main loop is idle, so that switching layers or
+        pressing shift doesn't have to wait for rendering.
+        """
+        self._prerender_pending = False
+        self._prerender_jobs = self._iter_prerender_jobs()
+        self._prerender_timer.start(callback=self._on_prerender_idle)
+
+    def stop_prerendering(self):
+        self._prerender_timer.stop()
+        self._prerender_jobs = None
+
+    def _on_prerender_idle(self):
+        """ Run pre-rendering jobs until input arrives or time is up. """
+        window = self.get_window()
+        if not window or self._prerender_jobs is None:
+            self._prerender_jobs = None
+            return False
+
+        context = window.cairo_create()
+        begin = time.time()
+        for job in self._prerender_jobs:
+            job(context)
+            if time.time() - begin > self.PRERENDER_SLICE or \
+               Gtk.events_pending():
+                return True
+
+        _logger.debug("Pre-rendering done. " +
+                      RectKey.get_face_cache().format_stats())
+        self._prerender_jobs = None
+        return False
+
+    def _iter_prerender_jobs(self):
+        """
+        Generate small rendering jobs, one per key and cache, visible
+        layers first.
+        """
+        layout = self.get_layout()
+        if not layout:
+            return
+
+        layer_ids = list(layout.get_layer_ids())
+        visible_layer_ids = layout.get_visible_layer_ids() or ()
+        layer_ids.sort(key=lambda layer_id: layer_id not in visible_layer_ids)
+        mod_masks = self.PRERENDER_MOD_MASKS
+
+        for layer_id in [None] + layer_ids:
+            keys = [item for item in layout.iter_layer_items(layer_id, False)
+                    if item.is_key() and item.visible]
+            for key in keys:
+                yield key.prerender
+                yield lambda context, key=key: \
+                    key.prerender(context, pressed=True)
+                if key.is_modifier() or key.is_layer_button():
+                    yield lambda context, key=key: \
+                        key.prerender(context, active=True)
+                yield lambda context, key=key: \
+                    key.prerender_labels(mod_masks)
+
+    def _draw_layers(self, context, draw_rect, decorated, lod, draw_cached,
+                     dynamic_keys = None):
+        """
+        Draw layer backgrounds, shadows and keys. If dynamic_keys is
+        given, collect keys in changing states there instead of
+        drawing them.
+        """
+        layout = self.get_layout()
+
         # draw layer 0 and None-layer background
         layer_ids = layout.get_layer_ids()
         if config.window.transparent_background:
@@ -312,14 +478,107 @@ class LayoutView:
             # draw key
             if item.is_key() and \
                draw_rect.intersects(item.get_canvas_border_rect()):
+                if dynamic_keys is not None:
+                    if self._is_dynamic_key(item):
+                        dynamic_keys.add(item)
+                        continue
                 if draw_cached:
                     item.draw_cached(context)
                 else:
                     item.draw(context, lod)
 
-        self._starting_up = False
-
-        return decorated
+    @staticmethod
+    def _is_dynamic_key(key):
+        """ Is the key in a state that is likely to change soon? """
+        return key.pressed or key.active or key.locked or key.scanned or \
+               key.is_dwelling()
+
+    def _add_backing_damage(self, rect):
+        """ Have all backings render rect again before their next use. """
+        damage = self._backing_damage
+        damage.append(rect)
+        excess = len(damage) - self.MAX_BACKING_DAMAGE
+        if excess > 0:
+            del damage[:excess]
+            self._backing_damage_base += excess
+
+    def _get_backing(self, context, decorated):
+        """
+        Composited layers for the visible layers and the current
+        modifier state, updated with all damage since their last use.
+        """
+        layout = self.get_layout()
+        if layout is not self._backing_layout:
+            self.invalidate_backings()
+            self._backing_layout = layout
+
+        w = self.get_allocated_width()
+        h = self.get_allocated_height()
+        if w <= 0 or h <= 0:
+            return None
+
+        backing_key = (layout.get_visible_layer_ids(),
+                       self.keyboard.get_mod_mask(),
+                       decorated,
+                       config.window.transparent_background,
+                       tuple(self.get_background_rgba()),
+                       w, h)
+        backing = self._backings.get(backing_key,
+                      lambda: self._create_backing(context, w, h))
+        if backing is None:
+            return None
+
+        # keys that went idle without being redrawn
+        for key in backing.dynamic_keys:
+            if not self._is_dynamic_key(key):
+                self._add_backing_damage(key.get_canvas_border_rect()
+                            .inflate(*key.get_extra_render_size()))
+
+        base = self._backing_damage_base
+        serial = base + len(self._backing_damage)
+        if backing.serial < base:
+            self._render_backing(backing, [Rect(0, 0, w, h)], decorated)
+        else:
+            rects = []
+            for rect in self._backing_damage[backing.serial - base:]:
+                if rect not in rects:
+                    rects.append(rect)
+            self._render_backing(backing, rects, decorated)
+        backing.serial = serial
+
+        return backing
+
+    def _create_backing(self, context, w, h):
+        target = context.get_target()
+        surface = target.create_similar(cairo.CONTENT_COLOR_ALPHA, w, h)
+
+        # Start out lagging behind all damage, i.e. render in full.
+        backing = LayerBacking(surface, -1)
+        return backing, SurfaceCache.get_surface_size(w, h)
+
+    def _render_backing(self, backing, rects, decorated):
+        """ Render the given canvas rects of the backing again. """
+        for rect in rects:
+            # forget about keys that are drawn again
+            backing.dynamic_keys = set(key for key in backing.dynamic_keys
+                if not rect.intersects(key.get_canvas_border_rect()))
+
+            # clip to whole pixels, or partially cleared
+            # pixels would leave seams
+            clip_rect = Rect.from_extents(floor(rect.left()),
+                                          floor(rect.top()),
+                                          ceil(rect.right()),
+                                          ceil(rect.bottom()))
+            cr = cairo.Context(backing.surface)
+            cr.rectangle(*clip_rect)
+            cr.clip()
+            cr.set_operator(cairo.OPERATOR_CLEAR)
+            cr.paint()
+            cr.set_operator(cairo.OPERATOR_OVER)
+
+            draw_rect = self.get_damage_rect(cr)
+            self._draw_layers(cr, draw_rect, decorated, LOD.FULL, True,
+                              backing.dynamic_keys)
 
     def _draw_background(self, context, lod):
         """ Draw keyboard background """
@@ -625,7 +884,6 @@ class LayoutView:
         keys = None
         for layer_id in layout.get_layer_ids():
             layer_keys = list(layout.iter_layer_keys(layer_id))
-            num_first_layer_keys = len(layer_keys)
             keys = layer_keys[:max_probe_keys]
             break
 
@@ -635,7 +893,12 @@ class LayoutView:
                 for key in keys:
                     key.create_shadow_surface(context, steps, 0.1)
                 elapsed = time.time() - begin
-                estimate = elapsed / len(keys) * num_first_layer_keys
+
+                # Keys of the same shape share their shadow mask,
+                # only unique masks have to be rendered.
+                num_shadows = len(set(key.get_shadow_key(steps, 0.1)[0]
+                                      for key in layer_keys))
+                estimate = elapsed / len(keys) * num_shadows
                 _logger.debug("Probing shadow performance: "
                               "estimated full refresh time {:6.1f}ms "
                               "at quality {}, {} steps." \
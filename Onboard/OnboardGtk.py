@@ -55,6 +55,7 @@ from Onboard.Exceptions      import LayoutFileError
 from Onboard.utils           import unicode_str
 from Onboard.Timer           import CallOnce, Timer
 from Onboard.WindowUtils     import show_confirmation_dialog
+from Onboard.LatencyTrace    import LatencyTrace
 import Onboard.osk as osk
 
 ### Config Singleton ###
@@ -177,6 +178,9 @@ class OnboardGtk(object):
         # finish config initialization
         config.init()
 
+        if config.latency_trace_file:
+            LatencyTrace().enable(config.latency_trace_file)
+
         # Optionally wait a little before proceeding.
         # When the system starts up, the docking strut can be unreliable
         # on Compiz (Yakkety) and the keyboard may end up at unexpected initial
@@ -358,12 +362,22 @@ class OnboardGtk(object):
                                  self.keyboard.on_active_lang_id_changed())
         config.typing_assistance.spell_check_backend_notify_add(lambda x: \
                                  self.keyboard.on_spell_checker_changed())
+        config.typing_assistance.async_spell_check_notify_add(lambda x: \
+                                 self.keyboard.on_spell_checker_changed())
+        config.typing_assistance.spell_check_cache_notify_add(lambda x: \
+                                 self.keyboard.on_spell_checker_changed())
         config.typing_assistance.auto_capitalization_notify_add(lambda x: \
                                  self.keyboard.on_word_suggestions_enabled(x))
         config.word_suggestions.spelling_suggestions_enabled_notify_add(lambda x: \
                                  self.keyboard.on_spell_checker_changed())
         config.word_suggestions.delayed_word_separators_enabled_notify_add(lambda x: \
                                  self.keyboard.on_punctuator_changed())
+        config.word_suggestions.async_prediction_notify_add(lambda x: \
+                                 self.keyboard.on_async_prediction_changed())
+        config.word_suggestions.compact_system_models_notify_add(lambda x: \
+                             self.keyboard.on_compact_system_models_changed())
+        config.word_suggestions.max_user_model_ngrams_notify_add(lambda x: \
+                             self.keyboard.on_max_user_model_ngrams_changed())
         config.word_suggestions.wordlist_buttons_notify_add(
                                  update_ui_no_resize)
 
@@ -769,6 +783,8 @@ class OnboardGtk(object):
     def cleanup(self):
         self._reload_layout_timer.stop()
 
+        LatencyTrace().save()
+
         config.cleanup()
 
         # Make an effort to disconnect all handlers.
@@ -22,11 +22,12 @@ from __future__ import division, print_function, unicode_literals
 
 import os
 import subprocess
-import time
 import re
 import glob
+import threading
 
-from Onboard.utils import unicode_str
+from Onboard.utils import unicode_str, XDGDirs, BackgroundWorker, LRUCache
+from Onboard.LatencyTrace import LatencyTrace, Stage
 
 import Onboard.osk as osk
 
@@ -35,49 +36,180 @@ _logger = logging.getLogger(__name__)
 
 
 class SpellChecker(object):
-    MAX_QUERY_CACHE_SIZE = 100    # max number of cached queries
+    """
+    Spell checker frontend, caches queries of the active backend.
+
+    Doctests:
+    # asynchronous queries are answered in the main thread
+    >>> class Backend(object):
+    ...     def query(self, text):
+    ...         return [[[0, len(text), text], [text + "s"]]]
+    ...     def check(self, text):
+    ...         return [[m.start(), m.end(), m.group()]
+    ...                 for m in re.finditer("[^aeiou\\s]{3,}", text)]
+    ...     def is_running(self):
+    ...         return True
+    ...     def get_active_dict_ids(self):
+    ...         return ["en_US"]
+    >>> answers = []
+    >>> sc = SpellChecker()
+    >>> sc._backend = Backend()
+    >>> sc._update_dict_key()
+    >>> sc._worker = BackgroundWorker(idle_add=lambda func, *args:
+    ...                               answers.append((func, args)))
+    >>> sc._worker.start()
+    >>> sc.find_corrections("tst", 3, lambda: None)
+    (None, [])
+    >>> import time
+    >>> while not answers: time.sleep(0.01)
+    >>> func, args = answers.pop()
+    >>> func(*args)
+    False
+    >>> sc.find_corrections("tst", 3, lambda: None)
+    ([0, 3, 'tst'], ['tsts'])
+
+    # superseded queries are dropped
+    >>> sc.find_corrections("wrd", 3, lambda: None)
+    (None, [])
+    >>> sc.find_corrections("tst", 3, lambda: None)
+    ([0, 3, 'tst'], ['tsts'])
+    >>> sc._worker.stop()
+    >>> _ = [func(*args) for func, args in answers]
+    >>> sc._cache.get(sc._dict_key, "wrd") is None
+    True
+    >>> sc.find_corrections("wrd", 3)
+    ([0, 3, 'wrd'], ['wrds'])
+
+    # batched checks leave out suggestions until they are needed
+    >>> sc.find_incorrect_spans("a smll txt")
+    [[2, 6, 'smll'], [7, 10, 'txt']]
+    >>> sc._cache.get(sc._dict_key, "a smll txt") is None
+    True
+    >>> sc._cache.get(sc._dict_key, "a")
+    []
+    >>> sc.find_incorrect_spans("nyx")
+    [[0, 3, 'nyx']]
+    >>> sc._cache.get(sc._dict_key, "nyx")
+    [[[0, 3, 'nyx'], None]]
+    >>> sc.find_corrections("nyx", 3)
+    ([0, 3, 'nyx'], ['nyxs'])
+    >>> sc.find_incorrect_spans("nyx")
+    [[0, 3, 'nyx']]
+    """
+    MAX_QUERY_CACHE_SIZE = 500    # max number of cached misspellings
+
+    WORDS = re.compile("\S+", re.UNICODE)
 
     def __init__(self, language_db = None):
         self._language_db = language_db
         self._backend = None
-        self._cached_queries = {}
+        self._cache = SpellCheckCache(self.MAX_QUERY_CACHE_SIZE)
+        self._cache_dir = None
+        self._dict_key = None   # cache key of the active dictionaries
 
-    def set_backend(self, backend):
-        """ Switch spell check backend on the fly """
-        if backend is None:
-            if self._backend:
-                self._backend.stop()
-            self._backend = None
+        # The backend may be queried from the worker thread
+        # and the main thread, only one at a time.
+        self._lock = threading.RLock()
+        self._worker = None
+
+    def set_async(self, enable):
+        """
+        Query the backend in a background thread,
+        see find_corrections().
+        """
+        if enable:
+            if not self._worker:
+                self._worker = BackgroundWorker()
+                self._worker.start()
         else:
-            if backend == 0:
-                _class = hunspell
-            else:
-                _class = aspell_cmd
+            if self._worker:
+                self._worker.stop()
+                self._worker = None
 
-            if not self._backend or \
-               not type(self._backend) == _class:
+    def is_async(self):
+        return self._worker is not None
+
+    def set_backend(self, backend):
+        """ Switch spell check backend on the fly """
+        with self._lock:
+            if backend is None:
                 if self._backend:
                     self._backend.stop()
-                self._backend = _class()
+                self._backend = None
+            else:
+                if backend == 0:
+                    _class = hunspell
+                else:
+                    _class = aspell_cmd
 
-        self.invalidate_query_cache()
+                if not self._backend or \
+                   not type(self._backend) == _class:
+                    if self._backend:
+                        self._backend.stop()
+                    self._backend = _class()
+
+        self._update_dict_key()
 
     def set_dict_ids(self, dict_ids):
         success = False
         ids = self._find_matching_dicts(dict_ids)
-        if self._backend and \
-           not ids == self._backend.get_active_dict_ids():
-            self._backend.stop()
-            if ids:
-                self._backend.start(ids)
-                success = True
-            else:
-                _logger.info("No matching dictionaries for '{backend}' {dicts}" \
-                             .format(backend=type(self._backend),
-                                     dicts=dict_ids))
-        self.invalidate_query_cache()
+        with self._lock:
+            if self._backend and \
+               not ids == self._backend.get_active_dict_ids():
+                self._backend.stop()
+                if ids:
+                    self._backend.start(ids)
+                    success = True
+                else:
+                    _logger.info("No matching dictionaries for "
+                                 "'{backend}' {dicts}" \
+                                 .format(backend=type(self._backend),
+                                         dicts=dict_ids))
+        self._update_dict_key()
         return success
 
+    def set_cache_dir(self, path):
+        """
+        Keep correctly spelled words of each set of dictionaries in
+        path, so they don't need to be checked again after restart.
+        None disables the on-disk cache.
+        """
+        if path != self._cache_dir:
+            self.save_cache()
+            self._cache_dir = path
+            self._load_known_words()
+
+    def save_cache(self):
+        """ Save new correctly spelled words to the cache directory. """
+        if self._cache_dir:
+            self._cache.save_known_words(self._cache_dir)
+            _logger.info("spell check cache: {}"
+                         .format(self._cache.get_stats()))
+
+    def _update_dict_key(self):
+        """
+        Results are cached per backend and set of active dictionaries.
+        Nothing is cached without running backend.
+        """
+        key = None
+        backend = self._backend
+        if backend and backend.is_running():
+            dict_ids = backend.get_active_dict_ids()
+            if dict_ids:
+                key = (type(backend).__name__, tuple(dict_ids))
+
+        if key != self._dict_key:
+            self._dict_key = key
+            self._cancel_async_query()
+            self._load_known_words()
+
+    def _load_known_words(self):
+        key = self._dict_key
+        if self._cache_dir and key:
+            with self._lock:
+                dict_files = self._backend.get_dict_files()
+            self._cache.load_known_words(self._cache_dir, key, dict_files)
+
     def _find_matching_dicts(self, dict_ids):
         results = []
         for dict_id in dict_ids:
@@ -115,17 +247,24 @@ class SpellChecker(object):
 
         return result
 
-    def find_corrections(self, word, caret_offset):
+    def find_corrections(self, word, caret_offset, callback = None):
         """
         Return spelling suggestions for word.
         Multiple result sets may be returned, as the spell
         checkers may return more than one result for certain tokens,
         e.g. before and after hyphens.
+
+        With callback in async mode, uncached words are queried in the
+        background and no suggestions are returned for now. Callback is
+        called in the main thread once the result has been cached.
         """
         span = None
         suggestions = []
         if self._backend:
-            results = self.query_cached(word)
+            if callback and self._worker:
+                results = self._query_cached_async(word, callback)
+            else:
+                results = self.query_cached(word)
             # hunspell splits words at underscores and then
             # returns results for multiple sub-words.
             # -> find the sub-word at the current caret offset.
@@ -137,58 +276,332 @@ class SpellChecker(object):
 
         return span, suggestions
 
-    def find_incorrect_spans(self, word):
+    def find_incorrect_spans(self, text):
         """
-        Return misspelled spans (begin- to end-index) inside word.
-        Multiple result sets may be returned, as the spell
-        checkers may return more than one result for certain tokens,
-        e.g. before and after hyphens.
+        Return misspelled spans [begin, end, word] inside text.
+        Text may be a single word or whole sentences. Results are
+        cached per whitespace separated word, uncached words are
+        checked in one batch. Suggestions aren't looked up until
+        find_corrections() asks for them.
         """
         spans = []
         if self._backend:
-            results = self.query_cached(word)
-            # hunspell splits words at underscores and then
-            # returns results for multiple sub-words.
-            # -> find the sub-word at the current caret offset.
-            spans = [result[0] for result in results]
+            key = self._dict_key
+            matches = list(self.WORDS.finditer(text))
+
+            word_results = {}
+            unknown_words = []
+            for match in matches:
+                word = match.group()
+                if word not in word_results:
+                    results = self._cache.get(key, word)
+                    word_results[word] = results
+                    if results is None:
+                        unknown_words.append(word)
+
+            if unknown_words:
+                for word, results in self._check_words(unknown_words):
+                    word_results[word] = results
+                    self._cache.set(key, word, results)
+
+            for match in matches:
+                offset = match.start()
+                for result in word_results[match.group()]:
+                    begin, end, word = result[0]
+                    spans.append([offset + begin, offset + end, word])
         return spans
 
+    def _check_words(self, words):
+        """
+        Check words in one batch, one word per line. Return (word,
+        results) pairs with spans relative to each word and without
+        suggestions.
+        """
+        offsets = []
+        offset = 0
+        for word in words:
+            offsets.append(offset)
+            offset += len(word) + 1
+
+        word_spans = [[] for word in words]
+        i = 0
+        for begin, end, span_word in self.check("\n".join(words)):
+            while i + 1 < len(offsets) and offsets[i + 1] <= begin:
+                i += 1
+            offset = offsets[i]
+            word_spans[i].append([[begin - offset, end - offset, span_word],
+                                  None])
+
+        return zip(words, word_spans)
+
     def query_cached(self, word):
         """
         Return cached query or ask the backend if necessary.
         """
-        query = self._cached_queries.get(word)
-        if query is None:
-            # limit cache size
-            size = len(self._cached_queries)
-            if size >= self.MAX_QUERY_CACHE_SIZE:
-                new_size = size // 2
-
-                _logger.debug("shrinking query cache from {} to {} entries." \
-                              .format(size, new_size))
+        key = self._dict_key
+        results = self._cache.get(key, word)
+        if not self._has_suggestions(results):
+            results = self.query(word)
+            self._cache.set(key, word, results)
+        return results
 
-                # discard the oldest entries
-                queries = sorted(self._cached_queries.items(),
-                                 key = lambda x: x[1][0])
-                self._cached_queries = dict(queries[new_size:])
+    @staticmethod
+    def _has_suggestions(results):
+        """
+        Misspellings found by find_incorrect_spans() come without
+        suggestions, these have to be queried again.
+        """
+        return results is not None and \
+               all(result[1] is not None for result in results)
 
-            # query backend
-            results = self.query(word)
-            query = [0.0, results]
-            self._cached_queries[word] = query
+    def _query_cached_async(self, word, callback):
+        """
+        Return cached query or ask the backend in the worker thread.
+        Only the most recent query is answered, older ones are dropped.
+        """
+        key = self._dict_key
+        results = self._cache.get(key, word)
+        if not self._has_suggestions(results):
+            self._worker.submit_query(
+                lambda: self.query(word),
+                lambda results:
+                    self._on_async_query(key, word, results, callback))
+            return []
+
+        self._cancel_async_query()
+        return results
 
-        query[0] = time.time()
+    def _on_async_query(self, key, word, results, callback):
+        """ Query result arrived in the main thread. """
+        self._cache.set(key, word, results)
+        callback()
 
-        return query[1]
+    def _cancel_async_query(self):
+        if self._worker:
+            self._worker.cancel_queries()
 
+    @LatencyTrace.traced(Stage.SPELL_CHECK)
     def query(self, word):
-        return self._backend.query(word)
+        """ Ask the backend, may run in the worker thread. """
+        with self._lock:
+            if self._backend:
+                return self._backend.query(word)
+        return []
+
+    @LatencyTrace.traced(Stage.SPELL_CHECK)
+    def check(self, text):
+        """ Ask the backend for misspelled spans only. """
+        with self._lock:
+            if self._backend:
+                return self._backend.check(text)
+        return []
 
     def invalidate_query_cache(self):
-        self._cached_queries = {}
+        """
+        Forget all results, words may have been added to or removed
+        from the dictionaries. This includes the on-disk cache.
+        """
+        # drop pending queries, their results may be outdated
+        self._cancel_async_query()
+        self._cache.invalidate()
 
     def get_supported_dict_ids(self):
-        return self._backend.get_supported_dict_ids()
+        with self._lock:
+            return self._backend.get_supported_dict_ids()
+
+    def get_cache_stats(self):
+        return self._cache.get_stats()
+
+
+class SpellCheckCache(object):
+    """
+    Spell check results of multiple sets of dictionaries.
+
+    Queries with spelling errors go into a least recently used cache,
+    suggestions may be None if they weren't requested. Correctly
+    spelled words go into a set of known words per set of dictionaries.
+    Known words can be saved, so common words never reach the backend
+    after warm-up.
+
+    Doctests:
+    >>> c = SpellCheckCache(2)
+    >>> en = ("hunspell", ("en_US",))
+    >>> c.set(en, "test", [])
+    >>> c.set(en, "tst", [[[0, 3, 'tst'], ['test']]])
+    >>> c.get(en, "test")
+    []
+    >>> c.get(en, "tst")
+    [[[0, 3, 'tst'], ['test']]]
+    >>> c.get(("hunspell", ("de_DE",)), "test") is None
+    True
+
+    # known words survive restarts
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> c.save_known_words(d)
+    >>> os.listdir(d)
+    ['hunspell-en_US.words']
+    >>> c = SpellCheckCache(2)
+    >>> c.load_known_words(d, en, [])
+    >>> c.get(en, "test")
+    []
+    >>> c.get_stats()
+    {'hits': 0, 'known_hits': 1, 'misses': 0, 'known_words': 1}
+
+    # invalidation forgets everything, saved words included
+    >>> c.set(en, "tst", [[[0, 3, 'tst'], ['test']]])
+    >>> c.invalidate()
+    >>> c.get(en, "tst") is None
+    True
+    >>> c.get(en, "test") is None
+    True
+    >>> c.save_known_words(d)
+    >>> os.listdir(d)
+    []
+    >>> c.set(en, "test", [])
+    >>> c.save_known_words(d)
+    >>> os.listdir(d)
+    ['hunspell-en_US.words']
+
+    # unless the dictionaries changed since
+    >>> dic = os.path.join(d, "en_US.dic")
+    >>> with open(dic, "w") as f: _ = f.write("")
+    >>> fn = os.path.join(d, "hunspell-en_US.words")
+    >>> os.utime(dic, (os.path.getmtime(fn) + 1,) * 2)
+    >>> c = SpellCheckCache(2)
+    >>> c.load_known_words(d, en, [dic])
+    >>> c.get(en, "test") is None
+    True
+    >>> import shutil; shutil.rmtree(d)
+    """
+    MAX_KNOWN_WORDS = 50000   # per set of dictionaries
+
+    WHITESPACE = re.compile("\s", re.UNICODE)
+
+    def __init__(self, max_size):
+        self._queries = LRUCache(max_size)
+        self._known_words = {}    # key: set of correctly spelled words
+        self._modified_keys = set()
+        self._loaded_keys = set()
+        self._invalidated = False # discard saved words on next save
+        self._hits = 0
+        self._known_hits = 0
+        self._misses = 0
+
+    def get(self, key, word):
+        """ Return cached query results or None. """
+        known_words = self._known_words.get(key)
+        if known_words and word in known_words:
+            self._known_hits += 1
+            return []
+
+        results = self._queries.get((key, word))
+        if results is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return results
+
+    def set(self, key, word, results):
+        if key is None:
+            return
+        if results or self.WHITESPACE.search(word):
+            self._queries.set((key, word), results)
+        else:
+            known_words = self._known_words.setdefault(key, set())
+            if len(known_words) < self.MAX_KNOWN_WORDS:
+                known_words.add(word)
+                self._modified_keys.add(key)
+
+    def invalidate(self):
+        """
+        Forget misspelled and known words of all sets of dictionaries.
+        Saved known words are discarded on the next save.
+        """
+        self._queries.clear()
+        self._known_words = {}
+        self._modified_keys = set()
+        self._invalidated = True
+
+    def get_stats(self):
+        return {"hits" : self._hits,
+                "known_hits" : self._known_hits,
+                "misses" : self._misses,
+                "known_words" : sum(len(words) for words in
+                                    self._known_words.values())}
+
+    def load_known_words(self, path, key, dict_files):
+        """
+        Load correctly spelled words of the dictionaries in key, unless
+        one of dict_files is newer than the cache file.
+        """
+        if key in self._loaded_keys:
+            return
+        self._loaded_keys.add(key)
+
+        filename = self._get_filename(path, key)
+        if not os.path.exists(filename):
+            return
+
+        try:
+            mtime = os.path.getmtime(filename)
+            if any(os.path.getmtime(fn) > mtime
+                   for fn in dict_files if os.path.exists(fn)):
+                _logger.info("discarding outdated spell check cache '{}'"
+                             .format(filename))
+                return
+
+            with open(filename, "rb") as f:
+                words = f.read().decode("UTF-8").split("\n")
+        except (IOError, OSError, UnicodeDecodeError) as ex:
+            _logger.warning("failed to load spell check cache '{}': {}"
+                            .format(filename, unicode_str(ex)))
+            return
+
+        known_words = self._known_words.setdefault(key, set())
+        known_words.update(word for word in
+                           words[:self.MAX_KNOWN_WORDS] if word)
+        _logger.info("loaded {} known words from '{}'"
+                     .format(len(known_words), filename))
+
+    def save_known_words(self, path):
+        """
+        Save known words of all modified sets of dictionaries.
+        After invalidation, saved words of other sets are removed.
+        """
+        if self._invalidated:
+            self._invalidated = False
+            modified = [self._get_filename(path, key)
+                        for key in self._modified_keys]
+            for filename in glob.glob(os.path.join(path, "*.words")):
+                if not filename in modified:
+                    try:
+                        os.remove(filename)
+                    except OSError as ex:
+                        _logger.warning("failed to remove spell check "
+                                        "cache '{}': {}"
+                                        .format(filename, unicode_str(ex)))
+
+        for key in self._modified_keys:
+            words = [word for word in self._known_words[key]
+                     if not "\n" in word]
+            filename = self._get_filename(path, key)
+            tempfile = filename + ".tmp"
+            try:
+                XDGDirs.assure_user_dir_exists(path)
+                with open(tempfile, "wb") as f:
+                    f.write("\n".join(sorted(words)).encode("UTF-8"))
+                os.rename(tempfile, filename)
+            except (IOError, OSError) as ex:
+                _logger.warning("failed to save spell check cache '{}': {}"
+                                .format(filename, unicode_str(ex)))
+        self._modified_keys = set()
+
+    @staticmethod
+    def _get_filename(path, key):
+        backend, dict_ids = key
+        return os.path.join(path, "{}-{}.words"
+                            .format(backend, "+".join(dict_ids)))
 
 
 class SCBackend(object):
@@ -221,12 +634,7 @@ class SCBackend(object):
         """
         results = []
 
-        # Check if the process is still running, it might have
-        # exited on start due to an unknown dictinary name.
-        if self._p and not self._p.poll() is None:
-            self._p = None
-
-        if self._p:
+        if self._is_process_alive():
 
             # unicode?
             if type(text) == type(""):
@@ -237,28 +645,83 @@ class SCBackend(object):
 
             self._p.stdin.write(line)
             self._p.stdin.flush()
-            while True:
-                s = self._p.stdout.readline().decode("UTF-8")
-                s = s.strip()
-                if not s:
-                    break
-                if s[:1] == "&":
-                    sections = s.split(":")
-                    a = sections[0].split()
-                    begin = int(a[3]) - 1 # -1 for the prefixed ^
-                    end   = begin + len(a[1])
-                    span = [begin, end, a[1]] # begin, end, word
-                    suggestions = sections[1].strip().split(', ')
-                    results.append([span, suggestions])
-                if s[:1] == "#":
-                    sections = s.split(":")
-                    a = sections[0].split()
-                    begin = int(a[2]) - 1 # -1 for the prefixed ^
-                    end   = begin + len(a[1])
-                    span = [begin, end, a[1]] # begin, end, word
-                    suggestions = []
-                    results.append([span, suggestions])
+            results = self._read_results()
+
+        return results
+
+    def check(self, text):
+        """
+        Return misspelled spans [begin, end, word] of text,
+        without suggestions. Text may span multiple lines. All of
+        them are sent to the running spell checker in one pipe write,
+        in terse mode, i.e. only misspelled words are answered.
+        """
+        spans = []
+
+        if self._is_process_alive():
+            lines = text.split("\n")
+            data = b"!\n" + \
+                   b"".join(("^" + line + "\n").encode("UTF-8")
+                            for line in lines) + \
+                   b"%\n"   # back to normal mode for query()
+
+            # Read while writing, else large texts could fill
+            # both pipes and block the spell checker and us.
+            writer = threading.Thread(name="SCBackend writer",
+                                      target=self._write, args=(data,))
+            writer.start()
+
+            offset = 0
+            for line in lines:
+                for span, suggestions in self._read_results():
+                    spans.append([span[0] + offset,
+                                  span[1] + offset,
+                                  span[2]])
+                offset += len(line) + 1
+
+            writer.join()
 
+        return spans
+
+    def _write(self, data):
+        try:
+            self._p.stdin.write(data)
+            self._p.stdin.flush()
+        except (IOError, OSError) as ex:
+            _logger.error("failed to write to spell checker: {}"
+                          .format(unicode_str(ex)))
+
+    def _is_process_alive(self):
+        # Check if the process is still running, it might have
+        # exited on start due to an unknown dictinary name.
+        if self._p and not self._p.poll() is None:
+            self._p = None
+        return bool(self._p)
+
+    def _read_results(self):
+        """ Read the results for one line of input. """
+        results = []
+        while True:
+            s = self._p.stdout.readline().decode("UTF-8")
+            s = s.strip()
+            if not s:
+                break
+            if s[:1] == "&":
+                sections = s.split(":")
+                a = sections[0].split()
+                begin = int(a[3]) - 1 # -1 for the prefixed ^
+                end   = begin + len(a[1])
+                span = [begin, end, a[1]] # begin, end, word
+                suggestions = sections[1].strip().split(', ')
+                results.append([span, suggestions])
+            if s[:1] == "#":
+                sections = s.split(":")
+                a = sections[0].split()
+                begin = int(a[2]) - 1 # -1 for the prefixed ^
+                end   = begin + len(a[1])
+                span = [begin, end, a[1]] # begin, end, word
+                suggestions = []
+                results.append([span, suggestions])
         return results
 
     def get_supported_dict_ids(self):
@@ -273,6 +736,12 @@ class SCBackend(object):
         """
         return self._active_dicts
 
+    def get_dict_files(self):
+        """
+        Return files of the active dictionaries, if known.
+        """
+        return []
+
 
 class hunspell(SCBackend):
     """
@@ -291,6 +760,7 @@ class hunspell(SCBackend):
     """
     def __init__(self, dict_ids = None):
         self._osk_hunspell = None
+        self._dict_files = []
         SCBackend.__init__(self, dict_ids)
         if dict_ids:
             self.start(dict_ids)
@@ -303,6 +773,7 @@ class hunspell(SCBackend):
             _logger.info("using hunspell files '{}', '{}'" \
                             .format(dic, aff))
             if dic:
+                self._dict_files = [dic, aff]
                 try:
                     self._osk_hunspell = osk.Hunspell(aff, dic)
                     _logger.info("dictionary encoding '{}'" \
@@ -317,10 +788,14 @@ class hunspell(SCBackend):
         if self.is_running():
             self._osk_hunspell = None
             self._active_dicts = None
+            self._dict_files = []
 
     def is_running(self):
         return not self._osk_hunspell is None
 
+    def get_dict_files(self):
+        return [fn for fn in self._dict_files if fn]
+
     SPLITWORDS = re.compile("[^-_\s]+", re.UNICODE|re.DOTALL)
 
     def query(self, text):
@@ -405,25 +880,42 @@ class hunspell(SCBackend):
         results = []
 
         if self._osk_hunspell:
-            matches = self.SPLITWORDS.finditer(text)
-            for match in matches:
-                word = match.group()
-                begin = match.start()
-                end   = match.end()
-                span = [begin, end, word]
-
+            for span in self.check(text):
                 try:
-                    if self._osk_hunspell.spell(word) == 0:
-                        suggestions = list(self._osk_hunspell.suggest(word))
-                        results.append([span, suggestions])
+                    suggestions = list(self._osk_hunspell.suggest(span[2]))
                 except UnicodeEncodeError:
                     # Assume the offending character isn't part of the
                     # target language and consider this word to be not
                     # in the dictionary, i.e. misspelled without suggestions.
-                    results.append([span, []])
+                    suggestions = []
+                results.append([span, suggestions])
 
         return results
 
+    def check(self, text):
+        """
+        Return misspelled spans [begin, end, word] of text, without
+        suggestions. All words are checked in a single call.
+
+        Doctests:
+        >>> sp = hunspell(["en_US"])
+        >>> sp.check("a conter_trop of ubuntu-system")
+        [[2, 8, 'conter'], [9, 13, 'trop'], [17, 23, 'ubuntu']]
+        >>> sp.check("ἄναρχος")
+        [[0, 7, 'ἄναρχος']]
+        """
+        spans = []
+
+        if self._osk_hunspell:
+            matches = list(self.SPLITWORDS.finditer(text))
+            words = [match.group() for match in matches]
+            for match, res in zip(matches,
+                                  self._osk_hunspell.spell_words(words)):
+                if res == 0:
+                    spans.append([match.start(), match.end(), match.group()])
+
+        return spans
+
     def get_supported_dict_ids(self):
         """
         Return raw supported dictionary ids.
@@ -535,55 +1027,6 @@ class SCBackend_cmd(SCBackend):
     def is_running(self):
         return not self._p is None
 
-    def query(self, text):
-        """
-        Query for spelling suggestions.
-        Text may contain one or more words. Each word generates its own
-        list of suggestions. The spell checker backend decides about
-        word boundaries.
-        """
-        results = []
-
-        # Check if the process is still running, it might have
-        # exited on start due to an unknown dictinary name.
-        if self._p and not self._p.poll() is None:
-            self._p = None
-
-        if self._p:
-
-            # unicode?
-            if type(text) == type(""):
-                line = "^" + text + "\n"
-                line = line.encode("UTF-8")
-            else: # already UTF-8 byte array
-                line = b"^" + text + b"\n"
-
-            self._p.stdin.write(line)
-            self._p.stdin.flush()
-            while True:
-                s = self._p.stdout.readline().decode("UTF-8")
-                s = s.strip()
-                if not s:
-                    break
-                if s[:1] == "&":
-                    sections = s.split(":")
-                    a = sections[0].split()
-                    begin = int(a[3]) - 1 # -1 for the prefixed ^
-                    end   = begin + len(a[1])
-                    span = [begin, end, a[1]] # begin, end, word
-                    suggestions = sections[1].strip().split(', ')
-                    results.append([span, suggestions])
-                if s[:1] == "#":
-                    sections = s.split(":")
-                    a = sections[0].split()
-                    begin = int(a[2]) - 1 # -1 for the prefixed ^
-                    end   = begin + len(a[1])
-                    span = [begin, end, a[1]] # begin, end, word
-                    suggestions = []
-                    results.append([span, suggestions])
-
-        return results
-
     def get_supported_dict_ids(self):
         """
         Return raw supported dictionary ids.
@@ -611,6 +1054,10 @@ class hunspell_cmd(SCBackend_cmd):
     >>> sp = hunspell_cmd(["en_US"])
     >>> sp.query("jdaskljasd")  # doctest: +ELLIPSIS
     [[...
+
+    # misspelled spans only
+    >>> sp.check("a test\\nof jdaskljasd")
+    [[10, 19, 'jdaskljasd']]
     """
     def __init__(self, dict_ids = None):
         SCBackend.__init__(self, dict_ids)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2026 marmuta <marmvta@gmail.com>
+#
+# This file is part of Onboard.
+#
+# Onboard is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Onboard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Memory capped cache of rendered surfaces, shared by many keys.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class SurfaceCache(object):
+    """
+    Least recently used surfaces by rendering parameters.
+
+    Keys that look the same share a single rendering. When the
+    surfaces grow beyond max_bytes, the least recently used ones
+    are dropped.
+
+    Doctests:
+    >>> cache = SurfaceCache("faces", 100)
+    >>> def create(name, nbytes):
+    ...     return lambda: (name, nbytes)
+    >>> cache.get("a", create("surface a", 40))
+    'surface a'
+    >>> cache.get("a", create("other", 40))
+    'surface a'
+    >>> cache.get("b", create("surface b", 40))
+    'surface b'
+    >>> cache.get("c", create("surface c", 40))  # evicts "a"
+    'surface c'
+    >>> "a" in cache, len(cache), cache.get_size()
+    (False, 2, 80)
+    >>> cache.get("x", lambda: None) is None   # nothing to render
+    True
+    >>> print(cache.format_stats())
+    faces: 2 surfaces, 0.1 kB of 0.1 kB, created 3, reused 1, evicted 1
+    """
+
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.clear()
+        self.reset_stats()
+
+    def clear(self):
+        self._entries = OrderedDict()  # key -> (value, nbytes), LRU order
+        self._size = 0
+
+    def reset_stats(self):
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get_size(self):
+        """ Total bytes of the cached surfaces. """
+        return self._size
+
+    def get(self, key, create):
+        """
+        Return the value cached for key. On a miss, create() renders
+        it and returns (value, size in bytes), or None if there is
+        nothing to cache.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.reused += 1
+            return entry[0]
+
+        entry = create()
+        if entry is None:
+            return None
+
+        self._entries[key] = entry
+        self._size += entry[1]
+        self.created += 1
+        self._evict()
+
+        return entry[0]
+
+    def _evict(self):
+        # always keep the most recent entry, even if it is oversized
+        while self._size > self.max_bytes and \
+              len(self._entries) > 1:
+            key, (value, nbytes) = self._entries.popitem(last=False)
+            self._size -= nbytes
+            self.evicted += 1
+
+    def format_stats(self):
+        return "{}: {} surfaces, {:.1f} kB of {:.1f} kB, " \
+               "created {}, reused {}, evicted {}" \
+               .format(self.name, len(self._entries),
+                       self._size / 1024.0, self.max_bytes / 1024.0,
+                       self.created, self.reused, self.evicted)
+
+    @staticmethod
+    def get_surface_size(width, height, bytes_per_pixel=4):
+        """ Approximate memory use of a surface in bytes. """
+        return max(int(width), 1) * max(int(height), 1) * bytes_per_pixel
+
@@ -37,6 +37,7 @@ from Onboard.TextDomain        import TextDomains
 from Onboard.TextChanges       import TextChanges, TextSpan
 from Onboard.utils             import KeyCode, unicode_str
 from Onboard.Timer             import Timer
+from Onboard.LatencyTrace      import LatencyTrace, Stage
 from Onboard                   import KeyCommon
 
 ### Config Singleton ###
@@ -562,6 +563,7 @@ class AtspiTextContext(TextContext):
         self._update_context_timer.start(self._update_context_delay,
                                          self.on_text_context_changed)
 
+    @LatencyTrace.traced(Stage.TEXT_CONTEXT)
     def on_text_context_changed(self):
         # Clear pending separator when the user clicked to move
         # the cursor away from the separator position.
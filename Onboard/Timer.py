@@ -98,6 +98,23 @@ class Timer(object):
         return True
 
 
+class IdleTimer(Timer):
+    """
+    Calls on_timer whenever the main loop is idle, by default only
+    after input events and redrawing have been dealt with.
+    Return False there to stop.
+    """
+    def start(self, priority=GLib.PRIORITY_LOW, callback=None,
+              *callback_args):
+        if callback:
+            self._callback = callback
+            self._callback_args = callback_args
+
+        self.stop()
+
+        self._timer = GLib.idle_add(self._cb_timer, priority=priority)
+
+
 class TimerOnce(Timer):
     def on_timer(self):
         """
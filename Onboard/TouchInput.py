@@ -35,6 +35,7 @@ from gi.repository         import Gdk
 
 from Onboard.utils         import EventSource
 from Onboard.Timer         import Timer
+from Onboard.LatencyTrace  import LatencyTrace, Stage
 from Onboard.definitions   import TouchInputEnum
 from Onboard.XInput        import XIDeviceManager, XIEventType, XIEventMask, \
                                   XIDeviceEventLogger
@@ -674,8 +675,10 @@ class TouchInput(InputEventSource):
 
         return True
 
+    @LatencyTrace.traced(Stage.INPUT)
     def _input_sequence_begin(self, sequence):
         """ Button press/touch begin """
+        LatencyTrace().begin_keystroke()
         self.log_event("_input_sequence_begin1 {}", sequence)
         self._gesture_sequence_begin(sequence)
         first_sequence = len(self._input_sequences) == 0
@@ -727,8 +730,10 @@ class TouchInput(InputEventSource):
             self._gesture_timer.finish()  # run delayed begin before update
             self.on_input_sequence_update(sequence)
 
+    @LatencyTrace.traced(Stage.INPUT)
     def _input_sequence_end(self, sequence):
         """ Button release/touch end """
+        LatencyTrace().begin_keystroke()
         self.log_event("_input_sequence_end1 {}", sequence)
         self._gesture_sequence_end(sequence)
         self._gesture_timer.finish()  # run delayed begin before end
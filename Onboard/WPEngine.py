@@ -21,10 +21,17 @@ from __future__ import division, print_function, unicode_literals
 
 import os
 import time
+import zlib
+import codecs
 import logging
+import threading
+from collections import OrderedDict
 
-from Onboard.utils import unicode_str, XDGDirs
+from gi.repository import GLib
+
+from Onboard.utils import unicode_str, XDGDirs, BackgroundWorker, LRUCache
 from Onboard.Timer import Timer
+from Onboard.LatencyTrace import LatencyTrace, Stage
 from Onboard.Config import Config
 
 import Onboard.pypredict as pypredict
@@ -59,30 +66,148 @@ class WPLocalEngine(object):
         Singleton constructor, runs only once.
         """
         self._model_cache = ModelCache()
-        self._auto_save_timer = AutoSaveTimer(self._model_cache)
+        self._model_cache.loaded_callback = self._on_model_loaded
+        self._auto_save_timer = AutoSaveTimer(self.save_models)
         self.models = []
         self.persistent_models = []
         self.auto_learn_models = []
         self.scratch_models = []
 
+        # Candidate words of the previous keystroke, allows
+        # narrowing them down while the current word is typed.
+        self._prediction_session = pypredict.PredictionSession()
+
+        # Merged models, built once per model description.
+        self._merged_models = {}  # lmdesc -> (component models, merged)
+
+        # Recent prediction results, until the models change.
+        self._prediction_cache = LRUCache(32)
+
+        # Set by the main thread, the caches above are reset when
+        # the models are used next.
+        self._caches_outdated = False
+
+        # Models and caches may be used from the worker thread
+        # and the main thread, only one at a time.
+        self._lock = threading.RLock()
+        self._worker = None
+
+        # Called in the main thread when models finished loading
+        # in the background.
+        self.models_loaded_callback = None
+
     def cleanup(self):
         self._auto_save_timer.stop()
-        self._model_cache.save_models()
+        self.set_async(False)  # finish pending learning
+        with self._lock:
+            self._model_cache.save_models()
+
+    def set_async(self, enable):
+        """
+        Run predictions, learning and saving of models in a
+        background thread, see predict_async().
+        """
+        if enable:
+            if not self._worker:
+                self._worker = BackgroundWorker()
+                self._worker.start()
+        else:
+            if self._worker:
+                self._worker.stop()
+                self._worker = None
+
+    def is_async(self):
+        return self._worker is not None
+
+    def set_compact_system_models(self, enable):
+        """
+        Keep system models in the contiguous, read-only layout of
+        compiled models. Loaded system models are reloaded on demand.
+        """
+        # Settings don't take the engine lock, the worker thread may
+        # hold it for a whole save. The worker applies them instead,
+        # see _invalidate_caches().
+        if self._model_cache.compact_system_models != enable:
+            self._model_cache.compact_system_models = enable
+            self._model_cache.remove_models("system")
+            self._invalidate_caches()
 
     def set_models(self, persistent_models, auto_learn_models, scratch_models):
         """ Fixme: rename to "set_model_ids" """
+        # Replace, don't modify the lists, the worker may be using them.
         self.models = persistent_models + scratch_models
         self.persistent_models = persistent_models
         self.auto_learn_models = auto_learn_models
-        self.auto_learn_models = auto_learn_models
         self.scratch_models = scratch_models
+        self._invalidate_caches()
+
+    def reset_prediction_session(self):
+        """
+        Forget the candidates of previous predictions,
+        the next prediction searches from scratch.
+        """
+        self._invalidate_caches()
+
+    def _invalidate_caches(self):
+        """
+        Have the next user of the models drop merged models, cached
+        predictions and the prediction session. Doesn't wait for the
+        engine lock.
+        """
+        self._caches_outdated = True
+
+    def _update_caches(self):
+        """ Reset outdated caches, call with the engine lock held. """
+        if self._caches_outdated:
+            self._caches_outdated = False
+            self._merged_models = {}
+            self._prediction_cache.clear()
+            self._prediction_session.clear()
 
     def load_models(self):
         """
-        Pre-load models set with set_models. If this isn't called,
-        language models are lazy-loaded on demand.
+        Pre-load models set with set_models and wait until they are
+        resident. If this isn't called, language models are loaded in
+        the background on first prediction.
         """
-        self._model_cache.get_models(self.models)
+        with self._lock:
+            self._model_cache.get_models(self.models)
+
+    def are_models_loaded(self):
+        """ Are all models set with set_models resident? """
+        return all(self._model_cache.is_resident(lmid)
+                   for lmid in self.models)
+
+    def _on_model_loaded(self, lmid):
+        """ Runs in the loading thread. """
+        GLib.idle_add(self._notify_models_loaded)
+
+    def _notify_models_loaded(self):
+        if self.models_loaded_callback:
+            self.models_loaded_callback()
+        return False
+
+    def save_models(self):
+        """
+        Save modified user models, in the background in async mode.
+        """
+        if self._worker:
+            self._worker.submit_task(self._save_models)
+        else:
+            self._save_models()
+
+    def set_max_user_model_ngrams(self, max_ngrams):
+        """
+        Limit the size of user models, 0 for no limit. Larger models
+        are shrunk before they are saved next.
+        """
+        self._model_cache.max_user_model_ngrams = max_ngrams
+
+    def _save_models(self):
+        with self._lock:
+            if self._model_cache.save_models():
+                # Shrinking renumbered the words of user models.
+                self._invalidate_caches()
 
     def postpone_autosave(self):
         self._auto_save_timer.postpone()
@@ -95,14 +220,26 @@ class WPLocalEngine(object):
     def resume_autosave(self):
         self._auto_save_timer.resume()
 
+    @LatencyTrace.traced(Stage.PREDICT)
     def predict(self, context_line, limit=20,
                 case_insensitive=False,
                 case_insensitive_smart=False,
                 accent_insensitive=False,
                 accent_insensitive_smart=False,
                 ignore_capitalized=False,
-                ignore_non_capitalized=False):
-        """ Find completion/prediction choices. """
+                ignore_non_capitalized=False,
+                max_edit_distance=0,
+                drop_capitalized=False,
+                wait=True):
+        """
+        Find completion/prediction choices.
+        With max_edit_distance, find correction choices instead, i.e.
+        words within up to 3 edits of the last word of context_line.
+        With drop_capitalized, capitalized choices are left out when
+        their lower case spelling is known to any of the models.
+        Without wait, returns None instead of waiting for the worker
+        thread to finish learning or saving.
+        """
         LanguageModel = pypredict.LanguageModel
         options = 0
         if case_insensitive:
@@ -117,15 +254,58 @@ class WPLocalEngine(object):
             options |= LanguageModel.IGNORE_CAPITALIZED
         if ignore_non_capitalized:
             options |= LanguageModel.IGNORE_NON_CAPITALIZED
+        if max_edit_distance:
+            options |= min(max_edit_distance, 3) * \
+                       LanguageModel.MAX_EDIT_DISTANCE_1
+        if drop_capitalized:
+            options |= LanguageModel.DROP_CAPITALIZED
 
         context, spans = pypredict.tokenize_context(context_line)
-        choices = self._get_prediction(self.models, context, limit, options)
+        if not self._lock.acquire(wait):
+            return None
+        try:
+            choices = self._get_prediction(self.models, context, limit,
+                                           options)
+        finally:
+            self._lock.release()
         _logger.debug("context=" + repr(context))
         _logger.debug("choices=" + repr(choices[:5]))
         return [x[0] for x in choices]
 
+    def predict_async(self, func, callback, slot="predictions"):
+        """
+        Call func in the worker thread and pass its return value to
+        callback in the main thread. func typically calls predict().
+        Only the most recent request per slot is answered, pending or
+        running older requests of the slot are dropped. Without worker
+        func runs right away.
+        """
+        if self._worker:
+            self._worker.submit_query(func, callback, slot)
+        else:
+            callback(func())
+
+    def cancel_predictions(self):
+        """ Drop results of outstanding asynchronous predictions. """
+        if self._worker:
+            self._worker.cancel_queries()
+
     def learn_text(self, text, allow_new_words):
-        """ Count n-grams and add words to the auto-learn models. """
+        """
+        Count n-grams and add words to the auto-learn models.
+        Learning happens in the background in async mode.
+        """
+        if self._worker:
+            self._worker.submit_task(self._learn_text,
+                                     text, allow_new_words)
+        else:
+            self._learn_text(text, allow_new_words)
+
+    def _learn_text(self, text, allow_new_words):
+        with self._lock:
+            self._do_learn_text(text, allow_new_words)
+
+    def _do_learn_text(self, text, allow_new_words):
 
         _logger.debug("learn_text(text={}, allow_new_words={}): "
                       "auto_learn_models={}"
@@ -156,6 +336,7 @@ class WPLocalEngine(object):
             for model in models:
                 for tokens in token_sections:
                     model.learn_tokens(tokens)
+            self._prediction_cache.clear()
 
             _logger.info("learn_text: tokens=" + repr(token_sections))
 
@@ -175,16 +356,32 @@ class WPLocalEngine(object):
 
     def learn_scratch_text(self, text):
         """ Count n-grams and add words to the scratch models. """
+        if self._worker:
+            self._worker.submit_task(self._learn_scratch_text, text)
+        else:
+            self._learn_scratch_text(text)
+
+    def _learn_scratch_text(self, text):
         tokens, spans = pypredict.tokenize_text(text)
-        models = self._model_cache.get_models(self.scratch_models)
-        for model in models:
-            # print("scratch learn", model, tokens)
-            model.learn_tokens(tokens, True)
+        with self._lock:
+            models = self._model_cache.get_models(self.scratch_models)
+            for model in models:
+                # print("scratch learn", model, tokens)
+                model.learn_tokens(tokens, True)
+            self._prediction_cache.clear()
 
     def clear_scratch_models(self):
-        models = self._model_cache.get_models(self.scratch_models)
-        for model in models:
-            model.clear()
+        if self._worker:
+            self._worker.submit_task(self._clear_scratch_models)
+        else:
+            self._clear_scratch_models()
+
+    def _clear_scratch_models(self):
+        with self._lock:
+            models = self._model_cache.get_models(self.scratch_models)
+            for model in models:
+                model.clear()
+            self._prediction_cache.clear()
 
     def lookup_text(self, text, lmids):
         """
@@ -210,11 +407,12 @@ class WPLocalEngine(object):
         tokspans  = [(spans[i][0], spans[i][1], t)
                      for i, t in enumerate(tokens)]
         counts = [[0 for lmid in lmids] for t in tokspans]
-        for i, lmid in enumerate(lmids):
-            model = self._model_cache.get_model(lmid)
-            if model:
-                for j, t in enumerate(tokspans):
-                    counts[j][i] = model.lookup_word(t[2])
+        with self._lock:
+            for i, lmid in enumerate(lmids):
+                model = self._model_cache.get_model(lmid)
+                if model:
+                    for j, count in enumerate(model.lookup_words(tokens)):
+                        counts[j][i] = count
 
         _logger.debug("lookup_tokens: tokens=%s counts=%s" %
                      (repr(tokens), repr(counts)))
@@ -227,16 +425,17 @@ class WPLocalEngine(object):
         """
         Does word exist in any of the non-scratch models?
         """
-        exists = False
-        lmids = self.persistent_models
-        for i, lmid in enumerate(lmids):
-            model = self._model_cache.get_model(lmid)
-            if model:
-                count = model.lookup_word(word)
-                if count > 0:
-                    exists = True
-                    break
-        return exists
+        return self.words_exist([word])[0]
+
+    def words_exist(self, words):
+        """
+        Batch version of word_exists(), looks up all words in
+        a single call into the language models.
+        """
+        with self._lock:
+            model = self._get_merged_model(self.persistent_models)
+            counts = model.lookup_words(words)
+        return [count > 0 for count in counts]
 
     def tokenize_text(self, text):
         """
@@ -264,7 +463,8 @@ class WPLocalEngine(object):
 
     def get_model_names(self, _class):
         """ Return the names of the available models. """
-        names = self._model_cache.find_available_model_names(_class)
+        with self._lock:
+            names = self._model_cache.find_available_model_names(_class)
         return names
 
     def get_last_context_fragment(self, text):
@@ -282,45 +482,98 @@ class WPLocalEngine(object):
             return ""
 
     def _get_prediction(self, lmdesc, context, limit, options):
+        # Don't block while models load in the background,
+        # there are no choices until they are ready.
+        model = self._get_merged_model(lmdesc, wait=False)
+        if model is None:
+            return []
+
+        key = (tuple(lmdesc), tuple(context), limit, options)
+        choices = self._prediction_cache.get(key)
+        if choices is None:
+            # Typing further letters of the same word only filters the
+            # candidates of the last call. Backspace, a different history
+            # or changes to the models fall back to a full search.
+            choices = model.predictp(context, limit, options=options,
+                                     session=self._prediction_session)
+            self._prediction_cache.set(key, choices)
+
+        return choices
+
+    def _get_merged_model(self, lmdesc, wait=True):
+        """
+        Return the configured overlay of the models in lmdesc.
+        It is rebuilt only when the model cache hands out different
+        models, e.g. after set_models or reloading broken models.
+        Without wait, returns None while models are still loading.
+        """
+        self._update_caches()
+
         lmids, weights = self._model_cache.parse_lmdesc(lmdesc)
-        models = self._model_cache.get_models(lmids)
+        models = self._model_cache.get_models(lmids, wait)
+        if models is None:
+            return None
 
-        for m in models:
-            # Kneser-ney perfomes best in entropy and ksr measures, but
-            # failed in practice for anything but natural language, e.g.
-            # shell commands.
-            # -> use the second best available: absolute discounting
-            # m.smoothing = "kneser-ney"
-            m.smoothing = "abs-disc"
-
-            # setup recency caching
-            if hasattr(m, "recency_ratio"):
-                # Values found with
-                # $ pypredict/optimize caching models/en.lm learned_text.txt
-                # based on multilingual text actually typed (--log-learning)
-                # with onboard over ~3 months.
-                # How valid those settings are under different conditions
-                # remains to be seen, but for now this is the best I have.
-                m.recency_ratio = 0.811
-                m.recency_halflife = 96
-                m.recency_smoothing = "jelinek-mercer"
-                m.recency_lambdas = [0.404, 0.831, 0.444]
-
-        model = pypredict.overlay(models)
-        # model = pypredict.linint(models, weights)
-        # model = pypredict.loglinint(models, weights)
-
-        choices = model.predictp(context, limit, options=options)
+        key = tuple(lmdesc)
+        entry = self._merged_models.get(key)
+        if entry is None or \
+           len(entry[0]) != len(models) or \
+           any(m1 is not m2 for m1, m2 in zip(entry[0], models)):
 
-        return choices
+            for m in models:
+                self._configure_model(m)
+
+            model = pypredict.overlay(models)
+            # model = pypredict.linint(models, weights)
+            # model = pypredict.loglinint(models, weights)
+
+            entry = (models, model)
+            self._merged_models[key] = entry
+            self._prediction_cache.clear()
+
+        return entry[1]
+
+    @staticmethod
+    def _configure_model(m):
+        # Kneser-ney perfomes best in entropy and ksr measures, but
+        # failed in practice for anything but natural language, e.g.
+        # shell commands.
+        # -> use the second best available: absolute discounting
+        # m.smoothing = "kneser-ney"
+        m.smoothing = "abs-disc"
+
+        # setup recency caching
+        if hasattr(m, "recency_ratio"):
+            # Values found with
+            # $ pypredict/optimize caching models/en.lm learned_text.txt
+            # based on multilingual text actually typed (--log-learning)
+            # with onboard over ~3 months.
+            # How valid those settings are under different conditions
+            # remains to be seen, but for now this is the best I have.
+            m.recency_ratio = 0.811
+            m.recency_halflife = 96
+            m.recency_smoothing = "jelinek-mercer"
+            m.recency_lambdas = [0.404, 0.831, 0.444]
 
     def remove_context(self, context):
         """
         Remove the last word of context in the given context.
         If len(context) == 1 then all occurences of the word will be removed.
+        Removal happens in the background in async mode.
         """
+        if self._worker:
+            self._worker.submit_task(self._remove_context, context)
+        else:
+            self._remove_context(context)
+
+    def _remove_context(self, context):
+        with self._lock:
+            self._do_remove_context(context)
+
+    def _do_remove_context(self, context):
         lmids, weights = self._model_cache.parse_lmdesc(self.auto_learn_models)
         models = self._model_cache.get_models(lmids)
+        self._prediction_cache.clear()
         for i, m in enumerate(models):
             changes = m.remove_context(context)
 
@@ -336,40 +589,145 @@ class WPLocalEngine(object):
 
 
 class ModelCache:
-    """ Loads and caches language models """
+    """
+    Loads and caches language models.
 
-    def __init__(self):
-        self._language_models = {}
+    Models can be loaded in a background thread, see get_model().
+    Only the max_system_models most recently used system models stay
+    resident, older ones are dropped and reload on demand.
+    """
 
-    def clear(self):
-        self._language_models = {}
+    MAX_SYSTEM_MODELS = 2
+
+    # Oversized user models are shrunk to this fraction of the limit,
+    # so that they don't have to be shrunk again on every save.
+    USER_MODEL_SHRINK_RATIO = 0.9
+
+    def __init__(self, max_system_models=MAX_SYSTEM_MODELS):
+        self._language_models = OrderedDict()  # lmid -> model, LRU order
+        self._loading = {}        # lmid -> threading.Event of pending load
+        self._lock = threading.Lock()
+        self.max_system_models = max_system_models
+        self.compact_system_models = False
+        self.max_user_model_ngrams = 0     # no limit
 
-    def get_models(self, lmids):
+        # Called from the loading thread when a background load finished.
+        self.loaded_callback = None
+
+    def clear(self):
+        with self._lock:
+            self._language_models = OrderedDict()
+            self._loading = {}  # drop results of pending loads
+
+    def remove_models(self, class_):
+        """ Forget models of the given class, they reload on demand. """
+        with self._lock:
+            for models in (self._language_models, self._loading):
+                for lmid in list(models):
+                    if self.split_lmid(lmid)[1] == class_:
+                        del models[lmid]
+
+    def get_models(self, lmids, wait=True):
+        """
+        Get the models of lmids, see get_model(). Without wait,
+        returns None while any of the models is still loading.
+        """
         models = []
+        ready = True
         for lmid in lmids:
-            model = self.get_model(lmid)
+            model = self.get_model(lmid, wait)
             if model:
                 models.append(model)
-        return models
+            elif not wait and self.is_loading(lmid):
+                ready = False
+        return models if ready else None
 
-    def get_model(self, lmid):
-        """ get language model from cache or load it from disk"""
+    def get_model(self, lmid, wait=True):
+        """
+        Get language model from cache or load it from disk.
+        Without wait, a missing model is loaded in a background thread
+        and None is returned until it is resident.
+        """
         lmid = self.canonicalize_lmid(lmid)
-        if lmid in self._language_models:
-            model = self._language_models[lmid]
-        else:
+        if self.split_lmid(lmid)[1] == "mem":
+            wait = True   # memory models start empty, nothing to wait for
+
+        while True:
+            with self._lock:
+                model = self._language_models.get(lmid)
+                if model is not None:
+                    self._language_models.move_to_end(lmid)
+                    return model
+
+                event = self._loading.get(lmid)
+                if event is None:
+                    event = threading.Event()
+                    self._loading[lmid] = event
+                    break
+
+            # Someone else is loading it already.
+            if not wait:
+                return None
+            event.wait()
+
+        if not wait:
+            thread = threading.Thread(name="ModelCache " + lmid,
+                                      target=self._load,
+                                      args=(lmid, event, True))
+            thread.daemon = True
+            thread.start()
+            return None
+
+        return self._load(lmid, event)
+
+    def is_loading(self, lmid):
+        lmid = self.canonicalize_lmid(lmid)
+        with self._lock:
+            return lmid in self._loading
+
+    def is_resident(self, lmid):
+        lmid = self.canonicalize_lmid(lmid)
+        with self._lock:
+            return lmid in self._language_models
+
+    def _load(self, lmid, event, notify=False):
+        model = None
+        try:
             model = self.load_model(lmid)
-            if model:
-                self._language_models[lmid] = model
+        except Exception as ex:
+            _logger.exception("Failed to load language model '{}': {}"
+                              .format(lmid, unicode_str(ex)))
+        finally:
+            with self._lock:
+                # Keep the model unless clear() happened meanwhile.
+                if self._loading.get(lmid) is event:
+                    del self._loading[lmid]
+                    if model:
+                        self._language_models[lmid] = model
+                        self._evict_system_models()
+            event.set()
+
+        if notify and self.loaded_callback:
+            self.loaded_callback(lmid)
+
         return model
 
+    def _evict_system_models(self):
+        """ Drop the least recently used system models beyond the limit. """
+        lmids = [lmid for lmid in self._language_models
+                 if self.split_lmid(lmid)[1] == "system"]
+        for lmid in lmids[:max(0, len(lmids) - self.max_system_models)]:
+            _logger.info("Unloading language model '{}'.".format(lmid))
+            del self._language_models[lmid]
+
     def find_available_model_names(self, _class):
         names = []
         models = self._find_models(_class)
         for model in models:
             name = os.path.basename(model)
             name, ext = os.path.splitext(name)
-            names.append(name)
+            if name not in names:  # may exist as .lm and .lmc
+                names.append(name)
         return names
 
     @staticmethod
@@ -378,14 +736,16 @@ class ModelCache:
 
         if _class == "system":
             path = config.get_system_model_dir()
+            extensions = ("lm", "lmc")
         else:
             path = config.get_user_model_dir()
+            extensions = ("lm",)
 
         try:
             files = os.listdir(path)
-            extension = "lm"
             for filename in files:
-                if filename.endswith("." + extension):
+                name, ext = os.path.splitext(filename)
+                if ext[1:] in extensions:
                     models.append(os.path.join(path, filename))
         except OSError as e:
             _logger.warning("Failed to find language models in '{}': {} ({})"
@@ -446,6 +806,10 @@ class ModelCache:
 
         if type_ == "lm":
             if class_ == "system":
+                model = self.load_compiled_model(filename)
+                if model:
+                    return model
+
                 if pypredict.read_order(filename) == 1:
                     model = pypredict.UnigramModel()
                 else:
@@ -466,6 +830,80 @@ class ModelCache:
         if filename:
             self.do_load_model(model, filename, class_)
 
+            if class_ == "user" and \
+               not model.load_error:
+                ModelJournal.replay(model, filename)
+                model.journal = []
+
+            if class_ == "system" and \
+               self.compact_system_models and \
+               not model.load_error:
+                model = self.compact_model(model, filename)
+
+        return model
+
+    @staticmethod
+    def compact_model(model, filename):
+        """
+        Copy a loaded model into the contiguous, read-only layout of
+        compiled models. Returns the original model on failure.
+
+        Doctests:
+        >>> model = pypredict.DynamicModel()
+        >>> model.learn_tokens(["aaa", "bbb", "aaa"])
+        >>> compact = ModelCache.compact_model(model, "")
+        >>> type(compact).__name__
+        'CompiledModel'
+        >>> compact.get_ngram_count(["aaa", "bbb"])
+        1
+        """
+        compact = pypredict.CompiledModel()
+        try:
+            compact.compile(model)
+        except (IOError, MemoryError) as ex:
+            _logger.warning("Failed to compact language model '{}': {}"
+                            .format(filename, unicode_str(ex)))
+            return model
+
+        _logger.info("Compacted language model '{}' from {} to {} bytes."
+                     .format(filename, sum(model.memory_size()),
+                             sum(compact.memory_size())))
+        return compact
+
+    @staticmethod
+    def load_compiled_model(filename):
+        """
+        Memory map the compiled version of a system model, if there is one
+        that is at least as recent as the text model.
+        Returns None when the text model has to be loaded instead.
+        """
+        compiled_filename = ModelCache.get_compiled_filename(filename)
+        try:
+            compiled_mtime = os.path.getmtime(compiled_filename)
+        except OSError:
+            return None
+
+        try:
+            if compiled_mtime < os.path.getmtime(filename):
+                _logger.info("Compiled language model '{}' is outdated, "
+                             "ignoring it.".format(compiled_filename))
+                return None
+        except OSError:
+            pass  # there is only the compiled model
+
+        _logger.info("Loading language model '{}'."
+                     .format(compiled_filename))
+
+        model = pypredict.CompiledModel()
+        try:
+            model.load(compiled_filename)
+        except IOError as ex:
+            _logger.warning("Failed to load compiled language model '{}', "
+                            "falling back to '{}': {}"
+                            .format(compiled_filename, filename,
+                                    unicode_str(ex)))
+            return None
+
         return model
 
     @staticmethod
@@ -497,9 +935,55 @@ class ModelCache:
                                   "to prevent further data loss.")
 
     def save_models(self):
-        for lmid, model in list(self._language_models.items()):
+        """
+        Save modified user models. Returns True if any of them had to
+        be shrunk first.
+        """
+        with self._lock:
+            items = list(self._language_models.items())
+        shrunk = False
+        for lmid, model in items:
             if self.can_save(lmid):
+                if self.shrink_model(model, lmid):
+                    shrunk = True
                 self.save_model(model, lmid)
+        return shrunk
+
+    def shrink_model(self, model, lmid):
+        """
+        Drop rarely and long unused n-grams from user models
+        that have grown beyond max_user_model_ngrams.
+
+        Doctests:
+        >>> cache = ModelCache()
+        >>> cache.max_user_model_ngrams = 10
+        >>> model = pypredict.CachedDynamicModel()
+        >>> model.learn_tokens(["aaa", "bbb", "ccc", "aaa", "bbb"])
+        >>> model.get_num_ngrams()
+        13
+        >>> cache.shrink_model(model, "lm:user:en")
+        True
+        >>> model.get_num_ngrams()
+        9
+        >>> model.get_ngram_count(["aaa", "bbb"])
+        2
+        """
+        max_ngrams = self.max_user_model_ngrams
+        if not max_ngrams or \
+           not hasattr(model, "shrink") or \
+           model.load_error:
+            return False
+
+        # The recency of n-grams is measured in counted n-grams,
+        # let their weight halve once the model could have been
+        # refilled completely.
+        target_ngrams = int(max_ngrams * self.USER_MODEL_SHRINK_RATIO)
+        num_ngrams = model.get_num_ngrams()
+        num_removed = model.shrink(max_ngrams, target_ngrams, max_ngrams)
+        if num_removed:
+            _logger.info("Shrunk language model '{}' from {} to {} n-grams."
+                         .format(lmid, num_ngrams, num_ngrams - num_removed))
+        return num_removed > 0
 
     @staticmethod
     def can_save(lmid):
@@ -520,23 +1004,43 @@ class ModelCache:
                                 "due to previous error on load."
                                 .format(filename))
             else:
-                _logger.info("Saving language model '{}'".format(filename))
                 try:
-                    # create the path
-                    path = os.path.dirname(filename)
-                    XDGDirs.assure_user_dir_exists(path)
+                    # Append the changes to the journal, if possible.
+                    # Rewrite the whole model only once in a while.
+                    if model.journal and \
+                       os.path.exists(filename) and \
+                       not ModelJournal.needs_compaction(filename) and \
+                       ModelJournal.append(filename, model.journal):
+                        _logger.info("Appended {} changes to the journal "
+                                     "of language model '{}'"
+                                     .format(len(model.journal), filename))
+                    else:
+                        _logger.info("Saving language model '{}'"
+                                     .format(filename))
+
+                        # create the path
+                        path = os.path.dirname(filename)
+                        XDGDirs.assure_user_dir_exists(path)
 
-                    if 1:
                         # save to temp file
                         basename, ext = os.path.splitext(filename)
                         tempfile = basename + ".tmp"
                         model.save(tempfile)
 
+                        # Start a new journal for the new model file.
+                        # The old journal stays valid for the old file
+                        # until the final rename.
+                        journal_tempfile = ModelJournal.begin(filename,
+                                                              tempfile)
+
                         # rename to final file
                         if os.path.exists(filename):
                             os.rename(filename, backup_filename)
                         os.rename(tempfile, filename)
+                        ModelJournal.commit(filename, journal_tempfile)
 
+                    if model.journal is not None:
+                        model.journal = []
                     model.modified = False
                 except (IOError, OSError) as e:
                     _logger.warning(
@@ -558,6 +1062,18 @@ class ModelCache:
 
         return filename
 
+    @staticmethod
+    def get_compiled_filename(filename):
+        """
+        Filename of the binary, memory mappable version of a model.
+
+        Doctests:
+        >>> ModelCache.get_compiled_filename("/usr/share/models/en_US.lm")
+        '/usr/share/models/en_US.lmc'
+        """
+        basename, ext = os.path.splitext(filename)
+        return basename + ".lmc"
+
     @staticmethod
     def get_backup_filename(filename):
         return filename + ".bak"
@@ -600,14 +1116,233 @@ class ModelCache:
         return fn
 
 
+class ModelJournal:
+    """
+    Append-only log of the changes to a user model since its file
+    was last written in full. Changes are replayed on load.
+
+    UTF-8 text, one entry per line, fields separated by tabs:
+    #journal <id>                    id of the model file it belongs to
+    learn <allow_new_words> <token>...
+    count <increment> <word>...
+
+    The id is made up of size and checksum of the model file. A journal
+    whose model file was replaced, e.g. by a backup, is discarded and
+    the model is saved in full next time.
+
+    Doctests:
+    >>> import tempfile
+    >>> td = tempfile.TemporaryDirectory(prefix="test_onboard_")
+    >>> fn = os.path.join(td.name, "en_US.lm")
+    >>> model = pypredict.CachedDynamicModel()
+    >>> model.learn_tokens(["we", "saw", "whales"])
+    >>> model.save(fn)
+    >>> ModelJournal.commit(fn, ModelJournal.begin(fn, fn))
+    >>> ModelJournal.append(fn, [("learn", True, ["we", "saw", "dolphins"]),
+    ...                          ("count", -1, ["saw", "whales"])])
+    True
+
+    >>> model = pypredict.CachedDynamicModel()
+    >>> model.load(fn)
+    >>> ModelJournal.replay(model, fn)
+    2
+    >>> model.get_ngram_count(["saw", "whales"])
+    0
+    >>> model.get_ngram_count(["saw", "dolphins"])
+    1
+
+    # changed model file, the journal doesn't apply anymore
+    >>> model.save(fn)
+    >>> ModelJournal.append(fn, [("learn", True, ["we", "saw", "seals"])])
+    False
+    >>> ModelJournal.needs_compaction(fn)
+    True
+    >>> ModelJournal.replay(model, fn)
+    0
+    >>> os.path.exists(ModelJournal.get_filename(fn))
+    False
+
+    # learned text isn't lost after the model file was replaced
+    # under its journal, e.g. when restoring the backup
+    >>> cache = ModelCache()
+    >>> cache.get_filename = lambda lmid: fn
+    >>> model = cache.load_model("lm:user:en")
+    >>> model.learn_tokens(["we", "saw", "seals"])
+    >>> cache.save_model(model, "lm:user:en")
+    >>> model.learn_tokens(["we", "saw", "otters"])
+    >>> cache.save_model(model, "lm:user:en")
+    >>> model = pypredict.CachedDynamicModel()
+    >>> model.save(fn)
+    >>> model = cache.load_model("lm:user:en")
+    >>> model.get_ngram_count(["saw", "seals"])
+    0
+    >>> model.learn_tokens(["we", "saw", "orcas"])
+    >>> cache.save_model(model, "lm:user:en")
+    >>> model.learn_tokens(["we", "saw", "otters"])
+    >>> cache.save_model(model, "lm:user:en")
+    >>> model = cache.load_model("lm:user:en")
+    >>> [model.get_ngram_count(["saw", word])
+    ...  for word in ["seals", "orcas", "otters"]]
+    [0, 1, 1]
+    >>> td.cleanup()
+    """
+
+    HEADER = "#journal"
+
+    # Rewrite the model when the journal grows larger than this
+    # fraction of the model file, but not below MIN_COMPACTION_SIZE.
+    COMPACTION_RATIO = 0.25
+    MIN_COMPACTION_SIZE = 64 * 1024
+
+    @staticmethod
+    def get_filename(filename):
+        return filename + ".journal"
+
+    @staticmethod
+    def get_model_id(filename):
+        """ Identify the contents of a model file. """
+        crc = 0
+        size = 0
+        with open(filename, "rb") as f:
+            while True:
+                data = f.read(1024 * 1024)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+        return "{}-{:08x}".format(size, crc & 0xffffffff)
+
+    @staticmethod
+    def begin(filename, model_filename):
+        """
+        Write an empty journal for the freshly saved model_filename
+        to a temporary file. Returns the name of the temporary file.
+        """
+        journal_filename = ModelJournal.get_filename(filename)
+        tempfile = journal_filename + ".tmp"
+        with codecs.open(tempfile, "w", "UTF-8") as f:
+            f.write("{}\t{}\n".format(ModelJournal.HEADER,
+                                      ModelJournal.get_model_id(
+                                          model_filename)))
+        return tempfile
+
+    @staticmethod
+    def commit(filename, tempfile):
+        """ Replace the journal with the one written by begin(). """
+        os.rename(tempfile, ModelJournal.get_filename(filename))
+
+    @staticmethod
+    def is_valid(filename):
+        """ Does the journal belong to the current model file? """
+        journal_filename = ModelJournal.get_filename(filename)
+        try:
+            with codecs.open(journal_filename, "r", "UTF-8") as f:
+                header = f.readline().rstrip("\n").split("\t")
+            return header == [ModelJournal.HEADER,
+                              ModelJournal.get_model_id(filename)]
+        except (IOError, OSError, UnicodeDecodeError):
+            return False
+
+    @staticmethod
+    def append(filename, changes):
+        """
+        Add changes to the journal of the model file.
+        Returns False if the model has to be saved in full instead.
+        """
+        if not ModelJournal.is_valid(filename):
+            return False
+
+        journal_filename = ModelJournal.get_filename(filename)
+        lines = []
+        for op, value, words in changes:
+            if any("\t" in w or "\n" in w for w in words):
+                return False
+            lines.append("\t".join([op, str(int(value))] + words) + "\n")
+
+        with codecs.open(journal_filename, "a", "UTF-8") as f:
+            f.write("".join(lines))
+        return True
+
+    @staticmethod
+    def needs_compaction(filename):
+        if not ModelJournal.is_valid(filename):
+            return True
+        try:
+            journal_size = os.path.getsize(
+                ModelJournal.get_filename(filename))
+            model_size = os.path.getsize(filename)
+        except OSError:
+            return True
+        return journal_size > max(ModelJournal.MIN_COMPACTION_SIZE,
+                                  model_size * ModelJournal.COMPACTION_RATIO)
+
+    @staticmethod
+    def replay(model, filename):
+        """
+        Apply the journaled changes to the freshly loaded model.
+        Returns the number of replayed changes.
+        """
+        journal_filename = ModelJournal.get_filename(filename)
+        try:
+            with codecs.open(journal_filename, "r", "UTF-8") as f:
+                lines = f.readlines()
+        except (IOError, OSError, UnicodeDecodeError) as ex:
+            if os.path.exists(journal_filename):
+                _logger.warning("Failed to read journal '{}': {}"
+                                .format(journal_filename, unicode_str(ex)))
+            return 0
+
+        header = lines[0].rstrip("\n").split("\t") if lines else []
+        if header != [ModelJournal.HEADER,
+                      ModelJournal.get_model_id(filename)]:
+            # Drop it, or later changes would be appended to a
+            # journal that every load skips.
+            _logger.warning("Discarding journal '{}' of a different "
+                            "model file.".format(journal_filename))
+            try:
+                os.remove(journal_filename)
+            except OSError as ex:
+                _logger.warning("Failed to remove journal '{}': {}"
+                                .format(journal_filename,
+                                        unicode_str(ex)))
+            return 0
+
+        num_changes = 0
+        for line in lines[1:]:
+            if not line.endswith("\n"):  # cut short while writing
+                break
+            fields = line[:-1].split("\t")
+            op = fields[0]
+            try:
+                value = int(fields[1])
+            except (IndexError, ValueError):
+                op = None
+            if op == "learn":
+                model.learn_tokens(fields[2:], bool(value))
+            elif op == "count":
+                model.count_ngram(fields[2:], value)
+            else:
+                _logger.warning("Skipping bad journal entry {}"
+                                .format(repr(line)))
+                continue
+            num_changes += 1
+
+        # the changes are persistent, in the journal
+        model.modified = False
+
+        _logger.info("Replayed {} changes from journal '{}'"
+                     .format(num_changes, journal_filename))
+        return num_changes
+
+
 class AutoSaveTimer(Timer):
     """ Auto-save modified language models periodically """
 
-    def __init__(self, mode_cache,
+    def __init__(self, save_models,
                  interval_min=10 * 60,
                  interval_max=30 * 60,
                  postpone_delay=10):
-        self._model_cache = mode_cache
+        self._save_models = save_models
         self._interval_min = interval_min  # in seconds
         self._interval_max = interval_max  # in seconds
         self._postpone_delay = postpone_delay
@@ -654,7 +1389,7 @@ class AutoSaveTimer(Timer):
             _logger.debug("auto-saving language models; "
                           "interval {}, elapsed time {}"
                           .format(self._interval, elapsed))
-            self._model_cache.save_models()
+            self._save_models()
 
         if self._pause:
             self._pause = max(0, self._pause - self._timer_interval)
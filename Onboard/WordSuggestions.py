@@ -43,7 +43,7 @@ from Onboard.Layout            import LayoutPanel
 from Onboard.AtspiStateTracker import AtspiStateTracker
 from Onboard.WPEngine          import WPLocalEngine, ModelCache
 from Onboard.utils             import Rect, unicode_str, escape_markup
-from Onboard.Timer             import CallOnce, Timer, TimerOnce
+from Onboard.Timer             import CallOnce, Timer
 from Onboard.KeyGtk            import FullSizeKey, WordKey
 from Onboard.KeyboardPopups    import PendingSeparatorPopup
 
@@ -72,6 +72,8 @@ class WordSuggestions:
         self._correction_choices = []
         self._correction_span = None
         self._prediction_choices = []
+        self._async_prediction = None  # (request, choices) of last result
+        self._async_model_corrections = None  # (request, choices)
         self.word_infos = []
 
         self._separator_before_key_press = None
@@ -91,6 +93,8 @@ class WordSuggestions:
             self.text_context.cleanup()
         if self._wpengine:
             self._wpengine.cleanup()
+        self._spell_checker.set_async(False)
+        self._spell_checker.save_cache()
 
     def on_layout_loaded(self):
         self._word_list_bars = self.find_items_from_classes((WordListPanel,))
@@ -125,6 +129,11 @@ class WordSuggestions:
             # only enable if there is a wordlist in the layout
             if self._get_wordlist_bars():
                 self._wpengine = WPLocalEngine()
+                self._wpengine.set_async(config.wp.async_prediction)
+                self._wpengine.set_compact_system_models(
+                                        config.wp.compact_system_models)
+                self._wpengine.set_max_user_model_ngrams(
+                                        config.wp.max_user_model_ngrams)
                 self.apply_prediction_profile()
         else:
             if self._wpengine:
@@ -174,17 +183,30 @@ class WordSuggestions:
             self._wpengine.set_models(persistent_models,
                                       auto_learn_models,
                                       scratch_models)
+            self._async_prediction = None
+            self._async_model_corrections = None
+
+            # Language models load in the background on first
+            # prediction, only the languages actually typed in
+            # become resident.
+            self._wpengine.models_loaded_callback = self._on_models_loaded
+
+    def _on_models_loaded(self):
+        """ Models finished loading in the background. """
+        engine = self._wpengine
+        if not engine:
+            return
 
-            # Make sure to load the language models, so there is no
-            # delay on first key press. Don't burden the startup
-            # with this either, run it a little delayed.
-            TimerOnce(1, self._load_models)
-
-    def _load_models(self):
-        self._wpengine.load_models()
-        if not self._load_errors_reported:
+        if not self._load_errors_reported and \
+           engine.are_models_loaded():
             self._load_errors_reported = True
-            self._load_error_recovery.report_errors(self._wpengine)
+            self._load_error_recovery.report_errors(engine)
+
+        # predict again, choices were empty while loading
+        self._async_prediction = None
+        self._async_model_corrections = None
+        self.invalidate_context_ui()
+        self.commit_ui_updates()
 
     def get_system_model_names(self):
         """ Union of all system and user models """
@@ -313,6 +335,27 @@ class WordSuggestions:
         self._update_spell_checker()
         self.commit_ui_updates()
 
+    def on_async_prediction_changed(self):
+        """ On async_prediction changed """
+        if self._wpengine:
+            self._wpengine.set_async(config.wp.async_prediction)
+        self._async_prediction = None
+        self._async_model_corrections = None
+
+    def on_compact_system_models_changed(self):
+        """ On compact_system_models changed """
+        if self._wpengine:
+            self._wpengine.set_compact_system_models(
+                                        config.wp.compact_system_models)
+        self._async_prediction = None
+        self._async_model_corrections = None
+
+    def on_max_user_model_ngrams_changed(self):
+        """ On max_user_model_ngrams changed """
+        if self._wpengine:
+            self._wpengine.set_max_user_model_ngrams(
+                                        config.wp.max_user_model_ngrams)
+
     def on_punctuator_changed(self):
         """ On delayed_word_separators_enabled changed """
         self._update_punctuator()
@@ -336,6 +379,8 @@ class WordSuggestions:
         backend = config.typing_assistance.spell_check_backend \
             if config.is_spell_checker_enabled() else None
         self._spell_checker.set_backend(backend)
+        self._spell_checker.set_async(backend is not None and
+                            config.typing_assistance.async_spell_check)
 
         if backend is not None:
             # chose dicts
@@ -343,6 +388,11 @@ class WordSuggestions:
             dict_ids = [lang_id] if lang_id else []
             self._spell_checker.set_dict_ids(dict_ids)
 
+        self._spell_checker.set_cache_dir(
+            config.get_user_spell_cache_dir()
+            if backend is not None and
+               config.typing_assistance.spell_check_cache else None)
+
         self.invalidate_context_ui()
 
     def invalidate_for_resize(self):
@@ -418,6 +468,8 @@ class WordSuggestions:
     def remove_prediction_context(self, context):
         if self._wpengine:
             self._wpengine.remove_context(context)
+            self._async_prediction = None
+            self._async_model_corrections = None
 
     def _insert_correction_choice(self, key, choice_index):
         """ spelling correction clicked """
@@ -586,11 +638,20 @@ class WordSuggestions:
                     (self._correction_choices,
                      self._correction_span,
                      auto_capitalization) = \
-                        self._find_correction_choices(word_span, False)
+                        self._find_correction_choices(
+                            word_span, False, self._on_async_correction)
+
+    def _on_async_correction(self):
+        """ Spell check result arrived in the main thread. """
+        self.invalidate_context_ui()
+        self.commit_ui_updates()
 
-    def _find_correction_choices(self, word_span, auto_capitalize):
+    def _find_correction_choices(self, word_span, auto_capitalize,
+                                 callback=None):
         """
         Find spelling suggestions for the word at or before the caret.
+        With callback, the spell checker may answer asynchronously,
+        see SpellChecker.find_corrections().
 
         Doctests:
         >>> ws = WordSuggestions()
@@ -623,7 +684,7 @@ class WordSuggestions:
         offset = caret - text_begin  # caret offset into the word
 
         span, choices = \
-            self._spell_checker.find_corrections(word, offset)
+            self._spell_checker.find_corrections(word, offset, callback)
         if choices:
             correction_choices = choices
             correction_span = TextSpan(span[0] + text_begin,
@@ -631,6 +692,19 @@ class WordSuggestions:
                                        span[2],
                                        span[0] + text_begin)
 
+            # Offer close words of the language models first, ranked in
+            # context. They include words the user has learned.
+            # Until they arrive from the worker thread, rank by the
+            # spell checker alone.
+            model_choices = self._find_model_corrections(
+                                 word_span, span, self.MAX_MODEL_CORRECTIONS,
+                                 callback) or []
+            model_choices = [choice for choice in model_choices
+                             if choice != span[2]]
+            correction_choices = model_choices + \
+                [choice for choice in correction_choices
+                 if not choice in model_choices]
+
             # See if there is a valid upper caps variant for
             # auto-capitalization.
             if auto_capitalize:
@@ -648,62 +722,138 @@ class WordSuggestions:
 
         return correction_choices, correction_span, auto_capitalization
 
+    MAX_MODEL_CORRECTIONS = 3
+    MAX_MODEL_CORRECTION_DISTANCE = 2
+
+    def _find_model_corrections(self, word_span, span, limit,
+                                callback=None):
+        """
+        Find words of the language models within a few edits of the
+        sub-word span [begin, end, word] of word_span. The most probable
+        words in the context before it come first.
+
+        In async mode the fuzzy search mustn't wait for the worker
+        thread, which may be busy learning or saving models. With
+        callback, the search runs in the worker thread and callback is
+        called in the main thread once the result arrived. Without, it
+        runs only if the engine is idle. Returns None until a result
+        is available.
+        """
+        engine = self._wpengine
+        if not engine:
+            return []
+
+        text = word_span.get_text_until_span()
+        context = text[:len(text) - len(word_span.get_span_text())] + \
+                  word_span.get_span_text()[:span[1]]
+        request = (context, limit)
+        predict = lambda wait: engine.predict(
+            context, limit,
+            max_edit_distance=self.MAX_MODEL_CORRECTION_DISTANCE,
+            wait=wait)
+
+        if not engine.is_async():
+            return predict(True)
+
+        if self._async_model_corrections and \
+           self._async_model_corrections[0] == request:
+            return self._async_model_corrections[1]
+
+        if callback:
+            engine.predict_async(
+                lambda: predict(True),
+                lambda choices:
+                    self._on_async_model_corrections(request, choices,
+                                                     callback),
+                "corrections")
+            return None
+
+        return predict(False)
+
+    def _on_async_model_corrections(self, request, choices, callback):
+        """ Model corrections arrived in the main thread. """
+        self._async_model_corrections = (request, choices)
+        callback()
+
     def _update_prediction_choices(self):
         """ word prediction: find choices, only once per key press """
-        self._prediction_choices = []
-        text_context = self.text_context
+        engine = self._wpengine
+        if not engine:
+            self._prediction_choices = []
+            return
 
-        if self._wpengine:
+        text_context = self.text_context
+        context = text_context.get_context()
+        if not context:  # don't load models on startup
+            engine.cancel_predictions()
+            self._prediction_choices = []
+            return
 
-            context = text_context.get_context()
-            if context:  # don't load models on startup
-                bot_marker = text_context.get_text_begin_marker()
-                bot_context = text_context.get_pending_bot_context()
-
-                tokens, spans = self._wpengine.tokenize_context(bot_context)
-
-                (case_insensitive_mode, ignore_non_caps,
-                 capitalize, drop_capitalized) = \
-                    self._get_prediction_options(tokens,
-                                                 bool(self.mods[1]),
-                                                 bot_marker)
-
-                _choices = self._wpengine.predict(
-                    bot_context,
-                    config.wp.max_word_choices * 8,
-                    case_insensitive=case_insensitive_mode == 1,
-                    case_insensitive_smart=case_insensitive_mode == 2,
-                    accent_insensitive_smart=config.wp.accent_insensitive,
-                    ignore_non_capitalized=ignore_non_caps)
-
-                choices = []
-                for choice in _choices:
-                    # Filter out begin of text markers that sneak in as
-                    # high frequency unigrams.
-                    if choice.startswith("<bot:"):
-                        continue
-
-                    # Drop upper caps spelling in favor of a lower caps one.
-                    # Auto-capitalization may elect to upper caps on insertion.
-                    if drop_capitalized:
-                        choice_lower = choice.lower()
-                        if choice != choice_lower and \
-                           self._wpengine.word_exists(choice_lower):
-                            continue
-
-                    choices.append(choice)
-
-                # Make all words start upper case
-                if capitalize:
-                    choices = self._capitalize_choices(choices)
+        bot_marker = text_context.get_text_begin_marker()
+        bot_context = text_context.get_pending_bot_context()
+        tokens, spans = engine.tokenize_context(bot_context)
+        request = (bot_context, ) + \
+            self._get_prediction_options(tokens,
+                                         bool(self.mods[1]),
+                                         bot_marker) + \
+            (config.wp.max_word_choices, config.wp.accent_insensitive)
+
+        if engine.is_async():
+            # Use the result if it arrived for the current context,
+            # else keep showing the previous choices until it does.
+            if self._async_prediction and \
+               self._async_prediction[0] == request:
+                self._prediction_choices = self._async_prediction[1]
             else:
-                choices = []
+                engine.predict_async(
+                    lambda: self._find_prediction_choices(engine, request),
+                    lambda choices:
+                        self._on_async_prediction(request, choices))
+        else:
+            self._prediction_choices = \
+                self._find_prediction_choices(engine, request)
 
-            self._prediction_choices = choices
+        # update word information for the input line display
+        # self.word_infos = \
+        #    self.get_word_infos(self.text_context.get_line())
 
-            # update word information for the input line display
-            # self.word_infos = \
-            #    self.get_word_infos(self.text_context.get_line())
+    def _on_async_prediction(self, request, choices):
+        """ Prediction result arrived in the main thread. """
+        self._async_prediction = (request, choices)
+        self.invalidate_context_ui()
+        self.commit_ui_updates()
+
+    def _find_prediction_choices(self, engine, request):
+        """
+        Predict and filter choices. May run in the engine's worker thread.
+        """
+        (bot_context, case_insensitive_mode, ignore_non_caps,
+         capitalize, drop_capitalized,
+         max_word_choices, accent_insensitive) = request
+
+        # Fetch more choices than fit into the word list,
+        # the rest are for paging with "next-predictions".
+        _choices = engine.predict(
+            bot_context,
+            max_word_choices * 8,
+            case_insensitive=case_insensitive_mode == 1,
+            case_insensitive_smart=case_insensitive_mode == 2,
+            accent_insensitive_smart=accent_insensitive,
+            ignore_non_capitalized=ignore_non_caps,
+            # Drop upper caps spelling in favor of a lower caps one.
+            # Auto-capitalization may elect to upper caps on insertion.
+            drop_capitalized=drop_capitalized)
+
+        # Filter out begin of text markers that sneak in as
+        # high frequency unigrams.
+        choices = [choice for choice in _choices
+                   if not choice.startswith("<bot:")]
+
+        # Make all words start upper case
+        if capitalize:
+            choices = self._capitalize_choices(choices)
+
+        return choices
 
     @staticmethod
     def _get_prediction_options(tokens, shift, bot_marker=None):
@@ -795,6 +945,12 @@ class WordSuggestions:
         wis = []
         if text.rstrip():  # don't load models on startup
             tokspans, counts = self._wpengine.lookup_text(text)
+
+            # spell check the whole text at once
+            spans = []
+            if self._spell_checker:
+                spans = self._spell_checker.find_incorrect_spans(text)
+
             for i, t in enumerate(tokspans):
                 start, end, token = t
                 word = text[start:end]
@@ -804,7 +960,8 @@ class WordSuggestions:
                 wi.ignored       = word != token
                 if self._spell_checker:
                     wi.spelling_errors = \
-                        self._spell_checker.find_incorrect_spans(word)
+                        [[b - start, e - start, w] for b, e, w in spans
+                         if b >= start and e <= end]
                 wis.append(wi)
 
         return wis
@@ -1212,12 +1369,23 @@ class WordSuggestions:
             min_auto_correct_length = 2
             max_string_distance = 2
 
-            word = word_span.get_span_text()
+            word = correction_span.get_span_text()
             if len(word) > min_auto_correct_length:
-                choice = correction_choices[0]  # rely on spell checker for now
-                distance = self._string_distance(word, choice)
-                if distance <= max_string_distance:
-                    replacement = choice
+                # Prefer the most probable close word of the language
+                # models, unless that is the word itself. Rely on the
+                # spell checker while the engine is busy.
+                offset = correction_span.begin() - word_span.begin()
+                span = [offset, offset + len(word), word]
+                choices = self._find_model_corrections(
+                    word_span, span, self.MAX_MODEL_CORRECTIONS)
+                if choices:
+                    if choices[0] != word:
+                        replacement = choices[0]
+                else:
+                    choice = correction_choices[0]  # rely on spell checker
+                    distance = self._string_distance(word, choice)
+                    if distance <= max_string_distance:
+                        replacement = choice
 
         return correction_span, replacement
 
@@ -75,7 +75,12 @@ osk_hunspell_spell (PyObject *self, PyObject *args)
     if (!PyArg_ParseTuple (args, "es:spell", encoding, &word))
         return NULL;
 
+    // Don't block the main thread while spell checking in the background.
+    Py_BEGIN_ALLOW_THREADS
     res = Hunspell_spell(oh->hh, word);
+    Py_END_ALLOW_THREADS
+
+    PyMem_Free(word);
 
     return PyLong_FromLong(res);
 }
@@ -100,7 +105,12 @@ osk_hunspell_suggest (PyObject *self, PyObject *args)
     if (!PyArg_ParseTuple (args, "es:suggest", encoding, &word))
         return NULL;
 
+    // suggest() can take a long time, let other threads run meanwhile.
+    Py_BEGIN_ALLOW_THREADS
     n = Hunspell_suggest(oh->hh, &slst, word);
+    Py_END_ALLOW_THREADS
+
+    PyMem_Free(word);
 
     result = PyTuple_New(n);
     if (!result)
@@ -128,6 +138,91 @@ osk_hunspell_suggest (PyObject *self, PyObject *args)
     return result;
 }
 
+/*
+ * Check a sequence of words in one call. Returns a tuple with the
+ * result of spell() for each word. Words that can't be encoded in the
+ * dictionary encoding are reported as misspelled.
+ */
+static PyObject *
+osk_hunspell_spell_words (PyObject *self, PyObject *args)
+{
+    OskHunspell *oh = (OskHunspell*) self;
+    PyObject* words;
+    PyObject* seq;
+    PyObject** encoded;
+    int* res;
+    PyObject* result = NULL;
+    Py_ssize_t i, n;
+
+    char* encoding = Hunspell_get_dic_encoding(oh->hh);
+    if (!encoding)
+    {
+        PyErr_SetString(PyExc_MemoryError, "unknown dictionary encoding");
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple (args, "O:spell_words", &words))
+        return NULL;
+
+    seq = PySequence_Fast(words, "expected a sequence of words");
+    if (!seq)
+        return NULL;
+    n = PySequence_Fast_GET_SIZE(seq);
+
+    encoded = PyMem_New(PyObject*, n);
+    res = PyMem_New(int, n);
+    if (!encoded || !res)
+    {
+        PyMem_Free(encoded);
+        PyMem_Free(res);
+        Py_DECREF(seq);
+        return PyErr_NoMemory();
+    }
+
+    for (i = 0; i < n; i++)
+    {
+        PyObject* word = PySequence_Fast_GET_ITEM(seq, i);
+        if (!PyUnicode_Check(word))
+        {
+            PyErr_SetString(PyExc_TypeError, "words must be strings");
+            n = i;
+            goto cleanup;
+        }
+
+        encoded[i] = PyUnicode_AsEncodedString(word, encoding, "strict");
+        if (!encoded[i])
+        {
+            if (!PyErr_ExceptionMatches(PyExc_UnicodeEncodeError))
+            {
+                n = i;
+                goto cleanup;
+            }
+            PyErr_Clear();
+        }
+    }
+
+    // Check all words without holding the GIL.
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < n; i++)
+        res[i] = encoded[i] ?
+                 Hunspell_spell(oh->hh, PyBytes_AS_STRING(encoded[i])) : 0;
+    Py_END_ALLOW_THREADS
+
+    result = PyTuple_New(n);
+    if (result)
+        for (i = 0; i < n; i++)
+            PyTuple_SET_ITEM(result, i, PyLong_FromLong(res[i]));
+
+cleanup:
+    for (i = 0; i < n; i++)
+        Py_XDECREF(encoded[i]);
+    PyMem_Free(encoded);
+    PyMem_Free(res);
+    Py_DECREF(seq);
+
+    return result;
+}
+
 static PyObject *
 osk_hunspell_get_encoding (PyObject *self, PyObject *args)
 {
@@ -145,6 +240,9 @@ static PyMethodDef osk_hunspell_methods[] = {
     { "suggest",
         osk_hunspell_suggest,
         METH_VARARGS, NULL },
+    { "spell_words",
+        osk_hunspell_spell_words,
+        METH_VARARGS, NULL },
     { "get_encoding",
         osk_hunspell_get_encoding,
         METH_VARARGS, NULL },
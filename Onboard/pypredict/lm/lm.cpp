@@ -178,7 +178,7 @@ class PrefixCmp
             return c1 == c2;
         }
 
-    private:
+    public:
         static wint_t op_lower(wint_t c)
         {
             return towlower(c);
@@ -197,6 +197,7 @@ class PrefixCmp
             return c;
         }
 
+    private:
         static wint_t has_accent(wint_t c)
         {
             return op_remove_accent(c) != c;
@@ -224,18 +225,300 @@ class PrefixCmp
 };
 
 
+//------------------------------------------------------------------------
+// Fuzzy search - words within a maximum edit distance
+//------------------------------------------------------------------------
+// Walks a sorted list of UTF-8 keys like a trie. Rows of the
+// Damerau-Levenshtein (optimal string alignment) matrix are shared
+// between keys with common prefixes, and once all distances of a row
+// exceed the maximum, all keys with that prefix are skipped.
+
+// Decode one code point, invalid bytes are taken as they are.
+static inline uint32_t utf8_next(const char*& s)
+{
+    const unsigned char* p = (const unsigned char*) s;
+    uint32_t c = *p++;
+    int n = c < 0xC0 ? 0 : c < 0xE0 ? 1 : c < 0xF0 ? 2 : 3;
+    if (n)
+        c &= 0x3F >> n;
+    for (; n > 0 && (*p & 0xC0) == 0x80; n--)
+        c = (c << 6) | (*p++ & 0x3F);
+    s = (const char*) p;
+    return c;
+}
+
+template <class TKeys>
+static void fuzzy_search_keys(const TKeys& keys, const char* word,
+                              int max_distance,
+                              vector<WordId>& wids, vector<int>& distances)
+{
+    vector<uint32_t> query;
+    for (const char* s = word; *s;)
+        query.push_back(utf8_next(s));
+
+    int n = query.size();
+    int max_depth = n + max_distance;  // longer keys can't match
+    int w = n + 1;                     // row width
+
+    // rows[d*w + j]: distance between the first d characters of the
+    // key and the first j characters of the query
+    vector<int> rows((max_depth + 1) * w);
+    vector<uint32_t> chars(max_depth + 1);  // characters of the key
+    vector<size_t> offsets(max_depth + 1);  // their byte offsets
+    for (int j = 0; j < w; j++)
+        rows[j] = j;
+
+    const char* prev = "";  // key the rows were computed for
+    int depth = 0;          // number of valid rows after the first
+    uint32_t size = keys.size();
+    uint32_t i = 0;
+    while (i < size)
+    {
+        const char* key = keys.key(i);
+
+        // reuse the rows of the prefix shared with the previous key
+        size_t common = 0;
+        while (common < offsets[depth] && key[common] == prev[common])
+            common++;
+        int d = 0;
+        while (d < depth && offsets[d+1] <= common)
+            d++;
+
+        bool pruned = false;
+        const char* s = key + offsets[d];
+        while (*s)
+        {
+            if (d >= max_depth)
+            {
+                pruned = true;
+                break;
+            }
+
+            uint32_t c = utf8_next(s);
+            chars[d] = c;
+            offsets[d+1] = s - key;
+
+            const int* r0 = &rows[d * w];
+            int* r1 = &rows[(d + 1) * w];
+            int row_min = r1[0] = d + 1;
+            for (int j = 1; j < w; j++)
+            {
+                int v = r0[j-1] + (query[j-1] != c);
+                v = min(v, r0[j] + 1);
+                v = min(v, r1[j-1] + 1);
+                if (d >= 1 && j >= 2 &&
+                    c == query[j-2] && chars[d-1] == query[j-1])
+                    v = min(v, rows[(d - 1) * w + j - 2] + 1);
+                r1[j] = v;
+                row_min = min(row_min, v);
+            }
+            d++;
+
+            if (row_min > max_distance)
+            {
+                pruned = true;
+                break;
+            }
+        }
+        prev = key;
+        depth = d;
+
+        if (pruned)
+        {
+            // skip all keys starting with the first d characters
+            size_t len = offsets[d];
+            uint32_t lo = i + 1;
+            uint32_t hi = size;
+            while (lo < hi)
+            {
+                uint32_t mid = (lo+hi)>>1;
+                if (strncmp(keys.key(mid), key, len) == 0)
+                    lo = mid + 1;
+                else
+                    hi = mid;
+            }
+            i = lo;
+        }
+        else
+        {
+            int distance = rows[d * w + n];
+            if (distance <= max_distance)
+            {
+                wids.push_back(keys.wid(i));
+                distances.push_back(distance);
+            }
+            i++;
+        }
+    }
+}
+
+
+//------------------------------------------------------------------------
+// FoldedIndex - words sorted by their case- and/or accent-folded form
+//------------------------------------------------------------------------
+
+struct cmp_folded_key
+{
+    cmp_folded_key(const vector<char>& _keys) : keys(_keys) {}
+    template <class T>
+    bool operator() (const T& e1, const T& e2)
+    { return strcmp(&keys[e1.key], &keys[e2.key]) < 0; }
+    const vector<char>& keys;
+};
+
+bool FoldedIndex::fold_word(const wchar_t* word, string& key, StrConv& conv)
+{
+    wstring w = word;
+    if (fold & FOLD_CASE)
+        transform(w.begin(), w.end(), w.begin(), PrefixCmp::op_lower);
+    if (fold & FOLD_ACCENTS)
+        transform(w.begin(), w.end(), w.begin(), PrefixCmp::op_remove_accent);
+
+    const char* mb = conv.wc2mb(w.c_str());
+    if (!mb)
+        return false;
+    key = mb;
+    return true;
+}
+
+void FoldedIndex::build(uint32_t _fold, const vector<char*>& words,
+                        StrConv& conv)
+{
+    clear();
+    fold = _fold;
+
+    int size = words.size();
+    entries.reserve(size);
+    string key;
+    for (int i=0; i<size; i++)
+    {
+        const wchar_t* w = conv.mb2wc(words[i]);
+        if (!w || !fold_word(w, key, conv))
+            key = words[i];  // can't fold, keep it searchable as is
+
+        Entry e = {(WordId)i, (uint32_t)keys.size()};
+        keys.insert(keys.end(), key.c_str(), key.c_str() + key.size() + 1);
+        entries.push_back(e);
+    }
+    sort(entries.begin(), entries.end(), cmp_folded_key(keys));
+
+    built = true;
+}
+
+void FoldedIndex::add_word(const char* word, WordId wid, StrConv& conv)
+{
+    string key;
+    const wchar_t* w = conv.mb2wc(word);
+    if (!w || !fold_word(w, key, conv))
+        key = word;
+
+    uint32_t index = lower_bound(key.c_str());
+    Entry e = {wid, (uint32_t)keys.size()};
+    keys.insert(keys.end(), key.c_str(), key.c_str() + key.size() + 1);
+    entries.insert(entries.begin()+index, e);
+}
+
+struct FoldedKeys
+{
+    FoldedKeys(const FoldedIndex& _index) : index(_index) {}
+    uint32_t size() const {return index.entries.size();}
+    const char* key(uint32_t i) const {return index.get_key(i);}
+    WordId wid(uint32_t i) const {return index.entries[i].wid;}
+    const FoldedIndex& index;
+};
+
+void FoldedIndex::fuzzy_search(const wchar_t* word, int max_distance,
+                               vector<WordId>& wids, vector<int>& distances,
+                               StrConv& conv)
+{
+    string key;
+    if (!fold_word(word, key, conv))
+        return;
+
+    fuzzy_search_keys(FoldedKeys(*this), key.c_str(), max_distance,
+                      wids, distances);
+}
+
+void FoldedIndex::search(const wchar_t* prefix, vector<WordId>& wids,
+                         StrConv& conv)
+{
+    string key;
+    if (!fold_word(prefix, key, conv))
+        return;
+
+    size_t len = key.size();
+    uint32_t size = entries.size();
+    for (uint32_t i = lower_bound(key.c_str()); i<size; i++)
+    {
+        if (strncmp(get_key(i), key.c_str(), len) != 0)
+            break;
+        wids.push_back(entries[i].wid);
+    }
+}
+
+
 //------------------------------------------------------------------------
 // Dictionary - holds the vocabulary of the language model
 //------------------------------------------------------------------------
 
+// FoldedIndex flags for the case and accent options of predictions
+static uint32_t options_to_fold(uint32_t options)
+{
+    uint32_t fold = 0;
+    if (options & (LanguageModel::CASE_INSENSITIVE |
+                   LanguageModel::CASE_INSENSITIVE_SMART))
+        fold |= FoldedIndex::FOLD_CASE;
+    if (options & (LanguageModel::ACCENT_INSENSITIVE |
+                   LanguageModel::ACCENT_INSENSITIVE_SMART))
+        fold |= FoldedIndex::FOLD_ACCENTS;
+    return fold;
+}
+
+// Words in sorted order, control words are left out unless
+// they are sorted too.
+struct Dictionary::SortedKeys
+{
+    SortedKeys(const Dictionary& _dict) : dict(_dict) {}
+    uint32_t size() const
+    {
+        if (dict.sorted)
+            return dict.sorted->size();
+        return dict.words.size() - dict.sorted_words_begin;
+    }
+    const char* key(uint32_t i) const {return dict.words[get_wid(i)];}
+    WordId wid(uint32_t i) const {return get_wid(i);}
+    WordId get_wid(uint32_t i) const
+    {
+        if (dict.sorted)
+            return (*dict.sorted)[i];
+        return dict.sorted_words_begin + i;
+    }
+    const Dictionary& dict;
+};
+
+struct cmp_index_wid
+{
+    cmp_index_wid(const vector<WordId>& _wids) : wids(_wids) {}
+    bool operator() (int32_t i1, int32_t i2)
+    { return wids[i1] < wids[i2]; }
+    const vector<WordId>& wids;
+};
+
 void Dictionary::clear()
 {
-    vector<char*>::iterator it;
-    for (it=words.begin(); it < words.end(); it++)
-        MemFree(*it);
+    if (!external_words)
+    {
+        vector<char*>::iterator it;
+        for (it=words.begin(); it < words.end(); it++)
+            MemFree(*it);
+    }
+    external_words = false;
 
     vector<char*>().swap(words);  // clear and really free the memory
 
+    for (int i=0; i<ALEN(folded_indexes); i++)
+        folded_indexes[i].clear();
+
     if (sorted)
     {
         delete sorted;
@@ -259,7 +542,8 @@ struct cmp_str
 //   the dictionary already (vector "words").
 // - If new_words contains control words, they are
 //   located close to its begin.
-LMError Dictionary::set_words(const vector<wchar_t*>& new_words)
+LMError Dictionary::set_words(const vector<const char*>& new_words,
+                              vector<WordId>* wids)
 {
     // This is the goal: keep "sorted" unallocated
     // (for large static system models).
@@ -269,15 +553,18 @@ LMError Dictionary::set_words(const vector<wchar_t*>& new_words)
         sorted = NULL;
     }
 
-    // encode as utf-8 and store in "words"
+    // rebuild prefix indexes on demand
+    for (int i=0; i<ALEN(folded_indexes); i++)
+        folded_indexes[i].clear();
+
+    // store the utf-8 encoded words in "words"
     int initial_size = words.size(); // number of initial control words
     int n = new_words.size();
+    if (wids)
+        wids->resize(n);
     for (int i = 0; i<n; i++)
     {
-        // encode word to utf-8, this is how it is stored in the dictionary
-        const char* wtmp = conv.wc2mb(new_words[i]);
-        if (!wtmp)
-            return ERR_WC2MB;
+        const char* wtmp = new_words[i];
         char* w = (char*)MemAlloc((strlen(wtmp) + 1) * sizeof(char));
         if (!w)
             return ERR_MEMORY;
@@ -293,6 +580,8 @@ LMError Dictionary::set_words(const vector<wchar_t*>& new_words)
                 if (strcmp(w, words[j]) == 0)
                 {
                     exists = true;
+                    if (wids)
+                        (*wids)[i] = j;
                     break;
                 }
             }
@@ -300,16 +589,39 @@ LMError Dictionary::set_words(const vector<wchar_t*>& new_words)
 
         // add it, if it wasn't a known control word
         if (!exists)
+        {
+            if (wids)
+                (*wids)[i] = words.size();
             words.push_back(w);
+        }
     }
 
     // sort words, make sure to use the same comparison function
     // as Dictionary::search_index.
+    // Saved models usually come sorted already, skip sorting then.
     cmp_str cmp;
-    sort(words.begin()+initial_size, words.end(), cmp);
+    bool is_sorted = std::is_sorted(words.begin()+initial_size,
+                                    words.end(), cmp);
+    if (!is_sorted)
+        sort(words.begin()+initial_size, words.end(), cmp);
 
     sorted_words_begin = initial_size;
 
+    if (wids)
+    {
+        for (int i = 0; i<n; i++)
+        {
+            WordId& wid = (*wids)[i];
+            if (wid < (WordId)initial_size)  // control word
+                continue;
+            if (!is_sorted)
+                wid = word_to_id(new_words[i]);
+            else
+            if (i > 0 && strcmp(new_words[i], new_words[i-1]) == 0)
+                wid = (*wids)[i-1];  // duplicate, lookup finds the first
+        }
+    }
+
     return ERR_NONE;
 }
 
@@ -317,6 +629,14 @@ LMError Dictionary::set_words(const vector<wchar_t*>& new_words)
 WordId Dictionary::word_to_id(const wchar_t* word)
 {
     const char* w = conv.wc2mb(word);
+    if (!w)
+        return WIDNONE;
+    return word_to_id(w);
+}
+
+// Lookup the given utf-8 encoded word and return its id, binary search
+WordId Dictionary::word_to_id(const char* w)
+{
     int index = search_index(w);
     if (index >= 0 && index < (int)words.size())
     {
@@ -347,6 +667,19 @@ const wchar_t* Dictionary::id_to_word(WordId wid)
     return NULL;
 }
 
+void Dictionary::set_external_words(const vector<char*>& new_words,
+                                    int new_sorted_words_begin,
+                                    const vector<WordId>* new_sorted)
+{
+    clear();
+
+    words = new_words;
+    sorted_words_begin = new_sorted_words_begin;
+    if (new_sorted)
+        sorted = new vector<WordId>(*new_sorted);
+    external_words = true;
+}
+
 // Add a word to the dictionary
 WordId Dictionary::add_word(const wchar_t* word)
 {
@@ -362,6 +695,10 @@ WordId Dictionary::add_word(const wchar_t* word)
     WordId wid = (WordId)words.size();
     update_sorting(w, wid);
 
+    for (int i=0; i<ALEN(folded_indexes); i++)
+        if (folded_indexes[i].is_built())
+            folded_indexes[i].add_word(w, wid, conv);
+
     words.push_back(w);
 
     return wid;
@@ -421,6 +758,37 @@ void Dictionary::prefix_search(const wchar_t* prefix,
         }
     }
     else
+    // Binary search through one of the sorted indexes, then
+    // check the candidates with the exact matching rules.
+    if (prefix && prefix[0])
+    {
+        uint32_t fold = options_to_fold(options);
+
+        std::vector<WordId> wids;
+        if (fold)
+            prefix_search_folded(prefix, fold, wids);
+        else
+        {
+            const char* mbprefix = conv.wc2mb(prefix);
+            if (!mbprefix)
+                return;
+            prefix_search_sorted(mbprefix, wids);
+        }
+
+        // keep results in word id order like the exhaustive search
+        sort(wids.begin(), wids.end());
+
+        PrefixCmp cmp = PrefixCmp(prefix, options);
+        std::vector<WordId>::const_iterator it;
+        for(it = wids.begin(); it != wids.end(); it++)
+        {
+            WordId wid = *it;
+            if (wid >= min_wid &&
+                cmp.matches(words[wid]))
+                wids_out.push_back(wid);
+        }
+    }
+    else
     // exhaustive search through the dictionary
     {
         PrefixCmp cmp = PrefixCmp(prefix, options);
@@ -431,6 +799,100 @@ void Dictionary::prefix_search(const wchar_t* prefix,
     }
 }
 
+// Find all words within max_distance edits of word, results are
+// sorted by word id. Case and accent options compare folded words.
+void Dictionary::fuzzy_search(const wchar_t* word, int max_distance,
+                              vector<WordId>& wids_out,
+                              vector<int>& distances_out,
+                              uint32_t options)
+{
+    WordId min_wid = (options & LanguageModel::INCLUDE_CONTROL_WORDS) \
+                     ? 0 : NUM_CONTROL_WORDS;
+
+    vector<WordId> wids;
+    vector<int> distances;
+    uint32_t fold = options_to_fold(options);
+    if (fold)
+    {
+        FoldedIndex& index = folded_indexes[fold-1];
+        if (!index.is_built())
+            index.build(fold, words, conv);
+        index.fuzzy_search(word, max_distance, wids, distances, conv);
+    }
+    else
+    {
+        const char* mbword = conv.wc2mb(word);
+        if (!mbword)
+            return;
+        string key = mbword;
+        fuzzy_search_keys(SortedKeys(*this), key.c_str(), max_distance,
+                          wids, distances);
+    }
+
+    // sort by word id, keep only words passing the capitalization options
+    vector<int32_t> argsort(wids.size());
+    for (int i=0; i<(int)wids.size(); i++)
+        argsort[i] = i;
+    sort(argsort.begin(), argsort.end(), cmp_index_wid(wids));
+
+    PrefixCmp cmp = PrefixCmp(NULL, options);
+    vector<int32_t>::const_iterator it;
+    for(it = argsort.begin(); it != argsort.end(); it++)
+    {
+        WordId wid = wids[*it];
+        if (wid >= min_wid &&
+            cmp.matches(words[wid]))
+        {
+            wids_out.push_back(wid);
+            distances_out.push_back(distances[*it]);
+        }
+    }
+}
+
+// Collect all words starting with the UTF-8 encoded prefix.
+void Dictionary::prefix_search_sorted(const char* prefix,
+                                      std::vector<WordId>& wids)
+{
+    int i;
+    size_t len = strlen(prefix);
+    int size = words.size();
+
+    if (sorted)
+    {
+        for (i = binsearch_sorted(prefix); i<size; i++)
+        {
+            WordId wid = (*sorted)[i];
+            if (strncmp(words[wid], prefix, len) != 0)
+                break;
+            wids.push_back(wid);
+        }
+    }
+    else
+    {
+        for (i = binsearch_words(prefix); i<size; i++)
+        {
+            if (strncmp(words[i], prefix, len) != 0)
+                break;
+            wids.push_back(i);
+        }
+
+        // control words aren't sorted
+        for (i = 0; i<sorted_words_begin; i++)
+            if (strncmp(words[i], prefix, len) == 0)
+                wids.push_back(i);
+    }
+}
+
+// Collect all words whose folded form starts with the folded prefix.
+void Dictionary::prefix_search_folded(const wchar_t* prefix, uint32_t fold,
+                                      std::vector<WordId>& wids)
+{
+    FoldedIndex& index = folded_indexes[fold-1];
+    if (!index.is_built())
+        index.build(fold, words, conv);
+    index.search(prefix, wids, conv);
+}
+
 // lookup word
 // return value: 0 = no match
 //               1 = exact match
@@ -460,7 +922,7 @@ int Dictionary::lookup_word(const wchar_t* word)
     // then count partial matches
     for (int i=index; i<size; i++)
     {
-        WordId wid = sorted ? (*sorted)[index] : index;
+        WordId wid = sorted ? (*sorted)[i] : i;
         if (strncmp(words[wid], w, len) != 0)
             break;
         count++;
@@ -479,8 +941,9 @@ uint64_t Dictionary::get_memory_size()
     sum += d;
 
     uint64_t w = 0;
-    for (unsigned i=0; i<words.size(); i++)
-        w += (strlen(words[i]) + 1);
+    if (!external_words)
+        for (unsigned i=0; i<words.size(); i++)
+            w += (strlen(words[i]) + 1);
     sum += w;
 
     uint64_t wc = sizeof(char*) * words.capacity();
@@ -489,6 +952,9 @@ uint64_t Dictionary::get_memory_size()
     uint64_t sc = sorted ? sizeof(WordId) * sorted->capacity() : 0;
     sum += sc;
 
+    for (int i=0; i<ALEN(folded_indexes); i++)
+        sum += folded_indexes[i].get_memory_size();
+
     #ifndef NDEBUG
     printf("dictionary object: %12ld Byte\n", d);
     printf("strings:           %12ld Byte (%u)\n", w, (unsigned)words.size());
@@ -566,7 +1032,8 @@ void LanguageModel::get_candidates(const std::vector<WordId>& history,
 
 void LanguageModel::predict(std::vector<LanguageModel::Result>& results,
                             const std::vector<wchar_t*>& context,
-                            int limit, uint32_t options)
+                            int limit, uint32_t options,
+                            PredictionSession* session)
 {
     int i;
 
@@ -584,14 +1051,27 @@ void LanguageModel::predict(std::vector<LanguageModel::Result>& results,
     const wchar_t* prefix = split_context(context, h);
     vector<WordId> history = words_to_ids(h);
 
-    // get candidate words, completion
+    // get candidate words, completion or correction
     vector<WordId> wids;
-    get_candidates(history, prefix, wids, options);
+    vector<int> distances;
+    int max_edit_distance = get_max_edit_distance(options);
+    if (max_edit_distance && prefix && prefix[0])
+        get_fuzzy_candidates(prefix, max_edit_distance, wids, distances,
+                             options);
+    else
+    if (session)
+        get_session_candidates(session, history, prefix, wids, options);
+    else
+        get_candidates(history, prefix, wids, options);
 
     // calculate probability vector
     vector<double> probabilities(wids.size());
     get_probs(history, wids, probabilities);
 
+    // rank corrections by probability in context and edit distance
+    for (i=0; i<(int)distances.size(); i++)
+        probabilities[i] *= pow(FUZZY_PENALTY, distances[i]);
+
     // prepare results vector
     int result_size = wids.size();
     if (limit >= 0 && limit < result_size)
@@ -599,6 +1079,10 @@ void LanguageModel::predict(std::vector<LanguageModel::Result>& results,
     results.clear();
     results.reserve(result_size);
 
+    // Dropping capitalized words happens while collecting results,
+    // so that only as many words are looked up as the limit requires.
+    bool drop_capitalized = options & DROP_CAPITALIZED;
+
     if (!(options & NO_SORT)) // allow to skip sorting for calls from another model, i.e. linint
     {
         // sort by descending probabilities
@@ -608,12 +1092,15 @@ void LanguageModel::predict(std::vector<LanguageModel::Result>& results,
         stable_argsort_desc(argsort, probabilities);
 
         // merge word ids and probabilities into the return array
-        for (i=0; i<result_size; i++)
+        for (i=0; i<(int)wids.size() &&
+                  (int)results.size() < result_size; i++)
         {
             int index = argsort[i];
             const wchar_t* word = id_to_word(wids[index]);
             if (word)
             {
+                if (drop_capitalized && has_lower_case_variant(word))
+                    continue;
                 Result result = {word, probabilities[index]};
                 results.push_back(result);
             }
@@ -622,11 +1109,14 @@ void LanguageModel::predict(std::vector<LanguageModel::Result>& results,
     else
     {
         // merge word ids and probabilities into the return array
-        for (int i=0; i<result_size; i++)
+        for (int i=0; i<(int)wids.size() &&
+                      (int)results.size() < result_size; i++)
         {
             const wchar_t* word = id_to_word(wids[i]);
             if (word)
             {
+                if (drop_capitalized && has_lower_case_variant(word))
+                    continue;
                 Result result = {word, probabilities[i]};
                 results.push_back(result);
             }
@@ -634,6 +1124,95 @@ void LanguageModel::predict(std::vector<LanguageModel::Result>& results,
     }
 }
 
+// Is word spelled with upper case characters and does its
+// all lower case spelling exist in the model too?
+bool LanguageModel::has_lower_case_variant(const wchar_t* word)
+{
+    wstring w(word);
+    bool has_upper = false;
+    for (size_t i=0; i<w.size(); i++)
+    {
+        wchar_t c = (wchar_t) towlower(w[i]);
+        if (c != w[i])
+        {
+            w[i] = c;
+            has_upper = true;
+        }
+    }
+
+    return has_upper && lookup_word(w.c_str()) == 1;
+}
+
+const double LanguageModel::FUZZY_PENALTY = 0.01;
+
+// Words within max_distance edits of word, sorted by word id
+// for get_probs().
+void LanguageModel::get_fuzzy_candidates(const wchar_t* word,
+                                         int max_distance,
+                                         std::vector<WordId>& candidates,
+                                         std::vector<int>& distances,
+                                         uint32_t options)
+{
+    vector<WordId> wids;
+    vector<int> dists;
+    dictionary.fuzzy_search(word, max_distance, wids, dists, options);
+
+    // Filter out words with removed unigrams.
+    filter_candidates(wids, candidates);
+
+    // candidates are an ordered subset of wids
+    size_t j = 0;
+    distances.reserve(candidates.size());
+    vector<WordId>::const_iterator it;
+    for (it = candidates.begin(); it != candidates.end(); it++)
+    {
+        while (wids[j] != *it)
+            j++;
+        distances.push_back(dists[j]);
+    }
+}
+
+// Narrow down the candidates of the previous prediction when the prefix
+// was only extended, else search from scratch and remember the results.
+void LanguageModel::get_session_candidates(PredictionSession* session,
+                                           const std::vector<WordId>& history,
+                                           const wchar_t* prefix,
+                                           std::vector<WordId>& candidates,
+                                           uint32_t options)
+{
+    PredictionSession::State& state = session->get_state(this);
+    wstring new_prefix = prefix ? prefix : L"";
+
+    // Words matching the extended prefix are a subset of the previous
+    // matches. Not true for an empty prefix, that may only include
+    // words with predictions.
+    if (state.change_id == get_change_id() &&
+        state.options == options &&
+        state.history == history &&
+        !state.prefix.empty() &&
+        new_prefix.compare(0, state.prefix.size(), state.prefix) == 0)
+    {
+        if (new_prefix.size() == state.prefix.size())
+            candidates = state.candidates;
+        else
+            // candidates stay sorted
+            dictionary.prefix_search(new_prefix.c_str(), &state.candidates,
+                                     candidates, options);
+        session->num_reused++;
+    }
+    else
+    {
+        get_candidates(history, prefix, candidates, options);
+        session->num_searched++;
+    }
+
+    state.change_id = get_change_id();
+    state.options = options;
+    state.history = history;
+    state.prefix = new_prefix;
+    state.candidates = candidates;
+}
+
 // Return the probability of a single n-gram.
 // This is very inefficient, not optimized for speed at all, but it's
 // basically only there for entropy testing and not involved in
@@ -30,6 +30,7 @@
 #include <vector>
 #include <map>
 #include <algorithm>
+#include <atomic>
 #include <string>
 
 
@@ -87,6 +88,7 @@ enum LMError
     ERR_UNEXPECTED_EOF,
     ERR_WC2MB,
     ERR_MD2WC,
+    ERR_FORMAT,
 };
 
 template <class T>
@@ -110,9 +112,8 @@ class StrConv
             char* inptr = const_cast<char*>(instr);
             size_t inbytes = strlen(instr);
 
-            static char outstr[4096];
-            char* outptr = outstr;
-            size_t outbytes = sizeof(outstr);
+            char* outptr = (char*) wc_buf;
+            size_t outbytes = sizeof(wc_buf);
 
             size_t nconv;
 
@@ -134,7 +135,7 @@ class StrConv
             if (outbytes >= sizeof (wchar_t))
                 *((wchar_t *) outptr) = L'\0';
 
-            return (wchar_t *) outstr;
+            return wc_buf;
         }
 
         // encode wide-char to multi-byte
@@ -143,9 +144,8 @@ class StrConv
             char* inptr = (char*)instr;
             size_t inbytes = wcslen(instr) * sizeof(*instr);
 
-            static char outstr[4096];
-            char* outptr = outstr;
-            size_t outbytes = sizeof(outstr);
+            char* outptr = mb_buf;
+            size_t outbytes = sizeof(mb_buf);
 
             size_t nconv = iconv(cd_wc_mb, &inptr, &inbytes,
                                            &outptr, &outbytes);
@@ -166,11 +166,102 @@ class StrConv
             if (outbytes >= sizeof (wchar_t))
                 *outptr = '\0';
 
-            return outstr;
+            return mb_buf;
         }
     private:
         iconv_t cd_mb_wc;
         iconv_t cd_wc_mb;
+
+        // per instance, models may be used from different threads
+        wchar_t wc_buf[4096 / sizeof(wchar_t)];
+        char mb_buf[4096];
+};
+
+
+//------------------------------------------------------------------------
+// FoldedIndex - words sorted by their case- and/or accent-folded form
+//------------------------------------------------------------------------
+// Allows prefix searches in O(log n) for case- and accent-insensitive
+// completion. The folded prefix range is a superset of the exact matches,
+// results have to be checked against the original prefix.
+
+class FoldedIndex
+{
+    public:
+        enum Fold
+        {
+            FOLD_CASE    = 1<<0,
+            FOLD_ACCENTS = 1<<1,
+        };
+
+        FoldedIndex()
+        {
+            fold = 0;
+            built = false;
+        }
+
+        void clear()
+        {
+            std::vector<Entry>().swap(entries);
+            std::vector<char>().swap(keys);
+            built = false;
+        }
+
+        bool is_built() {return built;}
+
+        void build(uint32_t fold, const std::vector<char*>& words,
+                   StrConv& conv);
+        void add_word(const char* word, WordId wid, StrConv& conv);
+
+        // append word ids of all words whose folded form
+        // starts with the folded prefix
+        void search(const wchar_t* prefix, std::vector<WordId>& wids,
+                    StrConv& conv);
+
+        // append word ids and edit distances of all words whose folded
+        // form is within max_distance edits of the folded word
+        void fuzzy_search(const wchar_t* word, int max_distance,
+                          std::vector<WordId>& wids,
+                          std::vector<int>& distances,
+                          StrConv& conv);
+
+        uint64_t get_memory_size()
+        {
+            return sizeof(Entry) * entries.capacity() + keys.capacity();
+        }
+
+    private:
+        bool fold_word(const wchar_t* word, std::string& key, StrConv& conv);
+        const char* get_key(uint32_t i) const {return &keys[entries[i].key];}
+
+        // binary search for index of insertion point (std:lower_bound())
+        uint32_t lower_bound(const char* key)
+        {
+            uint32_t lo = 0;
+            uint32_t hi = entries.size();
+            while (lo < hi)
+            {
+                uint32_t mid = (lo+hi)>>1;
+                if (strcmp(get_key(mid), key) < 0)
+                    lo = mid + 1;
+                else
+                    hi = mid;
+            }
+            return lo;
+        }
+
+    private:
+        struct Entry
+        {
+            WordId wid;
+            uint32_t key;   // offset into keys
+        };
+        uint32_t fold;
+        bool built;
+        std::vector<Entry> entries;  // sorted by folded key
+        std::vector<char> keys;      // folded UTF-8 words, '\0'-terminated
+
+    friend struct FoldedKeys;
 };
 
 
@@ -184,18 +275,30 @@ class Dictionary
         Dictionary()
         {
             sorted = NULL;
+            external_words = false;
             clear();
         }
 
         void clear();
 
         WordId word_to_id(const wchar_t* word);
+        // Lookup of utf-8 encoded words. Doesn't modify the dictionary
+        // and may be called from several threads at once.
+        WordId word_to_id(const char* word);
         const wchar_t* id_to_word(WordId wid);
         std::vector<WordId> words_to_ids(const wchar_t** word, int n);
 
-        LMError set_words(const std::vector<wchar_t*>& new_words);
+        // Bulk-add utf-8 encoded words, optionally return their ids.
+        LMError set_words(const std::vector<const char*>& new_words,
+                          std::vector<WordId>* wids = NULL);
         WordId add_word(const wchar_t* word);
 
+        // Take words owned by someone else, e.g. a memory mapped file.
+        // They are left alone on clear() and must not be modified.
+        void set_external_words(const std::vector<char*>& new_words,
+                                int new_sorted_words_begin,
+                                const std::vector<WordId>* new_sorted);
+
         // get word ids, add unknown words as needed
         bool query_add_words(const wchar_t* const* new_words, int n,
                              std::vector<WordId>& wids,
@@ -233,6 +336,12 @@ class Dictionary
                            uint32_t options = 0);
         int lookup_word(const wchar_t* word);
 
+        // words within max_distance edits of word, sorted by word id
+        void fuzzy_search(const wchar_t* word, int max_distance,
+                          std::vector<WordId>& wids,
+                          std::vector<int>& distances,
+                          uint32_t options = 0);
+
         int get_num_word_types() {return words.size();}
 
         uint64_t get_memory_size();
@@ -299,11 +408,73 @@ class Dictionary
 
         void update_sorting(const char* word, WordId wid);
 
+        // candidates for prefix_search(), sub-linear in dictionary size
+        void prefix_search_sorted(const char* prefix,
+                                  std::vector<WordId>& wids);
+        void prefix_search_folded(const wchar_t* prefix, uint32_t fold,
+                                  std::vector<WordId>& wids);
+
+        struct SortedKeys;
+
     protected:
         std::vector<char*> words;
         std::vector<WordId>* sorted;  // only when words aren't already sorted
         int sorted_words_begin;
+        bool external_words;          // words aren't owned by the dictionary
         StrConv conv;
+
+        // built on demand, per combination of FoldedIndex::Fold flags
+        FoldedIndex folded_indexes[3];
+
+    friend class CompiledModel;
+};
+
+
+//------------------------------------------------------------------------
+// PredictionSession - candidate words carried over between predictions
+//------------------------------------------------------------------------
+// Typing "t", "th", "the" only has to narrow down the candidates of the
+// previous keystroke instead of searching the whole dictionary again.
+// There is one state per language model, merged models pass the session
+// on to their components.
+
+class LanguageModel;
+
+class PredictionSession
+{
+    public:
+        struct State
+        {
+            uint64_t change_id;          // model contents at the time
+            uint32_t options;
+            std::vector<WordId> history;
+            std::wstring prefix;
+            std::vector<WordId> candidates;
+        };
+
+        PredictionSession()
+        {
+            clear();
+        }
+
+        void clear()
+        {
+            states.clear();
+            num_reused = 0;
+            num_searched = 0;
+        }
+
+        State& get_state(const LanguageModel* model)
+        {
+            return states[model];
+        }
+
+    public:
+        int num_reused;     // number of narrowed down candidate searches
+        int num_searched;   // number of full candidate searches
+
+    private:
+        std::map<const LanguageModel*, State> states;
 };
 
 
@@ -339,6 +510,17 @@ class LanguageModel
             NORMALIZE              = 1<<8, // explicit normalization for
                                            // overlay and loglinint, everything
                                            // else ought to be normalized already.
+
+            // Candidates are words within up to 1, 2 or 3 edits of the
+            // completion prefix, instead of words starting with it.
+            // Probabilities are lowered by FUZZY_PENALTY per edit.
+            MAX_EDIT_DISTANCE_1    = 1<<9,
+            MAX_EDIT_DISTANCE_2    = 2<<9,
+            MAX_EDIT_DISTANCE_MASK = 3<<9,
+
+            // Drop capitalized words whose all lower case spelling
+            // is known too, e.g. "The" when "the" exists.
+            DROP_CAPITALIZED       = 1<<11,
             FILTER_OPTIONS         = CASE_INSENSITIVE |
                                      ACCENT_INSENSITIVE |
                                      ACCENT_INSENSITIVE_SMART |
@@ -350,6 +532,7 @@ class LanguageModel
     public:
         LanguageModel()
         {
+            set_changed();
         }
 
         virtual ~LanguageModel()
@@ -359,6 +542,14 @@ class LanguageModel
         virtual void clear()
         {
             dictionary.clear();
+            set_changed();
+        }
+
+        // Unique id of the current model contents, changes
+        // whenever words or n-grams are added, removed or cleared.
+        uint64_t get_change_id()
+        {
+            return change_id;
         }
 
         // never fails
@@ -389,16 +580,21 @@ class LanguageModel
             return w;
         }
 
-        int lookup_word(const wchar_t* word)
+        // 0 for no match, 1 for an exact match or -n for n partial
+        // (prefix) matches.
+        virtual int lookup_word(const wchar_t* word)
         {
             return dictionary.lookup_word(word);
         }
 
+        bool has_lower_case_variant(const wchar_t* word);
+
         typedef struct {std::wstring word; double p;} Result;
         virtual void predict(std::vector<LanguageModel::Result>& results,
                              const std::vector<wchar_t*>& context,
                              int limit=-1,
-                             uint32_t options = DEFAULT_OPTIONS);
+                             uint32_t options = DEFAULT_OPTIONS,
+                             PredictionSession* session = NULL);
 
         virtual double get_probability(const wchar_t* const* ngram, int n);
 
@@ -406,6 +602,14 @@ class LanguageModel
 
         virtual bool is_model_valid() = 0;
 
+        // Probability factor per edit of fuzzy matches.
+        static const double FUZZY_PENALTY;
+
+        static int get_max_edit_distance(uint32_t options)
+        {
+            return (options & MAX_EDIT_DISTANCE_MASK) / MAX_EDIT_DISTANCE_1;
+        }
+
         virtual LMError load(const char* filename) = 0;
         virtual LMError save(const char* filename) = 0;
 
@@ -420,6 +624,15 @@ class LanguageModel
                                     const wchar_t* prefix,
                                     std::vector<WordId>& wids,
                                     uint32_t options);
+        void get_fuzzy_candidates(const wchar_t* word, int max_distance,
+                                  std::vector<WordId>& wids,
+                                  std::vector<int>& distances,
+                                  uint32_t options);
+        void get_session_candidates(PredictionSession* session,
+                                    const std::vector<WordId>& history,
+                                    const wchar_t* prefix,
+                                    std::vector<WordId>& wids,
+                                    uint32_t options);
         virtual void filter_candidates(const std::vector<WordId>& in,
                                              std::vector<WordId>& out)
         {
@@ -431,8 +644,18 @@ class LanguageModel
         {}
         LMError read_utf8(const char* filename, wchar_t*& text);
 
+        void set_changed()
+        {
+            // atomic, models may change in several threads at once
+            static std::atomic<uint64_t> last_change_id(0);
+            change_id = ++last_change_id;
+        }
+
     public:
         Dictionary dictionary;
+
+    private:
+        uint64_t change_id;
 };
 
 
@@ -0,0 +1,792 @@
+/*
+ * Copyright © 2026 marmuta <marmvta@gmail.com>
+ *
+ * This file is part of Onboard.
+ *
+ * Onboard is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Onboard is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+#include "lm_compiled.h"
+
+using namespace std;
+
+
+static inline uint64_t align8(uint64_t offset)
+{
+    return (offset + 7) & ~(uint64_t)7;
+}
+
+// Does the block [offset, offset+size) fit into limit bytes?
+static inline bool is_in_range(uint64_t offset, uint64_t size, uint64_t limit)
+{
+    return offset <= limit && size <= limit - offset;
+}
+
+//------------------------------------------------------------------------
+// CompiledModel - read-only n-gram model, memory mapped from a binary file
+//                 or compiled in memory from another model
+//------------------------------------------------------------------------
+
+// preorder traversal, including removed nodes
+void CompiledModel::ngrams_iter::next_node()
+{
+    if (done)
+        return;
+
+    if (model->levels.empty())
+    {
+        done = true;
+        return;
+    }
+
+    // descend to the first child, if there is one
+    int level = indexes.size();
+    uint32_t begin, end;
+    model->get_child_range(level, level ? indexes.back() : 0, begin, end);
+    if (begin < end)
+    {
+        indexes.push_back(begin);
+        ends.push_back(end);
+        return;
+    }
+
+    // else continue with the next sibling, ascend as needed
+    while (!indexes.empty())
+    {
+        if (++indexes.back() < ends.back())
+            return;
+        indexes.pop_back();
+        ends.pop_back();
+    }
+    done = true;
+}
+
+void CompiledModel::clear()
+{
+    if (data)
+    {
+        if (image.empty())
+            munmap(const_cast<uint8_t*>(data), data_size);
+        data = NULL;
+        data_size = 0;
+    }
+    vector<uint8_t>().swap(image);
+    vector<LevelInfo>().swap(levels);
+    vector<double>().swap(Ds);
+    order = 0;
+
+    // Don't add control words like DynamicModelBase::clear() does,
+    // the model is read-only.
+    LanguageModel::clear();
+}
+
+LMError CompiledModel::load(const char* filename)
+{
+    clear();
+
+    LMError error = map_file(filename);
+    if (!error)
+        error = validate();
+    if (error)
+        clear();
+
+    return error;
+}
+
+// Compile the n-grams of any dynamic model in memory, same layout
+// as the file. The result is a read-only copy of the model with
+// contiguous levels, usually much smaller than the source model.
+LMError CompiledModel::compile(DynamicModelBase* model)
+{
+    clear();
+
+    LMError error = build_image(model, image);
+    if (!error)
+    {
+        data = &image[0];
+        data_size = image.size();
+        error = validate();
+    }
+    if (error)
+        clear();
+
+    return error;
+}
+
+LMError CompiledModel::map_file(const char* filename)
+{
+    int fd = open(filename, O_RDONLY);
+    if (fd < 0)
+        return ERR_FILE;
+
+    struct stat st;
+    if (fstat(fd, &st) < 0)
+    {
+        close(fd);
+        return ERR_FILE;
+    }
+
+    if (st.st_size < (off_t)sizeof(CompiledHeader))
+    {
+        close(fd);
+        return ERR_FORMAT;
+    }
+
+    // Read-only shared mapping, the pages are shared with
+    // every other process using the same model.
+    void* p = mmap(NULL, st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);
+    if (p == MAP_FAILED)
+        return ERR_FILE;
+
+    data = (const uint8_t*) p;
+    data_size = st.st_size;
+
+    return ERR_NONE;
+}
+
+// Check that all offsets and node references stay within the mapped
+// file, then set up the dictionary and the levels. Guards against
+// truncated files or files written by incompatible versions.
+LMError CompiledModel::validate()
+{
+    int i;
+    const CompiledHeader* header = (const CompiledHeader*) data;
+
+    if (memcmp(header->magic, COMPILED_MODEL_MAGIC,
+               sizeof(header->magic)) != 0 ||
+        header->version != COMPILED_MODEL_VERSION ||
+        header->byte_order != COMPILED_MODEL_BYTE_ORDER)
+        return ERR_FORMAT;
+
+    int new_order = header->order;
+    uint32_t num_words = header->num_words;
+    if (new_order < 1 ||
+        num_words < NUM_CONTROL_WORDS ||
+        header->sorted_words_begin > num_words)
+        return ERR_FORMAT;
+
+    // block positions
+    if (!is_in_range(header->levels_offset,
+                     (uint64_t)new_order * sizeof(CompiledLevel), data_size) ||
+        !is_in_range(header->word_offsets_offset,
+                     (uint64_t)num_words * sizeof(uint32_t), data_size) ||
+        (header->has_sorted_index &&
+         !is_in_range(header->sorted_index_offset,
+                      (uint64_t)num_words * sizeof(WordId), data_size)) ||
+        !is_in_range(header->strings_offset,
+                     header->strings_size, data_size) ||
+        header->strings_size == 0 ||
+        header->levels_offset % 8 ||
+        header->word_offsets_offset % 4 ||
+        header->sorted_index_offset % 4)
+        return ERR_FORMAT;
+
+    // words, the last string has to be terminated
+    const char* strings = (const char*)(data + header->strings_offset);
+    if (strings[header->strings_size-1] != '\0')
+        return ERR_FORMAT;
+
+    const uint32_t* word_offsets =
+                (const uint32_t*)(data + header->word_offsets_offset);
+    vector<char*> words(num_words);
+    for (uint32_t wid = 0; wid < num_words; wid++)
+    {
+        if (word_offsets[wid] >= header->strings_size)
+            return ERR_FORMAT;
+        words[wid] = const_cast<char*>(strings + word_offsets[wid]);
+    }
+
+    vector<WordId> sorted;
+    if (header->has_sorted_index)
+    {
+        const WordId* sorted_index =
+                    (const WordId*)(data + header->sorted_index_offset);
+        sorted.assign(sorted_index, sorted_index + num_words);
+        for (uint32_t j = 0; j < num_words; j++)
+            if (sorted[j] >= num_words)
+                return ERR_FORMAT;
+    }
+
+    // n-gram levels
+    const CompiledLevel* clevels =
+                    (const CompiledLevel*)(data + header->levels_offset);
+    vector<LevelInfo> new_levels(new_order);
+    for (i=0; i<new_order; i++)
+    {
+        const CompiledLevel& cl = clevels[i];
+        LevelInfo& l = new_levels[i];
+        bool is_last = i == new_order-1;
+        l.stride = is_last ? sizeof(BaseNode) : sizeof(CompiledNode);
+        uint64_t num_entries = cl.num_nodes + (is_last ? 0 : 1);
+        if (!is_in_range(cl.nodes_offset, num_entries * l.stride, data_size) ||
+            cl.nodes_offset % 2)
+            return ERR_FORMAT;
+
+        l.nodes = data + cl.nodes_offset;
+        l.num_nodes = cl.num_nodes;
+        l.num_ngrams = cl.num_ngrams;
+        l.total_count = cl.total_count;
+    }
+
+    // Unigrams exist for every word and their index is the word id.
+    if (new_levels[0].num_nodes != num_words)
+        return ERR_FORMAT;
+
+    for (i=0; i<new_order; i++)
+    {
+        const LevelInfo& l = new_levels[i];
+        bool is_last = i == new_order-1;
+        uint32_t num_children = is_last ? 0 : new_levels[i+1].num_nodes;
+        uint32_t last_child_begin = 0;
+
+        for (uint32_t j = 0; j <= l.num_nodes; j++)
+        {
+            if (j == l.num_nodes && is_last)
+                break;
+
+            const BaseNode* node = (const BaseNode*)(l.nodes + l.stride * j);
+            if (j < l.num_nodes)
+            {
+                if (i == 0 ? node->word_id != j : node->word_id >= num_words)
+                    return ERR_FORMAT;
+            }
+
+            // child ranges have to be ascending and within the next level
+            if (!is_last)
+            {
+                uint32_t child_begin =
+                       static_cast<const CompiledNode*>(node)->child_begin;
+                if (child_begin < last_child_begin ||
+                    child_begin > num_children ||
+                    (j == 0 && child_begin != 0) ||
+                    (j == l.num_nodes && child_begin != num_children))
+                    return ERR_FORMAT;
+                last_child_begin = child_begin;
+            }
+        }
+    }
+
+    // all good, take it
+    dictionary.set_external_words(words, header->sorted_words_begin,
+                                  header->has_sorted_index ? &sorted : NULL);
+    levels = new_levels;
+    order = new_order;
+
+    // discounting parameters for absolute discounting
+    Ds.resize(order);
+    for (i=0; i<order; i++)
+    {
+        double D;
+        int n1 = clevels[i].n1;
+        int n2 = clevels[i].n2;
+        if (n1 == 0 || n2 == 0)
+            D = 0.1;          // training corpus too small, take a guess
+        else
+            // deleted estimation, Ney, Essen, and Kneser 1994
+            D = n1 / (n1 + 2.0*n2);
+        Ds[i] = D;
+    }
+
+    return ERR_NONE;
+}
+
+// Write the n-grams of any dynamic model in compiled binary format.
+LMError CompiledModel::write_compiled(DynamicModelBase* model,
+                                      const char* filename)
+{
+    vector<uint8_t> image;
+    LMError error = build_image(model, image);
+    if (error)
+        return error;
+
+    FILE* f = fopen(filename, "wb");
+    if (!f)
+        return ERR_FILE;
+
+    bool ok = fwrite(&image[0], 1, image.size(), f) == image.size();
+
+    if (fclose(f) != 0)
+        ok = false;
+
+    return ok ? ERR_NONE : ERR_FILE;
+}
+
+// Lay out the n-grams of any dynamic model in compiled binary format.
+// Word ids are kept, so that the compiled model is an exact copy
+// of the source model, including removed n-grams.
+LMError CompiledModel::build_image(DynamicModelBase* model,
+                                   vector<uint8_t>& image)
+{
+    int i;
+    int order = model->get_order();
+    if (order < 1 || !model->is_model_valid())
+        return ERR_COUNT;
+
+    Dictionary& dictionary = model->dictionary;
+    uint32_t num_words = dictionary.words.size();
+
+    // Gather the nodes level by level. Preorder traversal visits the
+    // nodes of each level sorted by parent, then by word id.
+    vector< vector<CompiledNode> > inner_nodes(order-1);
+    vector<BaseNode> last_nodes;
+    vector<CompiledLevel> clevels(order);
+    memset(&clevels[0], 0, sizeof(CompiledLevel) * order);
+
+    vector<WordId> ngram;
+    DynamicModelBase::ngrams_iter* it;
+    for (it = model->ngrams_begin(); ; it->next_node())
+    {
+        BaseNode* node = *(*it);
+        if (!node)
+            break;
+
+        int level = it->get_level();
+        if (level < 1 || level > order)
+            continue;
+
+        // not all iterators provide the word id in the node
+        it->get_ngram(ngram);
+        WordId wid = ngram.back();
+
+        CompiledLevel& cl = clevels[level-1];
+        CountType count = node->count;
+        if (count > 0)
+            cl.num_ngrams++;
+        if (count == 1)
+            cl.n1++;
+        if (count == 2)
+            cl.n2++;
+        cl.total_count += count;
+
+        if (level < order)
+        {
+            CompiledNode cn;
+            cn.word_id = wid;
+            cn.count = count;
+            cn.child_begin = level < order-1 ? inner_nodes[level].size()
+                                             : last_nodes.size();
+            inner_nodes[level-1].push_back(cn);
+        }
+        else
+        {
+            BaseNode bn(wid);
+            bn.count = count;
+            last_nodes.push_back(bn);
+        }
+    }
+    delete it;
+
+    // sentinels mark the end of the last child range
+    for (i=0; i<order-1; i++)
+    {
+        CompiledNode cn;
+        cn.word_id = WIDNONE;
+        cn.count = 0;
+        cn.child_begin = i < order-2 ? inner_nodes[i+1].size()
+                                     : last_nodes.size();
+        inner_nodes[i].push_back(cn);
+    }
+
+    // unigram indexes have to match word ids
+    uint32_t num_unigrams = order > 1 ? inner_nodes[0].size()-1
+                                      : last_nodes.size();
+    if (num_unigrams != num_words)
+        return ERR_COUNT;
+    for (uint32_t wid = 0; wid < num_words; wid++)
+    {
+        const BaseNode& node = order > 1 ? inner_nodes[0][wid]
+                                         : last_nodes[wid];
+        if (node.word_id != wid)
+            return ERR_COUNT;
+    }
+
+    // word string offsets
+    vector<uint32_t> word_offsets(num_words);
+    uint64_t strings_size = 0;
+    for (uint32_t wid = 0; wid < num_words; wid++)
+    {
+        word_offsets[wid] = strings_size;
+        strings_size += strlen(dictionary.words[wid]) + 1;
+    }
+
+    // file layout
+    CompiledHeader header;
+    memset(&header, 0, sizeof(header));
+    memcpy(header.magic, COMPILED_MODEL_MAGIC, sizeof(header.magic));
+    header.version = COMPILED_MODEL_VERSION;
+    header.byte_order = COMPILED_MODEL_BYTE_ORDER;
+    header.order = order;
+    header.num_words = num_words;
+    header.sorted_words_begin = dictionary.sorted_words_begin;
+    header.has_sorted_index = dictionary.sorted != NULL;
+
+    uint64_t offset = sizeof(header);
+    header.levels_offset = align8(offset);
+    offset = header.levels_offset + sizeof(CompiledLevel) * order;
+    header.word_offsets_offset = align8(offset);
+    offset = header.word_offsets_offset + sizeof(uint32_t) * num_words;
+    if (header.has_sorted_index)
+    {
+        header.sorted_index_offset = align8(offset);
+        offset = header.sorted_index_offset + sizeof(WordId) * num_words;
+    }
+    header.strings_offset = align8(offset);
+    header.strings_size = strings_size;
+    offset = header.strings_offset + strings_size;
+
+    for (i=0; i<order; i++)
+    {
+        CompiledLevel& cl = clevels[i];
+        cl.nodes_offset = align8(offset);
+        if (i < order-1)
+        {
+            cl.num_nodes = inner_nodes[i].size()-1;
+            offset = cl.nodes_offset +
+                     sizeof(CompiledNode) * inner_nodes[i].size();
+        }
+        else
+        {
+            cl.num_nodes = last_nodes.size();
+            offset = cl.nodes_offset + sizeof(BaseNode) * last_nodes.size();
+        }
+    }
+
+    // copy the blocks, padding stays zero
+    image.assign(offset, 0);
+    uint8_t* p = &image[0];
+
+    memcpy(p, &header, sizeof(header));
+    memcpy(p + header.levels_offset, &clevels[0],
+           sizeof(CompiledLevel) * order);
+    memcpy(p + header.word_offsets_offset, &word_offsets[0],
+           sizeof(uint32_t) * num_words);
+
+    if (header.has_sorted_index)
+        memcpy(p + header.sorted_index_offset, &(*dictionary.sorted)[0],
+               sizeof(WordId) * num_words);
+
+    uint8_t* strings = p + header.strings_offset;
+    for (uint32_t wid = 0; wid < num_words; wid++)
+    {
+        const char* w = dictionary.words[wid];
+        size_t size = strlen(w) + 1;
+        memcpy(strings, w, size);
+        strings += size;
+    }
+
+    for (i=0; i<order; i++)
+    {
+        if (i < order-1)
+            memcpy(p + clevels[i].nodes_offset, &inner_nodes[i][0],
+                   sizeof(CompiledNode) * inner_nodes[i].size());
+        else
+            memcpy(p + clevels[i].nodes_offset, last_nodes.data(),
+                   sizeof(BaseNode) * last_nodes.size());
+    }
+
+    return ERR_NONE;
+}
+
+// Return the number of occurences of the given ngram
+int CompiledModel::get_ngram_count(const wchar_t* const* ngram, int n)
+{
+    if (!data || n > order)
+        return 0;
+
+    vector<WordId> wids(n);
+    for (int i=0; i<n; i++)
+    {
+        wids[i] = dictionary.word_to_id(ngram[i]);
+        if (wids[i] == WIDNONE)
+            return 0;
+    }
+
+    uint32_t index;
+    if (n && get_node(&wids[0], n, index))
+        return get_node_at(n, index)->get_count();
+    return 0;
+}
+
+void CompiledModel::get_node_values(BaseNode* node, int level,
+                                    std::vector<int>& values)
+{
+    values.push_back(node->count);
+
+    if (order > 1)
+    {
+        int N1prx = 0;
+        int sum_counts;
+        if (level == 0)
+            N1prx = levels[0].num_ngrams;
+        else
+        if (level < order)
+        {
+            const LevelInfo& l = levels[level-1];
+            uint32_t index = ((const uint8_t*)node - l.nodes) / l.stride;
+            get_child_stats(level, index, N1prx, sum_counts);
+        }
+        values.push_back(N1prx);
+    }
+}
+
+// Memory used by this instance of the model, and the size of the
+// n-gram image. The image of a mapped file is shared between processes.
+void CompiledModel::get_memory_sizes(std::vector<long>& values)
+{
+    values.push_back(dictionary.get_memory_size());
+    values.push_back(data_size);
+}
+
+void CompiledModel::filter_candidates(const std::vector<WordId>& in,
+                                            std::vector<WordId>& out)
+{
+    // filter out removed unigrams
+    int num_candidates = in.size();
+    out.reserve(num_candidates);
+    for (int i=0; i<num_candidates; i++)
+    {
+        WordId wid = in[i];
+        if (wid < levels[0].num_nodes &&
+            get_node_at(1, wid)->get_count())
+            out.push_back(wid);
+    }
+}
+
+// Return the word ids of all words following the last word of history,
+// excluding removed n-grams.
+void CompiledModel::get_words_with_predictions(
+                                       const std::vector<WordId>& history,
+                                       std::vector<WordId>& wids)
+{
+    if (order < 2 || history.empty())
+        return;
+
+    uint32_t index;
+    if (get_node(&history.back(), 1, index))
+    {
+        uint32_t begin, end;
+        get_child_range(1, index, begin, end);
+        for (uint32_t i = begin; i < end; i++)
+        {
+            const BaseNode* child = get_node_at(2, i);
+            if (child->count)
+                wids.push_back(child->word_id);
+        }
+    }
+}
+
+bool CompiledModel::get_child(int level, uint32_t index, WordId wid,
+                              uint32_t& child_index)
+{
+    if (level >= order)
+        return false;
+
+    // unigram index equals word id
+    if (level == 0)
+    {
+        if (wid >= levels[0].num_nodes)
+            return false;
+        child_index = wid;
+        return true;
+    }
+
+    // binary search like lower_bound()
+    uint32_t lo, hi;
+    get_child_range(level, index, lo, hi);
+    uint32_t end = hi;
+    while (lo < hi)
+    {
+        uint32_t mid = (lo+hi)>>1;
+        if (get_node_at(level+1, mid)->word_id < wid)
+            lo = mid + 1;
+        else
+            hi = mid;
+    }
+    if (lo < end && get_node_at(level+1, lo)->word_id == wid)
+    {
+        child_index = lo;
+        return true;
+    }
+    return false;
+}
+
+// Find the node of the given n-gram. Level 0, n=0, is the root node.
+bool CompiledModel::get_node(const WordId* wids, int n, uint32_t& index)
+{
+    index = 0;
+    for (int i=0; i<n; i++)
+        if (!get_child(i, index, wids[i], index))
+            return false;
+    return true;
+}
+
+// Number of children with count > 0 and the sum of their counts.
+void CompiledModel::get_child_stats(int level, uint32_t index,
+                                    int& N1prx, int& sum_counts)
+{
+    if (level == 0)
+    {
+        N1prx = levels[0].num_ngrams;
+        sum_counts = levels[0].total_count;
+        return;
+    }
+
+    N1prx = 0;
+    sum_counts = 0;
+    uint32_t begin, end;
+    get_child_range(level, index, begin, end);
+    for (uint32_t i = begin; i < end; i++)
+    {
+        int count = get_node_at(level+1, i)->get_count();
+        if (count > 0)
+            N1prx++;
+        sum_counts += count;
+    }
+}
+
+// Calculate a vector of probabilities for the ngrams formed
+// by history + word[i], for all i.
+// Results are identical to those of the model the file was compiled from.
+void CompiledModel::get_probs(const std::vector<WordId>& history,
+                              const std::vector<WordId>& words,
+                              std::vector<double>& probabilities)
+{
+    if (!data)
+        return;
+
+    if (order == 1)
+    {
+        get_probs_unigram(words, probabilities);
+    }
+    else
+    {
+        // pad/cut history so it's always of length order-1
+        int n = std::min((int)history.size(), order-1);
+        std::vector<WordId> h(order-1, UNKNOWN_WORD_ID);
+        copy_backward(history.end()-n, history.end(), h.end());
+
+        get_probs_interpolated(h, words, probabilities);
+    }
+}
+
+// Same as UnigramModel::get_probs()
+void CompiledModel::get_probs_unigram(const std::vector<WordId>& words,
+                                      std::vector<double>& vp)
+{
+    int size = words.size();   // number of candidate words
+    int num_word_types = get_num_word_types();
+    int cs = levels[0].total_count; // total number of occurences
+    vp.resize(size);
+    if (cs)
+    {
+        for(int i=0; i<size; i++)
+        {
+            CountType count = get_node_at(1, words[i])->count;
+            vp[i] = count / (double) cs;
+        }
+    }
+    else
+    {
+        fill(vp.begin(), vp.end(), 1.0/num_word_types); // uniform distribution
+    }
+}
+
+// Same as NGramTrie::get_probs_witten_bell_i() and
+// NGramTrie::get_probs_abs_disc_i()
+void CompiledModel::get_probs_interpolated(const std::vector<WordId>& history,
+                                           const std::vector<WordId>& words,
+                                           std::vector<double>& vp)
+{
+    int i,j;
+    int n = history.size() + 1;
+    int size = words.size();   // number of candidate words
+    std::vector<int32_t> vc(size);  // vector of counts, reused for order 1..n
+
+    // order 0
+    vp.resize(size);
+    fill(vp.begin(), vp.end(), 1.0/get_num_word_types()); // uniform distribution
+
+    // order 1..n
+    for(j=0; j<n; j++)
+    {
+        uint32_t index;
+        if (get_node(history.data() + (n-j-1), j, index))
+        {
+            int N1prx, cs;
+            get_child_stats(j, index, N1prx, cs);
+            if (!N1prx)  // break early, don't reset probabilities to 0
+                break;   // for unknown histories
+
+            if (cs)
+            {
+                // get ngram counts
+                fill(vc.begin(), vc.end(), 0);
+                uint32_t begin, end;
+                get_child_range(j, index, begin, end);
+                if (end - begin > (uint32_t)size)
+                {
+                    // few candidates, look them up among the children
+                    for(i=0; i<size; i++)
+                    {
+                        uint32_t child_index;
+                        if (get_child(j, index, words[i], child_index))
+                            vc[i] = get_node_at(j+1, child_index)->get_count();
+                    }
+                }
+                else
+                {
+                    for (uint32_t k = begin; k < end; k++)
+                    {
+                        const BaseNode* child = get_node_at(j+1, k);
+                        int ci = binsearch(words, child->word_id); // word_indices have to be sorted by index
+                        if (ci >= 0)
+                            vc[ci] = child->get_count();
+                    }
+                }
+
+                if (smoothing == WITTEN_BELL_I)
+                {
+                    double l1 = N1prx / (N1prx + float(cs)); // normalization factor
+                                                             // 1 - lambda
+                    for(i=0; i<size; i++)
+                    {
+                        double pmle = vc[i] / float(cs);
+                        vp[i] = (1.0 - l1) * pmle + l1 * vp[i];
+                    }
+                }
+                else
+                if (smoothing == ABS_DISC_I)
+                {
+                    double D = Ds[j];
+                    double l1 = D / float(cs) * N1prx; // normalization factor
+                                                       // 1 - lambda
+                    for(i=0; i<size; i++)
+                    {
+                        double a = vc[i] - D;
+                        if (a < 0)
+                            a = 0;
+                        vp[i] = a / float(cs) + l1 * vp[i];
+                    }
+                }
+            }
+        }
+    }
+}
+
@@ -0,0 +1,303 @@
+/*
+ * Copyright © 2026 marmuta <marmvta@gmail.com>
+ *
+ * This file is part of Onboard.
+ *
+ * Onboard is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Onboard is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#ifndef LM_COMPILED_H
+#define LM_COMPILED_H
+
+#include "lm_dynamic.h"
+
+// Binary file layout, all values in native byte order:
+//
+// CompiledHeader
+// CompiledLevel[order]          one entry per n-gram level
+// uint32_t[num_words]           offsets of the words into the string block
+// uint32_t[num_words]           word ids in alphabetical order (optional)
+// char[strings_size]            UTF-8 encoded, '\0'-terminated words
+// CompiledNode[num_nodes+1]     per level 1..order-1, with sentinel entry
+// BaseNode[num_nodes]           for the last level
+//
+// Nodes of each level are stored contiguously, sorted by parent and then
+// by word id. Children are referenced by index into the next level.
+// Unigrams are stored for every word of the dictionary, so that
+// their index equals their word id.
+
+#define COMPILED_MODEL_MAGIC "OBLMC\0\0\0"
+#define COMPILED_MODEL_VERSION 1
+#define COMPILED_MODEL_BYTE_ORDER 0x01020304
+
+struct CompiledHeader
+{
+    char     magic[8];
+    uint32_t version;
+    uint32_t byte_order;
+    uint32_t order;
+    uint32_t num_words;
+    uint32_t sorted_words_begin;
+    uint32_t has_sorted_index;
+    uint64_t levels_offset;
+    uint64_t word_offsets_offset;
+    uint64_t sorted_index_offset;
+    uint64_t strings_offset;
+    uint64_t strings_size;
+};
+
+struct CompiledLevel
+{
+    uint64_t nodes_offset;
+    uint32_t num_nodes;    // number of nodes, excluding the sentinel
+    uint32_t num_ngrams;   // number of nodes with count > 0
+    uint64_t total_count;  // sum of all counts
+    uint32_t n1;           // number of n-grams with count == 1
+    uint32_t n2;           // number of n-grams with count == 2
+};
+
+#pragma pack(2)
+
+//------------------------------------------------------------------------
+// CompiledNode - inner node of the flat n-gram trie
+//------------------------------------------------------------------------
+
+class CompiledNode : public BaseNode
+{
+    public:
+        uint32_t child_begin;  // index of the first child in the next level
+};
+
+#pragma pack()
+
+
+//------------------------------------------------------------------------
+// CompiledModel - read-only n-gram model, memory mapped from a binary file
+//                 or compiled in memory from another model
+//------------------------------------------------------------------------
+
+class CompiledModel : public DynamicModelBase
+{
+    public:
+        static const Smoothing DEFAULT_SMOOTHING = ABS_DISC_I;
+
+        class ngrams_iter : public DynamicModelBase::ngrams_iter
+        {
+            public:
+                ngrams_iter(CompiledModel* lm)
+                {
+                    model = lm;
+                    done = false;
+                    operator++(0);
+                }
+
+                virtual BaseNode* operator*() const // dereference operator
+                {
+                    if (done)
+                        return NULL;
+                    if (indexes.empty())
+                        return const_cast<BaseNode*>(&model->root);
+                    return const_cast<BaseNode*>(
+                        model->get_node_at(indexes.size(), indexes.back()));
+                }
+
+                virtual void operator++(int unused) // postfix operator
+                {
+                    // skip removed nodes, i.e. nodes with count==0
+                    for(;;)
+                    {
+                        next_node();
+                        BaseNode* node = operator*();
+                        if (node == NULL || node->count != 0)
+                            break;
+                    }
+                }
+
+                // preorder traversal, including removed nodes
+                virtual void next_node();
+
+                virtual void get_ngram(std::vector<WordId>& ngram)
+                {
+                    ngram.resize(indexes.size());
+                    for (int i=0; i<(int)indexes.size(); i++)
+                        ngram[i] = model->get_node_at(i+1, indexes[i])->word_id;
+                }
+
+                virtual int get_level()
+                { return done ? -1 : indexes.size(); }
+
+                virtual bool at_root()
+                { return !done && indexes.empty(); }
+
+            private:
+                CompiledModel* model;
+                std::vector<uint32_t> indexes;  // path to the current node
+                std::vector<uint32_t> ends;     // end of each child range
+                bool done;
+        };
+        virtual DynamicModelBase::ngrams_iter* ngrams_begin()
+        {return new ngrams_iter(this);}
+
+    public:
+        CompiledModel()
+        {
+            data = NULL;
+            data_size = 0;
+            smoothing = DEFAULT_SMOOTHING;
+            order = 0;
+        }
+
+        virtual ~CompiledModel()
+        {
+            clear();
+        }
+
+        virtual void clear();
+
+        virtual int get_max_order()
+        {
+            return 0;
+        }
+
+        virtual Smoothing get_smoothing() {return smoothing;}
+        virtual void set_smoothing(Smoothing s) {smoothing = s;}
+        virtual std::vector<Smoothing> get_smoothings()
+        {
+            std::vector<Smoothing> smoothings;
+            smoothings.push_back(WITTEN_BELL_I);
+            smoothings.push_back(ABS_DISC_I);
+            return smoothings;
+        }
+
+        virtual bool is_model_valid()
+        {
+            return data != NULL;
+        }
+
+        // read-only, counting isn't supported
+        virtual BaseNode* count_ngram(const wchar_t* const* ngram, int n,
+                                int increment=1, bool allow_new_words=true)
+        {return NULL;}
+        virtual BaseNode* count_ngram(const WordId* wids, int n, int increment)
+        {return NULL;}
+
+        virtual int get_ngram_count(const wchar_t* const* ngram, int n);
+        virtual void get_node_values(BaseNode* node, int level,
+                                     std::vector<int>& values);
+        virtual void get_memory_sizes(std::vector<long>& values);
+
+        virtual LMError load(const char* filename);
+        virtual LMError save(const char* filename)
+        {return write_compiled(this, filename);}
+
+        // Freeze a copy of the model in memory, without file.
+        LMError compile(DynamicModelBase* model);
+
+        // Write any dynamic model in compiled binary format.
+        static LMError write_compiled(DynamicModelBase* model,
+                                      const char* filename);
+
+    protected:
+        virtual void filter_candidates(const std::vector<WordId>& in,
+                                             std::vector<WordId>& out);
+        virtual void get_words_with_predictions(
+                                       const std::vector<WordId>& history,
+                                       std::vector<WordId>& wids);
+        virtual void get_probs(const std::vector<WordId>& history,
+                               const std::vector<WordId>& words,
+                               std::vector<double>& probabilities);
+
+        virtual int get_num_ngrams(int level)
+        {
+            if (level < (int)levels.size())
+                return levels[level].num_ngrams;
+            return 0;
+        }
+
+        virtual void reserve_unigrams(int count)
+        {}
+
+    private:
+        static LMError build_image(DynamicModelBase* model,
+                                   std::vector<uint8_t>& image);
+        LMError map_file(const char* filename);
+        LMError validate();
+
+        const BaseNode* get_node_at(int level, uint32_t index)
+        {
+            const LevelInfo& l = levels[level-1];
+            return (const BaseNode*)(l.nodes + l.stride * index);
+        }
+
+        // Range of child indexes in level+1 of the node at level, index.
+        // Level 0 is the root, the only node that doesn't need an index.
+        void get_child_range(int level, uint32_t index,
+                             uint32_t& begin, uint32_t& end)
+        {
+            if (level == 0)
+            {
+                begin = 0;
+                end = levels[0].num_nodes;
+            }
+            else
+            if (level < order)
+            {
+                const CompiledNode* node =
+                               static_cast<const CompiledNode*>(
+                                                get_node_at(level, index));
+                begin = node[0].child_begin;
+                end   = node[1].child_begin;
+            }
+            else
+            {
+                begin = end = 0;
+            }
+        }
+
+        bool get_child(int level, uint32_t index, WordId wid,
+                       uint32_t& child_index);
+        bool get_node(const WordId* wids, int n, uint32_t& index);
+        void get_child_stats(int level, uint32_t index,
+                             int& N1prx, int& sum_counts);
+
+        void get_probs_unigram(const std::vector<WordId>& words,
+                               std::vector<double>& vp);
+        void get_probs_interpolated(const std::vector<WordId>& history,
+                                    const std::vector<WordId>& words,
+                                    std::vector<double>& vp);
+
+    private:
+        typedef struct
+        {
+            const uint8_t* nodes;
+            int stride;
+            uint32_t num_nodes;
+            uint32_t num_ngrams;
+            uint64_t total_count;
+        } LevelInfo;
+
+        const uint8_t* data;     // memory mapped file contents or image
+        size_t data_size;
+        std::vector<uint8_t> image;  // contents when compiled in memory
+        std::vector<LevelInfo> levels;
+        BaseNode root;           // dummy root node for ngrams_iter
+
+        Smoothing smoothing;
+
+        // discounting parameters for absolute discounting, per level
+        std::vector<double> Ds;
+};
+
+#endif
+
@@ -18,36 +18,353 @@
  */
 
 #include <error.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <thread>
+#include <system_error>
 
 #include "lm_dynamic.h"
 
 using namespace std;
 
+//------------------------------------------------------------------------
+// ARPAC parsing helpers
+//------------------------------------------------------------------------
+
+// Memory mapped contents of a whole file, read-only.
+class MappedFile
+{
+    public:
+        MappedFile() : data(NULL), size(0), mapped(false)
+        {}
+        ~MappedFile()
+        {
+            if (mapped)
+                munmap(const_cast<char*>(data), size);
+        }
+
+        LMError open(const char* filename)
+        {
+            int fd = ::open(filename, O_RDONLY);
+            if (fd < 0)
+                return ERR_FILE;
+
+            struct stat st;
+            if (fstat(fd, &st) != 0)
+            {
+                close(fd);
+                return ERR_FILE;
+            }
+
+            size = st.st_size;
+            if (size)  // mmap fails for empty files
+            {
+                void* p = mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0);
+                if (p == MAP_FAILED)
+                {
+                    close(fd);
+                    return ERR_FILE;
+                }
+                data = (const char*) p;
+                mapped = true;
+            }
+            close(fd);
+            return ERR_NONE;
+        }
+
+        const char* data;
+        size_t size;
+
+    private:
+        bool mapped;
+};
+
+// Token in the mapped file, not zero-terminated.
+typedef struct
+{
+    const char* str;
+    int len;
+} Token;
+
+// Return the end of the line starting at p, excluding the newline.
+static const char* find_line_end(const char* p, const char* end)
+{
+    const char* nl = (const char*) memchr(p, '\n', end - p);
+    return nl ? nl : end;
+}
+
+// Return the start of the line following line_end.
+static const char* next_line(const char* line_end, const char* end)
+{
+    return line_end < end ? line_end + 1 : end;
+}
+
+// Split a line into tokens, same separators as wcstok(line, L" \n").
+static int split_line(const char* begin, const char* end,
+                      Token* tokens, int max_tokens)
+{
+    int n = 0;
+    const char* p = begin;
+    while (n < max_tokens)
+    {
+        while (p < end && (*p == ' ' || *p == '\n'))
+            p++;
+        if (p >= end)
+            break;
+
+        tokens[n].str = p;
+        while (p < end && *p != ' ' && *p != '\n')
+            p++;
+        tokens[n].len = p - tokens[n].str;
+        n++;
+    }
+    return n;
+}
+
+// Does the first token of the line start with a backslash?
+static bool is_section_line(const char* p, const char* end)
+{
+    while (p < end && *p == ' ')
+        p++;
+    return p < end && *p == '\\';
+}
+
+static bool token_startswith(const Token& token, const char* prefix)
+{
+    int len = strlen(prefix);
+    return token.len >= len && memcmp(token.str, prefix, len) == 0;
+}
+
+// Copy the token into a zero-terminated buffer for the C library.
+static const char* token_to_cstr(const Token& token, char* buf, int size)
+{
+    int len = std::min(token.len, size-1);
+    memcpy(buf, token.str, len);
+    buf[len] = '\0';
+    return buf;
+}
+
+static long token_to_long(const Token& token)
+{
+    char buf[64];
+    return strtol(token_to_cstr(token, buf, sizeof(buf)), NULL, 10);
+}
+
+// Return the first byte that doesn't belong to a well-formed utf-8
+// sequence, or end if there is none. Reading with "ccs=UTF-8" used to
+// stop at these.
+static const char* find_invalid_utf8(const char* begin, const char* end)
+{
+    const unsigned char* p = (const unsigned char*) begin;
+    const unsigned char* e = (const unsigned char*) end;
+    while (p < e)
+    {
+        unsigned char c = *p;
+        if (c < 0x80)
+        {
+            p++;
+            continue;
+        }
+
+        int n;
+        unsigned char lo = 0x80;
+        unsigned char hi = 0xBF;
+        if (c >= 0xC2 && c <= 0xDF)
+            n = 1;
+        else if (c >= 0xE0 && c <= 0xEF)
+        {
+            n = 2;
+            if (c == 0xE0)
+                lo = 0xA0;   // overlong
+            else if (c == 0xED)
+                hi = 0x9F;   // surrogates
+        }
+        else if (c >= 0xF0 && c <= 0xF4)
+        {
+            n = 3;
+            if (c == 0xF0)
+                lo = 0x90;   // overlong
+            else if (c == 0xF4)
+                hi = 0x8F;   // > U+10FFFF
+        }
+        else
+            break;
+
+        if (e - p <= n ||
+            p[1] < lo || p[1] > hi)
+            break;
+        int i;
+        for (i=2; i<=n; i++)
+            if ((p[i] & 0xC0) != 0x80)
+                break;
+        if (i <= n)
+            break;
+        p += n + 1;
+    }
+    return (const char*) p;
+}
+
+// Parsed n-grams of a range of lines of one n-gram section.
+// Chunks of a section are parsed concurrently, so parsing must not
+// modify the model. Words are looked up read-only in the dictionary,
+// n-grams with unknown words are left for the caller.
+class ArpacChunk
+{
+    public:
+        ArpacChunk(const char* _begin, const char* _end) :
+            begin(_begin), end(_end),
+            num_lines(0), num_zero_counts(0),
+            error(ERR_NONE), error_line(0), error_ntoks(0)
+        {}
+
+        void parse(int level, Dictionary& dictionary)
+        {
+            std::string word;
+            Token tokens[32];
+            const char* p = begin;
+            while (p < end)
+            {
+                const char* line = p;
+                const char* line_end = find_line_end(p, end);
+                p = next_line(line_end, end);
+
+                int ntoks = split_line(line, line_end,
+                                       tokens, ALEN(tokens)-1);
+                num_lines++;
+                if (!ntoks)
+                    continue;
+
+                if (ntoks < level+1)
+                {
+                    error = ERR_NUMTOKENS; // too few tokens for cur. level
+                    error_line = num_lines - 1;
+                    error_ntoks = ntoks;
+                    break;
+                }
+
+                int itok = 0;
+                int count = token_to_long(tokens[itok++]);
+
+                uint32_t time = 0;
+                if (ntoks >= level+2)
+                    time = token_to_long(tokens[itok++]);
+
+                // There is a slight possibility that old models have
+                // zero counts. Since rev. 1845 n-grams with zero count
+                // are considered removed, which causes load failures.
+                // -> ignore n-grams with count 0
+                if (count <= 0)
+                {
+                    // Expect one n-gram fewer for this level.
+                    num_zero_counts++;
+                    continue;
+                }
+
+                if (level == 1)
+                {
+                    // Unigrams go to the dictionary first, keep the words.
+                    words.push_back(std::string(tokens[itok].str,
+                                                tokens[itok].len));
+                }
+                else
+                {
+                    int i;
+                    for (i=0; i<level; i++)
+                    {
+                        const Token& token = tokens[itok+i];
+                        word.assign(token.str, token.len);
+                        WordId wid = dictionary.word_to_id(word.c_str());
+                        if (wid == WIDNONE)
+                            break;
+                        wids.push_back(wid);
+                    }
+                    if (i < level)
+                    {
+                        wids.resize(wids.size() - i);
+                        unknown_lines.push_back(line);
+                        continue;
+                    }
+                }
+                counts.push_back(count);
+                times.push_back(time);
+            }
+        }
+
+        const char* begin;
+        const char* end;
+
+        std::vector<std::string> words;   // level 1: utf-8 words
+        std::vector<WordId> wids;         // levels > 1: level wids each
+        std::vector<CountType> counts;
+        std::vector<uint32_t> times;
+        std::vector<const char*> unknown_lines; // n-grams with new words
+
+        int num_lines;
+        int num_zero_counts;
+
+        LMError error;
+        int error_line;    // line in the chunk, 0-based
+        int error_ntoks;
+};
+
+static void parse_arpac_chunk(ArpacChunk* chunk, int level,
+                              Dictionary* dictionary)
+{
+    chunk->parse(level, *dictionary);
+}
+
+// Split the lines [begin, end) into about equally sized chunks,
+// one per available cpu core, but not too small to be worth a thread.
+static void split_chunks(const char* begin, const char* end,
+                         std::vector<ArpacChunk>& chunks)
+{
+    const size_t min_chunk_size = 256 * 1024;
+    size_t size = end - begin;
+    int num_chunks = std::max(1u, std::thread::hardware_concurrency());
+    num_chunks = std::min(num_chunks,
+                          std::max(1, (int)(size / min_chunk_size)));
+
+    const char* p = begin;
+    for (int i=0; i<num_chunks; i++)
+    {
+        const char* chunk_end = end;
+        if (i < num_chunks-1)
+        {
+            chunk_end = begin + size * (i+1) / num_chunks;
+            chunk_end = next_line(find_line_end(chunk_end, end), end);
+            chunk_end = std::max(chunk_end, p);
+        }
+        chunks.push_back(ArpacChunk(p, chunk_end));
+        p = chunk_end;
+    }
+}
+
+
 //------------------------------------------------------------------------
 // DynamicModelBase
 //------------------------------------------------------------------------
 
 // Load from ARPA-like format, expects counts instead of log probabilities
 // and no back-off values. N-grams don't have to be sorted alphabetically.
-// State machine driven version, still the fastest.
+// The file is memory mapped and read in one pass. The n-gram sections are
+// split into chunks that are parsed in parallel, then the n-grams are
+// inserted in bulk.
 LMError DynamicModelBase::load_arpac(const char* filename)
 {
-    int i;
     int new_order = 0;
-    int current_level = 0;
     int line_number = -1;
     std::vector<int> counts;
     LMError err_code = ERR_NONE;
 
-    enum {BEGIN, COUNTS, NGRAMS_HEAD, NGRAMS, DONE}
+    enum {BEGIN, COUNTS, NGRAMS_HEAD, DONE}
     state = BEGIN;
 
-    vector<Unigram> unigrams;
-
     clear();
 
-    FILE* f = fopen(filename, "r,ccs=UTF-8");
-    if (!f)
+    MappedFile file;
+    if (file.open(filename))
     {
         #ifndef NDEBUG
         printf( "Error opening %s\n", filename);
@@ -55,166 +372,107 @@ LMError DynamicModelBase::load_arpac(const char* filename)
         return ERR_FILE;
     }
 
-    while(1)
+    // Stop before the line with the first encoding error.
+    const char* begin = file.data;
+    const char* end = begin + file.size;
+    const char* invalid = find_invalid_utf8(begin, end);
+    if (invalid < end)
+    {
+        end = invalid;
+        while (end > begin && end[-1] != '\n')
+            end--;
+    }
+
+    const char* p = begin;
+    while (p < end)
     {
         // read line
-        wchar_t buf[4096];
-        if (fgetws(buf, ALEN(buf), f) == NULL)
-            break;
+        const char* line_end = find_line_end(p, end);
+        Token tokens[32];
+        int ntoks = split_line(p, line_end, tokens, ALEN(tokens)-1);
+        p = next_line(line_end, end);
         line_number++;
 
-        // chop line into tokens
-        wchar_t *tstate;
-        wchar_t* tokens[32] = {wcstok(buf, L" \n", &tstate)};
-        for (i=0; tokens[i] && i < ALEN(tokens)-1; i++)
-            tokens[i+1] = wcstok(NULL, L" \n", &tstate);
-        int ntoks = i;
+        if (!ntoks)  // any tokens there?
+            continue;
 
-        if (ntoks)  // any tokens there?
+        char buf[64];
+        if (state == BEGIN)
         {
-            // check for n-grams first, this is by far the most frequent case
-            if (state == NGRAMS)
+            if (token_startswith(tokens[0], "\\data\\"))
             {
-                if (tokens[0][0] == L'\\')  // end of section?
-                {
-                    // add unigrams
-                    if (current_level == 1)
-                    {
-                        err_code = set_unigrams(unigrams);
-                        vector<Unigram>().swap(unigrams); // really free mem
-                        if (err_code)
-                            break;
-                    }
-
-                    // check count
-                    int ngrams_expected = counts[current_level-1];
-                    int ngrams_read = get_num_ngrams(current_level-1);
-                    if (ngrams_read != ngrams_expected)
-                    {
-                        error (0, 0, "unexpected n-gram count for level %d: "
-                                     "expected %d n-grams, but read %d",
-                              current_level,
-                              ngrams_expected, ngrams_read);
-                        err_code = ERR_COUNT; // count doesn't match number of unique ngrams
-                        break;
-                    }
-                    state = NGRAMS_HEAD;
-                }
-                else
-                {
-                    if (ntoks < current_level+1)
-                    {
-                        err_code = ERR_NUMTOKENS; // too few tokens for cur. level
-                        error (0, 0, "too few tokens for n-gram level %d: "
-                              "line %d, tokens found %d/%d",
-                              current_level,
-                              line_number, ntoks, current_level+1);
-                        break;
-                    }
-
-                    int itok = 0;
-                    int count = wcstol(tokens[itok++], NULL, 10);
-
-                    uint32_t time = 0;
-                    if (ntoks >= current_level+2)
-                        time  = wcstol(tokens[itok++], NULL, 10);
-
-                    // There is a slight possibility that old models have
-                    // zero counts. Since rev. 1845 n-grams with zero count
-                    // are considered removed, which causes load failures.
-                    // -> ignore n-grams with count 0
-                    if (count <= 0)
-                    {
-                        // Expect one n-gram fewer for this level.
-                        counts[current_level-1]--;
-                    }
-                    else
-                    {
-                        if (current_level == 1)
-                        {
-                            // Temporarily collect unigrams so we can sort them.
-                            Unigram unigram = {tokens[itok],
-                                               (CountType)count,
-                                               time};
-                            unigrams.push_back(unigram);
-                        }
-                        else
-                        {
-                            BaseNode* node = count_ngram(tokens+itok,
-                                                        current_level,
-                                                        count);
-                            if (!node)
-                            {
-                                err_code = ERR_MEMORY; // out of memory
-                                break;
-                            }
-                            set_node_time(node, time);
-                        }
-                    }
-
-                    continue;
-                }
+                state = COUNTS;
             }
-            else
-            if (state == BEGIN)
+        }
+        else
+        if (state == COUNTS)
+        {
+            if (token_startswith(tokens[0], "ngram") && ntoks >= 2)
             {
-                if (wcsncmp(tokens[0], L"\\data\\", 6) == 0)
+                int level;
+                int count;
+                if (sscanf(token_to_cstr(tokens[1], buf, sizeof(buf)),
+                           "%d=%d", &level, &count) == 2)
                 {
-                    state = COUNTS;
+                    new_order = std::max(new_order, level);
+                    counts.resize(new_order);
+                    counts[level-1] = count;
                 }
             }
             else
-            if (state == COUNTS)
             {
-                if (wcsncmp(tokens[0], L"ngram", 5) == 0 && ntoks >= 2)
+                int max_order = get_max_order();
+                if (max_order && max_order < new_order)
                 {
-                    int level;
-                    int count;
-                    if (swscanf(tokens[1], L"%d=%d", &level, &count) == 2)
-                    {
-                        new_order = std::max(new_order, level);
-                        counts.resize(new_order);
-                        counts[level-1] = count;
-                    }
+                    err_code = ERR_ORDER_UNSUPPORTED;
+                    break;
                 }
-                else
-                {
-                    int max_order = get_max_order();
-                    if (max_order && max_order < new_order)
-                    {
-                        err_code = ERR_ORDER_UNSUPPORTED;
-                        break;
-                    }
 
-                    // clear language model and set it up for the new order
-                    set_order(new_order);
-                    if (new_order)
-                    {
-                        // This drops control words! They are added back
-                        // with assure_valid_control_words() below.
-                        reserve_unigrams(counts[0]);
-                    }
-                    state = NGRAMS_HEAD;
+                // clear language model and set it up for the new order
+                set_order(new_order);
+                if (new_order)
+                {
+                    // This drops control words! They are added back
+                    // with assure_valid_control_words() below.
+                    reserve_unigrams(counts[0]);
                 }
+                state = NGRAMS_HEAD;
             }
+        }
 
-            if (state == NGRAMS_HEAD)
+        if (state == NGRAMS_HEAD)
+        {
+            int level;
+            if (sscanf(token_to_cstr(tokens[0], buf, sizeof(buf)),
+                       "\\%d-grams", &level) == 1)
             {
-                if (swscanf(tokens[0], L"\\%d-grams", &current_level) == 1)
+                if (level < 1 || level > new_order)
                 {
-                    if (current_level < 1 || current_level > new_order)
-                    {
-                        err_code = ERR_ORDER_UNEXPECTED;
-                        break;
-                    }
-                    state = NGRAMS;
+                    err_code = ERR_ORDER_UNEXPECTED;
+                    break;
                 }
-                else
-                if (wcsncmp(tokens[0], L"\\end\\", 5) == 0)
+
+                // The section ends with the next line starting with
+                // a backslash, usually the next section header.
+                const char* section_begin = p;
+                int first_line = line_number + 1;
+                while (p < end && !is_section_line(p, end))
                 {
-                    state = DONE;
-                    break;
+                    p = next_line(find_line_end(p, end), end);
+                    line_number++;
                 }
+
+                err_code = load_arpac_section(section_begin, p, level,
+                                              first_line, p < end,
+                                              counts[level-1]);
+                if (err_code)
+                    break;
+            }
+            else
+            if (token_startswith(tokens[0], "\\end\\"))
+            {
+                state = DONE;
+                break;
             }
         }
     }
@@ -234,6 +492,146 @@ LMError DynamicModelBase::load_arpac(const char* filename)
     return err_code;
 }
 
+// Parse and insert the n-grams of the section [begin, end).
+// ngrams_expected is the count from the header, it is adjusted for
+// ignored n-grams and checked if the section was complete.
+LMError DynamicModelBase::load_arpac_section(const char* begin,
+                                             const char* end,
+                                             int level, int first_line,
+                                             bool complete,
+                                             int& ngrams_expected)
+{
+    int i;
+    LMError err_code = ERR_NONE;
+
+    // Parse chunks in parallel, the first one in this thread.
+    // Fall back to parsing in this thread if threads aren't available.
+    std::vector<ArpacChunk> chunks;
+    split_chunks(begin, end, chunks);
+
+    std::vector<std::thread> threads;
+    for (i=1; i<(int)chunks.size(); i++)
+    {
+        try
+        {
+            threads.push_back(std::thread(parse_arpac_chunk, &chunks[i],
+                                          level, &dictionary));
+        }
+        catch (const std::system_error&)
+        {
+            break;
+        }
+    }
+    int num_threaded = threads.size();
+    chunks[0].parse(level, dictionary);
+    for (i=num_threaded+1; i<(int)chunks.size(); i++)
+        chunks[i].parse(level, dictionary);
+    for (i=0; i<num_threaded; i++)
+        threads[i].join();
+
+    // Insert n-grams in file order.
+    int line_number = first_line;
+    std::vector<Unigram> unigrams;
+    StrConv conv;
+    for (i=0; i<(int)chunks.size(); i++)
+    {
+        ArpacChunk& chunk = chunks[i];
+        if (chunk.error)
+        {
+            error (0, 0, "too few tokens for n-gram level %d: "
+                  "line %d, tokens found %d/%d",
+                  level,
+                  line_number + chunk.error_line,
+                  chunk.error_ntoks, level+1);
+            return chunk.error;
+        }
+        line_number += chunk.num_lines;
+        ngrams_expected -= chunk.num_zero_counts;
+
+        int n = chunk.counts.size();
+        if (level == 1)
+        {
+            // Temporarily collect unigrams so we can sort them.
+            for (int j=0; j<n; j++)
+            {
+                Unigram unigram = {std::string(),
+                                   chunk.counts[j],
+                                   chunk.times[j]};
+                unigrams.push_back(unigram);
+                unigrams.back().word.swap(chunk.words[j]);
+            }
+            continue;
+        }
+
+        for (int j=0; j<n; j++)
+        {
+            BaseNode* node = count_ngram(&chunk.wids[j*level],
+                                         level, chunk.counts[j]);
+            if (!node)
+                return ERR_MEMORY; // out of memory
+            set_node_time(node, chunk.times[j]);
+        }
+
+        // N-grams with words missing from the unigrams.
+        // Adds the words to the dictionary, like count_ngram() does.
+        for (int j=0; j<(int)chunk.unknown_lines.size(); j++)
+        {
+            const char* line = chunk.unknown_lines[j];
+            Token tokens[32];
+            int ntoks = split_line(line, find_line_end(line, chunk.end),
+                                   tokens, ALEN(tokens)-1);
+            int itok = 0;
+            int count = token_to_long(tokens[itok++]);
+
+            uint32_t time = 0;
+            if (ntoks >= level+2)
+                time = token_to_long(tokens[itok++]);
+
+            std::vector<std::wstring> words;
+            for (int k=0; k<level; k++)
+            {
+                std::string word(tokens[itok+k].str, tokens[itok+k].len);
+                const wchar_t* w = conv.mb2wc(word.c_str());
+                if (!w)
+                    return ERR_MD2WC;
+                words.push_back(w);
+            }
+            std::vector<const wchar_t*> ngram;
+            for (int k=0; k<level; k++)
+                ngram.push_back(words[k].c_str());
+
+            BaseNode* node = count_ngram(&ngram[0], level, count);
+            if (!node)
+                return ERR_MEMORY; // out of memory
+            set_node_time(node, time);
+        }
+    }
+
+    if (!complete)
+        return ERR_NONE;
+
+    // add unigrams
+    if (level == 1)
+    {
+        err_code = set_unigrams(unigrams);
+        if (err_code)
+            return err_code;
+    }
+
+    // check count
+    int ngrams_read = get_num_ngrams(level-1);
+    if (ngrams_read != ngrams_expected)
+    {
+        error (0, 0, "unexpected n-gram count for level %d: "
+                     "expected %d n-grams, but read %d",
+              level,
+              ngrams_expected, ngrams_read);
+        return ERR_COUNT; // count doesn't match number of unique ngrams
+    }
+
+    return ERR_NONE;
+}
+
 
 // Save to ARPA-like format, stores counts instead of log probabilities
 // and no back-off values.
@@ -296,34 +694,33 @@ LMError DynamicModelBase::write_arpa_ngrams(FILE* f)
     return ERR_NONE;
 }
 
-// add unigrams in bulk
-LMError DynamicModelBase::set_unigrams(const vector<Unigram>& unigrams)
+// add unigrams in bulk, optionally return their word ids
+LMError DynamicModelBase::set_unigrams(const vector<Unigram>& unigrams,
+                                       vector<WordId>* wids_out)
 {
     LMError error = ERR_NONE;
 
     // Add all words in bulk to the dictionary.
     // -> they are stored sorted and don't need
     // the sorted array -> saves memory.
-    vector<wchar_t*> words;
+    vector<const char*> words;
     words.reserve(unigrams.size());
     vector<Unigram>::const_iterator it;
     for (it=unigrams.begin(); it != unigrams.end(); it++)
     {
         const Unigram& unigram = *it;
-        words.push_back(const_cast<wchar_t*>(unigram.word.c_str()));
+        words.push_back(unigram.word.c_str());
     }
-    error = dictionary.set_words(words);
+    vector<WordId> wids;
+    error = dictionary.set_words(words, &wids);
 
     if (!error)
     {
         // finally add all the unigrams
-        for (it=unigrams.begin(); it < unigrams.end(); it++)
+        for (int i = 0; i<(int)unigrams.size(); i++)
         {
-            const Unigram& unigram = *it;
-            const wchar_t* word = unigram.word.c_str();
-            BaseNode* node = count_ngram(&word,
-                                         1,
-                                         unigram.count);
+            const Unigram& unigram = unigrams[i];
+            BaseNode* node = count_ngram(&wids[i], 1, unigram.count);
             if (!node)
             {
                 error = ERR_MEMORY; // out of memory
@@ -332,6 +729,324 @@ LMError DynamicModelBase::set_unigrams(const vector<Unigram>& unigrams)
             set_node_time(node, unigram.time);
         }
     }
+    if (wids_out)
+        wids_out->swap(wids);
     return error;
 }
 
+// N-gram as seen by shrink().
+typedef struct
+{
+    WordId wid;       // last word of the n-gram
+    int parent;       // index of the (n-1)-gram prefix, -1 for unigrams
+    int level;
+    CountType count;
+    uint32_t time;
+    double value;     // how much is lost by dropping the n-gram
+    bool keep;
+} ShrinkNode;
+
+// Sort order of removal candidates, least valuable first.
+// On equal value, longer n-grams go before their prefixes.
+class cmp_shrink_candidates
+{
+    public:
+        cmp_shrink_candidates(const vector<ShrinkNode>& _nodes) :
+            nodes(_nodes)
+        {}
+        bool operator() (int i1, int i2) const
+        {
+            const ShrinkNode& n1 = nodes[i1];
+            const ShrinkNode& n2 = nodes[i2];
+            if (n1.value != n2.value)
+                return n1.value < n2.value;
+            return n1.level > n2.level;
+        }
+        const vector<ShrinkNode>& nodes;
+};
+
+// Drop the least valuable n-grams until at most target_ngrams remain,
+// but only if there are more than max_ngrams. N-grams are valued by
+// count and, with recency_halflife > 0, by the time since their last
+// use, halving every recency_halflife time steps.
+//
+// An n-gram is never worth less than the longer n-grams it is part of,
+// so prefixes and words of kept n-grams are kept too, and the model
+// stays consistent. The model is then rebuilt from the kept n-grams,
+// which releases the memory of the dropped ones, as well as of
+// n-grams removed earlier with count 0.
+LMError DynamicModelBase::shrink(int max_ngrams, int target_ngrams,
+                                 double recency_halflife, int& num_removed)
+{
+    num_removed = 0;
+
+    int num_ngrams = get_num_ngrams_total();
+    if (num_ngrams <= max_ngrams)
+        return ERR_NONE;
+    target_ngrams = std::max(0, std::min(target_ngrams, max_ngrams));
+
+    // Gather all nodes in preorder, including removed ones.
+    vector<ShrinkNode> nodes;
+    nodes.reserve(num_ngrams);
+    uint32_t current_time = get_current_time();
+    vector<int> path(get_order()+1, -1);  // last node index per level
+    vector<WordId> ngram;
+    DynamicModelBase::ngrams_iter* it;
+    for (it = ngrams_begin(); ; it->next_node())
+    {
+        BaseNode* node = *(*it);
+        if (!node)
+            break;
+
+        int level = it->get_level();
+        if (level < 1)
+            continue;
+
+        it->get_ngram(ngram);
+        ShrinkNode sn;
+        sn.wid = ngram.back();
+        sn.parent = path[level-1];
+        sn.level = level;
+        sn.count = node->count;
+        sn.time = get_node_time(node);
+        sn.keep = true;
+        if (sn.count <= 0)
+            sn.value = -1;
+        else
+        if (recency_halflife > 0)
+            sn.value = sn.count * pow(2, -(double)(current_time - sn.time) /
+                                         recency_halflife);
+        else
+            sn.value = sn.count;
+
+        path[level] = nodes.size();
+        nodes.push_back(sn);
+    }
+    delete it;
+
+    int i;
+    int n = nodes.size();
+
+    // Children come after their parents, propagate values upwards.
+    for (i=n-1; i>=0; i--)
+    {
+        const ShrinkNode& sn = nodes[i];
+        if (sn.parent >= 0)
+        {
+            ShrinkNode& parent = nodes[sn.parent];
+            parent.value = std::max(parent.value, sn.value);
+        }
+    }
+
+    // Every n-gram that contains a word has a prefix ending in it,
+    // so the word is worth the most valuable node ending in it.
+    int num_words = dictionary.get_num_word_types();
+    vector<double> word_values(num_words, -1);
+    for (i=0; i<n; i++)
+    {
+        const ShrinkNode& sn = nodes[i];
+        if (sn.wid < (WordId)num_words)
+            word_values[sn.wid] = std::max(word_values[sn.wid], sn.value);
+    }
+    for (i=0; i<n; i++)
+    {
+        ShrinkNode& sn = nodes[i];
+        if (sn.level == 1 && sn.wid < (WordId)num_words)
+            sn.value = std::max(sn.value, word_values[sn.wid]);
+    }
+
+    // Drop the least valuable n-grams, control words stay.
+    vector<int> candidates;
+    for (i=0; i<n; i++)
+    {
+        const ShrinkNode& sn = nodes[i];
+        if (sn.count > 0 &&
+            !(sn.level == 1 && sn.wid < NUM_CONTROL_WORDS))
+            candidates.push_back(i);
+    }
+    int num_drop = std::min(num_ngrams - target_ngrams,
+                            (int)candidates.size());
+    std::nth_element(candidates.begin(), candidates.begin() + num_drop,
+                     candidates.end(), cmp_shrink_candidates(nodes));
+    for (i=0; i<num_drop; i++)
+        nodes[candidates[i]].keep = false;
+
+    // Removed n-grams with count 0 go too, unless kept n-grams need
+    // them as prefix or for their words.
+    vector<bool> word_used(num_words, false);
+    for (i=0; i<n; i++)
+        if (nodes[i].count <= 0)
+            nodes[i].keep = false;
+    for (i=n-1; i>=0; i--)
+    {
+        const ShrinkNode& sn = nodes[i];
+        if (sn.keep)
+        {
+            if (sn.parent >= 0)
+                nodes[sn.parent].keep = true;
+            if (sn.wid < (WordId)num_words)
+                word_used[sn.wid] = true;
+        }
+    }
+    for (i=0; i<n; i++)
+    {
+        ShrinkNode& sn = nodes[i];
+        if (sn.level == 1 && sn.wid < (WordId)num_words &&
+            word_used[sn.wid])
+            sn.keep = true;
+    }
+
+    // Remember the words of the kept unigrams, the dictionary is
+    // about to be cleared.
+    vector<Unigram> unigrams;
+    vector<WordId> old_wids;
+    StrConv conv;
+    for (i=0; i<n; i++)
+    {
+        const ShrinkNode& sn = nodes[i];
+        if (sn.level == 1 && sn.keep)
+        {
+            const char* word = conv.wc2mb(dictionary.id_to_word(sn.wid));
+            if (!word)
+                return ERR_WC2MB;
+            Unigram unigram = {std::string(word),
+                               sn.count,
+                               sn.time};
+            unigrams.push_back(unigram);
+            old_wids.push_back(sn.wid);
+        }
+    }
+
+    // Rebuild the model from the kept n-grams, level by level.
+    int order = get_order();
+    set_order(order);  // clears the model
+    reserve_unigrams(unigrams.size());
+
+    vector<WordId> new_wids;
+    LMError error = set_unigrams(unigrams, &new_wids);
+    if (error)
+        return error;
+
+    vector<WordId> wid_map(num_words, WIDNONE);
+    for (i=0; i<(int)old_wids.size(); i++)
+        wid_map[old_wids[i]] = new_wids[i];
+
+    vector<WordId> wids(order);
+    for (int level=2; level<=order; level++)
+    {
+        for (i=0; i<n; i++)
+        {
+            const ShrinkNode& sn = nodes[i];
+            if (sn.level != level || !sn.keep || sn.count <= 0)
+                continue;
+
+            // words of the n-gram, from the end to the front
+            int j = i;
+            for (int k=level-1; k>=0; k--)
+            {
+                wids[k] = wid_map[nodes[j].wid];
+                j = nodes[j].parent;
+            }
+
+            BaseNode* node = count_ngram(&wids[0], level, sn.count);
+            if (!node)
+                return ERR_MEMORY;
+            set_node_time(node, sn.time);
+        }
+    }
+
+    assure_valid_control_words();
+    set_current_time(current_time);
+
+    num_removed = num_ngrams - get_num_ngrams_total();
+
+    return ERR_NONE;
+}
+
+// Extract n-grams from tokens and count them.
+// <unk> doesn't enter the model, tokens are split into sections
+// between <unk>s. Sentence begins <s> aren't learned across either,
+// they start new sections. Same results as lm_wrapper's _extract_ngrams.
+LMError DynamicModelBase::learn_tokens(const vector<wchar_t*>& tokens,
+                                       bool allow_new_words)
+{
+    int num_tokens = tokens.size();
+    int section_begin = 0;
+    for (int i=0; i<=num_tokens; i++)
+    {
+        // end of a section between <unk>s?
+        if (i == num_tokens ||
+            wcscmp(tokens[i], L"<unk>") == 0)
+        {
+            int begin = section_begin;
+            for (int j=section_begin; j<i; j++)
+            {
+                // split before sentence begin, keeping the marker
+                if (wcscmp(tokens[j], L"<s>") == 0)
+                {
+                    if (j > begin)
+                        if (!learn_section(&tokens[begin], j - begin,
+                                           allow_new_words))
+                            return ERR_MEMORY;
+                    begin = j;
+                }
+            }
+
+            // a lone <s> at the end doesn't start anything
+            if (i - begin > 1 ||
+                (i - begin == 1 && wcscmp(tokens[begin], L"<s>") != 0))
+                if (!learn_section(&tokens[begin], i - begin,
+                                   allow_new_words))
+                    return ERR_MEMORY;
+
+            section_begin = i + 1;
+        }
+    }
+    return ERR_NONE;
+}
+
+// Find all n-grams that contain the word sequence context.
+// Generic version, scans all n-grams of the model.
+void DynamicModelBase::get_context_ngrams(const vector<WordId>& context,
+                                          vector<NGramCount>& results)
+{
+    int k = context.size();
+    if (k == 0)
+        return;
+
+    vector<WordId> wids;
+    DynamicModelBase::ngrams_iter* it;
+    for (it = ngrams_begin(); ; (*it)++)
+    {
+        BaseNode* node = *(*it);
+        if (!node)
+            break;
+
+        it->get_ngram(wids);
+        if ((int)wids.size() >= k &&
+            search(wids.begin(), wids.end(),
+                   context.begin(), context.end()) != wids.end())
+        {
+            NGramCount result = {wids, node->get_count()};
+            results.push_back(result);
+        }
+    }
+    delete it;
+}
+
+// Run a window of size <order> along the section and count its n-grams.
+bool DynamicModelBase::learn_section(const wchar_t* const* section, int len,
+                                     bool allow_new_words)
+{
+    vector<WordId> wids(len);
+    if (!dictionary.query_add_words(section, len, wids, allow_new_words))
+        return false;
+
+    int order = get_order();
+    for (int i=0; i<len; i++)
+        for (int n=1; n<=order && i+n<=len; n++)
+            if (!count_ngram(&wids[i], n, 1))
+                return false;
+
+    return true;
+}
@@ -532,6 +532,15 @@ class NGramTrie : public TNODE
             return node;
         }
 
+        BaseNode* get_child(BaseNode* parent, int level, int wid, int& index)
+        {
+            if (level == order)
+                return NULL;
+            if (level == order - 1)
+                return static_cast<TBEFORELASTNODE*>(parent)->get_child(wid);
+            return static_cast<TNODE*>(parent)->get_child(wid, index);
+        }
+
         int get_num_children(BaseNode* node, int level)
         {
             if (level == order)
@@ -637,15 +646,6 @@ class NGramTrie : public TNODE
         }
 
 
-        BaseNode* get_child(BaseNode* parent, int level, int wid, int& index)
-        {
-            if (level == order)
-                return NULL;
-            if (level == order - 1)
-                return static_cast<TBEFORELASTNODE*>(parent)->get_child(wid);
-            return static_cast<TNODE*>(parent)->get_child(wid, index);
-        }
-
         int get_node_memory_size(BaseNode* node, int level)
         {
             if (level == order)
@@ -702,6 +702,7 @@ class DynamicModelBase : public NGramModel
                 virtual ~ngrams_iter() {}
                 virtual BaseNode* operator*() const = 0;
                 virtual void operator++(int unused) = 0;
+                virtual void next_node() = 0;  // including removed nodes
                 virtual void get_ngram(std::vector<WordId>& ngram) = 0;
                 virtual int get_level() = 0;
                 virtual bool at_root() = 0;
@@ -742,11 +743,40 @@ class DynamicModelBase : public NGramModel
         virtual BaseNode* count_ngram(const WordId* wids,
                                       int n, int increment) = 0;
 
+        // Count all n-grams of a token stream in one go.
+        LMError learn_tokens(const std::vector<wchar_t*>& tokens,
+                             bool allow_new_words=true);
+
+        typedef struct
+        {
+            std::vector<WordId> wids;
+            int count;
+        } NGramCount;
+
+        // Find all n-grams that contain the word sequence context,
+        // excluding removed ones with count==0.
+        virtual void get_context_ngrams(const std::vector<WordId>& context,
+                                        std::vector<NGramCount>& results);
+
         virtual LMError load(const char* filename)
         {return load_arpac(filename);}
         virtual LMError save(const char* filename)
         {return save_arpac(filename);}
 
+        // Number of n-grams of all levels, excluding removed ones.
+        int get_num_ngrams_total()
+        {
+            int n = 0;
+            for (int i=0; i<get_order(); i++)
+                n += get_num_ngrams(i);
+            return n;
+        }
+
+        // Drop the least valuable n-grams until at most target_ngrams
+        // remain, if there are more than max_ngrams.
+        LMError shrink(int max_ngrams, int target_ngrams,
+                       double recency_halflife, int& num_removed);
+
         // Debug output, dump all n-grams.
         virtual void dump()
         {
@@ -774,14 +804,18 @@ class DynamicModelBase : public NGramModel
         }
 
     protected:
+        bool learn_section(const wchar_t* const* section, int len,
+                           bool allow_new_words);
+
         // temporary unigram, only used during loading
         typedef struct
         {
-            std::wstring word;
+            std::string word;   // utf-8
             uint32_t count;
             uint32_t time;
         } Unigram;
-        virtual LMError set_unigrams(const std::vector<Unigram>& unigrams);
+        virtual LMError set_unigrams(const std::vector<Unigram>& unigrams,
+                                     std::vector<WordId>* wids = NULL);
 
         virtual LMError write_arpa_ngram(FILE* f,
                                        const BaseNode* node,
@@ -800,10 +834,19 @@ class DynamicModelBase : public NGramModel
         virtual LMError write_arpa_ngrams(FILE* f);
 
         virtual LMError load_arpac(const char* filename);
+        LMError load_arpac_section(const char* begin, const char* end,
+                                   int level, int first_line,
+                                   bool complete, int& ngrams_expected);
         virtual LMError save_arpac(const char* filename);
 
         virtual void set_node_time(BaseNode* node, uint32_t time)
         {}
+        virtual uint32_t get_node_time(BaseNode* node)
+        {return 0;}
+        virtual uint32_t get_current_time()
+        {return 0;}
+        virtual void set_current_time(uint32_t time)
+        {}
         virtual int get_num_ngrams(int level) = 0;
         virtual void reserve_unigrams(int count) = 0;
 
@@ -835,6 +878,9 @@ class _DynamicModel : public DynamicModelBase
                 virtual void operator++(int unused) // postfix operator
                 { it++; }
 
+                virtual void next_node()
+                { it.next(); }
+
                 virtual void get_ngram(std::vector<WordId>& ngram)
                 { it.get_ngram(ngram); }
 
@@ -853,6 +899,7 @@ class _DynamicModel : public DynamicModelBase
     public:
         _DynamicModel()
         {
+            reverse_index_valid = false;
             smoothing = DEFAULT_SMOOTHING;
             set_order(3);
         }
@@ -918,6 +965,9 @@ class _DynamicModel : public DynamicModelBase
         virtual BaseNode* count_ngram(const WordId* wids, int n, int increment);
         virtual int get_ngram_count(const wchar_t* const* ngram, int n);
 
+        virtual void get_context_ngrams(const std::vector<WordId>& context,
+                                        std::vector<NGramCount>& results);
+
         virtual void get_node_values(BaseNode* node, int level,
                                      std::vector<int>& values)
         {
@@ -971,6 +1021,13 @@ class _DynamicModel : public DynamicModelBase
             return ngrams.get_node(wids);
         }
 
+        void build_reverse_index();
+        void update_reverse_index(const WordId* wids, int n);
+        void collect_context_ngrams(BaseNode* node, int level,
+                                    std::vector<WordId>& path, bool matched,
+                                    const std::vector<WordId>& context,
+                                    std::vector<NGramCount>& results);
+
     protected:
         // n-gram trie
         TNGRAMS ngrams;
@@ -986,6 +1043,12 @@ class _DynamicModel : public DynamicModelBase
 
         // discounting parameters for abs. discounting, kneser-ney, per level
         std::vector<double> Ds;
+
+        // Per word id, the sorted ids of the unigrams whose subtrees
+        // contain the word at a deeper level. Built on first use by
+        // get_context_ngrams, may include n-grams removed since.
+        std::vector<std::vector<WordId> > reverse_index;
+        bool reverse_index_valid;
 };
 
 typedef _DynamicModel<NGramTrie<TrieNode<BaseNode>,
@@ -112,6 +112,11 @@ class NGramTrieRecency : public NGramTrieKN<TNODE, TBEFORELASTNODE, TLASTNODE>
             current_time = t;
         }
 
+        uint32_t get_current_time()
+        {
+            return current_time;
+        }
+
         int increment_node_count(BaseNode* node, const WordId* wids, int n,
                                   int increment);
 
@@ -251,6 +256,21 @@ class _CachedDynamicModel : public _DynamicModelKN<TNGRAMS>
             static_cast<RecencyNode*>(node)->set_time(time);
         }
 
+        virtual uint32_t get_node_time(BaseNode* node)
+        {
+            return static_cast<RecencyNode*>(node)->get_time();
+        }
+
+        virtual uint32_t get_current_time()
+        {
+            return this->ngrams.get_current_time();
+        }
+
+        virtual void set_current_time(uint32_t time)
+        {
+            this->ngrams.set_current_time(time);
+        }
+
         void set_recency_halflife(double hl) {recency_halflife = hl;}
         uint32_t get_recency_halflife() {return recency_halflife;}
 
@@ -247,6 +247,8 @@ template <class TNGRAMS>
 void _DynamicModel<TNGRAMS>::clear()
 {
     ngrams.clear();
+    std::vector<std::vector<WordId> >().swap(reverse_index);
+    reverse_index_valid = false;
     DynamicModelBase::clear();  // clears dictionary
 }
 
@@ -277,6 +279,8 @@ BaseNode* _DynamicModel<TNGRAMS>::count_ngram(const WordId* wids, int n,
     if (!node)
         return NULL;
 
+    set_changed();
+
     // remove old state
     if (node->count == 1)
         n1s[n-1]--;
@@ -285,6 +289,9 @@ BaseNode* _DynamicModel<TNGRAMS>::count_ngram(const WordId* wids, int n,
 
     int count = increment_node_count(node, wids, n, increment);
 
+    if (reverse_index_valid && increment > 0)
+        update_reverse_index(wids, n);
+
     // add new state
     if (node->count == 1)
         n1s[n-1]++;
@@ -318,6 +325,148 @@ int _DynamicModel<TNGRAMS>::get_ngram_count(const wchar_t* const* ngram, int n)
     return (node ? node->get_count() : 0);
 }
 
+// Find all n-grams that contain the word sequence context.
+// Only unigram subtrees that contain the last word of context are
+// searched, and within them only children that can still complete
+// a match.
+template <class TNGRAMS>
+void _DynamicModel<TNGRAMS>::get_context_ngrams(
+                                        const std::vector<WordId>& context,
+                                        std::vector<NGramCount>& results)
+{
+    int k = context.size();
+    if (k == 0 || k > order)
+        return;
+
+    build_reverse_index();
+
+    // first words of all n-grams that may contain the context
+    WordId wid = context.back();
+    std::vector<WordId> first_wids;
+    if (wid < reverse_index.size())
+        first_wids = reverse_index[wid];
+    std::vector<WordId>::iterator it;
+    it = std::lower_bound(first_wids.begin(), first_wids.end(), wid);
+    if (it == first_wids.end() || *it != wid)
+        first_wids.insert(it, wid);
+
+    int num_unigrams = ngrams.get_num_children(&ngrams, 0);
+    std::vector<WordId> path;
+    for (it = first_wids.begin(); it != first_wids.end(); it++)
+    {
+        if ((int)*it >= num_unigrams)
+            continue;
+        // unigrams are indexed by word id
+        BaseNode* node = ngrams.get_child_at(&ngrams, 0, *it);
+        path.assign(1, *it);
+        collect_context_ngrams(node, 1, path, false, context, results);
+    }
+}
+
+template <class TNGRAMS>
+void _DynamicModel<TNGRAMS>::collect_context_ngrams(BaseNode* node,
+                                    int level,
+                                    std::vector<WordId>& path, bool matched,
+                                    const std::vector<WordId>& context,
+                                    std::vector<NGramCount>& results)
+{
+    int k = context.size();
+
+    // does the path end with context?
+    if (!matched && level >= k)
+        matched = std::equal(context.begin(), context.end(),
+                             path.end() - k);
+
+    if (matched && node->count > 0)
+    {
+        NGramCount result = {path, (int)node->count};
+        results.push_back(result);
+    }
+
+    if (level >= order)
+        return;
+
+    int num_children = ngrams.get_num_children(node, level);
+
+    // Visit all children if the match is complete, or if the
+    // context may still start below the child.
+    if (matched || level + 1 + k <= order)
+    {
+        for (int i=0; i<num_children; i++)
+        {
+            BaseNode* child = ngrams.get_child_at(node, level, i);
+            path.push_back(child->word_id);
+            collect_context_ngrams(child, level+1, path, matched,
+                                   context, results);
+            path.pop_back();
+        }
+    }
+    else
+    {
+        // Otherwise only children that continue a partial match of
+        // length L at the end of the path are of interest.
+        std::vector<WordId> wids;
+        for (int L=0; L<k && L<=level; L++)
+        {
+            if (level - L + k > order)
+                continue;
+            if (!std::equal(context.begin(), context.begin() + L,
+                            path.end() - L))
+                continue;
+            WordId wid = context[L];
+            if (std::find(wids.begin(), wids.end(), wid) != wids.end())
+                continue;
+            wids.push_back(wid);
+
+            int index;
+            BaseNode* child = ngrams.get_child(node, level, wid, index);
+            if (child)
+            {
+                path.push_back(wid);
+                collect_context_ngrams(child, level+1, path, false,
+                                       context, results);
+                path.pop_back();
+            }
+        }
+    }
+}
+
+template <class TNGRAMS>
+void _DynamicModel<TNGRAMS>::build_reverse_index()
+{
+    if (reverse_index_valid)
+        return;
+
+    reverse_index.clear();
+    reverse_index_valid = true;
+
+    std::vector<WordId> wids;
+    typename TNGRAMS::iterator it(&ngrams);
+    for (; *it; it++)
+    {
+        it.get_ngram(wids);
+        update_reverse_index(&wids[0], wids.size());
+    }
+}
+
+template <class TNGRAMS>
+void _DynamicModel<TNGRAMS>::update_reverse_index(const WordId* wids, int n)
+{
+    WordId first = wids[0];
+    for (int i=1; i<n; i++)
+    {
+        WordId wid = wids[i];
+        if (wid >= reverse_index.size())
+            reverse_index.resize(wid + 1);
+
+        std::vector<WordId>& firsts = reverse_index[wid];
+        std::vector<WordId>::iterator it;
+        it = std::lower_bound(firsts.begin(), firsts.end(), first);
+        if (it == firsts.end() || *it != first)
+            firsts.insert(it, first);
+    }
+}
+
 // Calculate a vector of probabilities for the ngrams formed
 // by history + word[i], for all i.
 // input:  constant history and a vector of candidate words
@@ -45,12 +45,19 @@ struct cmp_results_word
 
 void MergedModel::predict(vector<LanguageModel::Result>& results,
                           const vector<wchar_t*>& context,
-                          int limit, uint32_t options)
+                          int limit, uint32_t options,
+                          PredictionSession* session)
 {
     int i;
 
     init_merge();
 
+    // The lower case spelling of a capitalized word may come from any
+    // component. Drop capitalized words only after merging and don't
+    // let components cut off the results that would replace them.
+    bool drop_capitalized = options & DROP_CAPITALIZED;
+    options &= ~DROP_CAPITALIZED;
+
     // merge prediction results of all component models
     ResultsMap m;
     for (i=0; i<(int)components.size(); i++)
@@ -58,7 +65,7 @@ void MergedModel::predict(vector<LanguageModel::Result>& results,
         // Ask the derived class if a limit on the number of results
         // is allowed. Otherwise assume a limit would change the
         // outcome and get all results.
-        bool can_limit = can_limit_components();
+        bool can_limit = can_limit_components() && !drop_capitalized;
 
         // Setting a limit requires sorting of results by probabilities.
         // Skip sorting for performance reasons if there is no limit.
@@ -70,7 +77,7 @@ void MergedModel::predict(vector<LanguageModel::Result>& results,
         vector<Result> rs;
         components[i]->predict(rs, context,
                            can_limit ? limit : -1, // limit number of results
-                           options);
+                           options, session);
 
         merge(m, rs, i);
     }
@@ -98,6 +105,18 @@ void MergedModel::predict(vector<LanguageModel::Result>& results,
     if (limit >= 0 && limit < (int)results.size())
         result_size = limit;
 
+    // Drop capitalized words, but look up only as many
+    // as needed to fill the limit.
+    if (drop_capitalized)
+    {
+        int n = 0;
+        for (i=0; i<(int)results.size() && n < result_size; i++)
+            if (!has_lower_case_variant(results[i].word.c_str()))
+                results[n++] = results[i];
+        results.resize(n);
+        result_size = n;
+    }
+
     // normalize the final probabilities as needed
     // Only works as expected with all words included, no filtering, no prefix
     if (options & NORMALIZE && needs_normalization())
@@ -51,7 +51,22 @@ class MergedModel : public LanguageModel
         virtual void predict(std::vector<LanguageModel::Result>& results,
                              const std::vector<wchar_t*>& context,
                              int limit=-1,
-                             uint32_t options = DEFAULT_OPTIONS);
+                             uint32_t options = DEFAULT_OPTIONS,
+                             PredictionSession* session = NULL);
+
+        // Exact match in any component, else the sum of partial matches.
+        virtual int lookup_word(const wchar_t* word)
+        {
+            int count = 0;
+            for (unsigned i=0; i<components.size(); i++)
+            {
+                int c = components[i]->lookup_word(word);
+                if (c > 0)
+                    return c;
+                count += c;
+            }
+            return count;
+        }
 
         virtual LMError load(const char* filename)
         {return ERR_NOT_IMPL;}
@@ -49,6 +49,7 @@
 #include "lm_dynamic_kn.h"
 #include "lm_dynamic_cached.h"
 #include "lm_merged.h"
+#include "lm_compiled.h"
 
 using namespace std;
 
@@ -69,17 +70,19 @@ using namespace std;
 #define my_offsetof(TYPE, MEMBER) \
         ((size_t)((char *)&(((TYPE *)0x10)->MEMBER) - (char*)0x10))
 
-#if 1
-// python recommends using it's own memory allocator for extensions
+#if PY_MAJOR_VERSION >= 3
+// python recommends using it's own memory allocator for extensions.
+// The raw allocator doesn't need the GIL, so models may allocate
+// while other python threads run.
 void* HeapAlloc(size_t size)
 {
-    void* p = PyMem_Malloc(size);
+    void* p = PyMem_RawMalloc(size);
     return p;
 }
 
 void HeapFree(void* p)
 {
-    PyMem_Free(p);
+    PyMem_RawFree(p);
 }
 #else
 void* HeapAlloc(size_t size)
@@ -126,6 +129,8 @@ typedef PyWrapper<UnigramModel> PyUnigramModel;
 typedef PyWrapper<DynamicModel> PyDynamicModel;
 typedef PyWrapper<DynamicModelKN> PyDynamicModelKN;
 typedef PyWrapper<CachedDynamicModel> PyCachedDynamicModel;
+typedef PyWrapper<CompiledModel> PyCompiledModel;
+typedef PyWrapper<PredictionSession> PyPredictionSession;
 
 // Another, derived wrapper to encapsulate python reference handling
 // of a vector of LanguageModels.
@@ -404,6 +409,109 @@ pyseqence_to_objects(PyObject* sequence, vector<T*>& results, PYTYPE* type)
     return true;
 }
 
+//------------------------------------------------------------------------
+// PredictionSession - python interface for PredictionSession
+//------------------------------------------------------------------------
+
+static PyObject *
+PredictionSession_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    PyPredictionSession *self;
+
+    self = (PyPredictionSession*)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self = new(self) PyPredictionSession;   // placement new
+    }
+    return (PyObject *)self;
+}
+
+static void
+PredictionSession_dealloc(PyPredictionSession* self)
+{
+    self->~PyPredictionSession();   // call destructor
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+PredictionSession_clear(PyPredictionSession* self)
+{
+    (*self)->clear();
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+PredictionSession_get_num_reused(PyPredictionSession *self, void *closure)
+{
+    return PyInt_FromLong((*self)->num_reused);
+}
+
+static PyObject *
+PredictionSession_get_num_searched(PyPredictionSession *self, void *closure)
+{
+    return PyInt_FromLong((*self)->num_searched);
+}
+
+static PyGetSetDef PredictionSession_getsetters[] = {
+    {(char*)"num_reused",
+     (getter)PredictionSession_get_num_reused, (setter)NULL,
+     (char*)"number of predictions that narrowed down previous candidates",
+     NULL},
+    {(char*)"num_searched",
+     (getter)PredictionSession_get_num_searched, (setter)NULL,
+     (char*)"number of predictions that searched for candidates from scratch",
+     NULL},
+    {NULL}  /* Sentinel */
+};
+
+static PyMethodDef PredictionSession_methods[] = {
+    {"clear", (PyCFunction)PredictionSession_clear, METH_NOARGS,
+     ""
+    },
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject PredictionSessionType = {
+    PyVarObject_HEAD_INIT(&PyType_Type, 0)
+    "lm.PredictionSession",             /*tp_name*/
+    sizeof(PyPredictionSession),             /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)PredictionSession_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /*tp_flags*/
+    "PredictionSession objects",           /* tp_doc */
+    0,		               /* tp_traverse */
+    0,		               /* tp_clear */
+    0,		               /* tp_richcompare */
+    0,		               /* tp_weaklistoffset */
+    0,		               /* tp_iter */
+    0,		               /* tp_iternext */
+    PredictionSession_methods,     /* tp_methods */
+    0,     /* tp_members */
+    PredictionSession_getsetters,   /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    0,      /* tp_init */
+    0,                         /* tp_alloc */
+    PredictionSession_new,                 /* tp_new */
+};
+
+
 //------------------------------------------------------------------------
 // LanguageModel - python interface for LanguageModel
 //------------------------------------------------------------------------
@@ -454,6 +562,8 @@ bool check_error(const LMError err, const char* filename = NULL)
                     msg = "error encoding to UTF-8"; break;
                 case ERR_MD2WC:
                     msg = "error decoding to Unicode"; break;
+                case ERR_FORMAT:
+                    msg = "incompatible binary model"; break;
                 default:
                     PyErr_SetString(PyExc_ValueError, "Unknown Error");
                     return true;
@@ -475,6 +585,7 @@ predict(PyLanguageModel* self, PyObject* args, PyObject *kwds,
     int error = 0;
     PyObject *result = NULL;
     PyObject *ocontext = NULL;
+    PyObject *osession = NULL;
     vector<wchar_t*> context;
     int limit = -1;
     long options = 0;
@@ -482,17 +593,38 @@ predict(PyLanguageModel* self, PyObject* args, PyObject *kwds,
     static char *kwlist[] = {(char*)"context",
                              (char*)"limit",
                              (char*)"options",
+                             (char*)"session",
                              NULL};
-    if (PyArg_ParseTupleAndKeywords(args, kwds, "O|IL:predict", kwlist,
+    if (PyArg_ParseTupleAndKeywords(args, kwds, "O|ILO:predict", kwlist,
                                     &ocontext,
                                     &limit,
-                                    &options))
+                                    &options,
+                                    &osession))
     {
+        PredictionSession* session = NULL;
+        if (osession && osession != Py_None)
+        {
+            if (!PyObject_TypeCheck(osession, &PredictionSessionType))
+            {
+                PyErr_SetString(PyExc_TypeError,
+                                "session must be a PredictionSession");
+                return NULL;
+            }
+            session = ((PyPredictionSession*)osession)->o;
+        }
+
         if (!pyseqence_to_strings(ocontext, context))
             return NULL;
 
+        // Let other python threads run while predicting. The model
+        // and session mustn't be used concurrently, callers serialize
+        // access to them.
         vector<LanguageModel::Result> results;
-        (*self)->predict(results, context, limit, (uint32_t) options);
+        LanguageModel* model = self->o;
+        Py_BEGIN_ALLOW_THREADS;
+        model->predict(results, context, limit, (uint32_t) options,
+                       session);
+        Py_END_ALLOW_THREADS;
 
         // build return list
         result = PyList_New(results.size());
@@ -603,6 +735,30 @@ LanguageModel_lookup_word(PyLanguageModel* self, PyObject* value)
     return PyInt_FromLong(result);
 }
 
+// Batch version of lookup_word(), returns a list of lookup results.
+static PyObject *
+LanguageModel_lookup_words(PyLanguageModel* self, PyObject* owords)
+{
+    vector<wchar_t*> words;
+    if (!pyseqence_to_strings(owords, words))
+        return NULL;
+
+    PyObject* result = PyList_New(words.size());
+    if (!result)
+    {
+        free_strings(words);
+        PyErr_SetString(PyExc_MemoryError, "failed to allocate results list");
+        return NULL;
+    }
+
+    for (int i=0; i<(int)words.size(); i++)
+        PyList_SetItem(result, i, PyInt_FromLong((*self)->lookup_word(words[i])));
+
+    free_strings(words);
+
+    return result;
+}
+
 static PyObject *
 LanguageModel_load(PyLanguageModel *self, PyObject *args)
 {
@@ -611,10 +767,15 @@ LanguageModel_load(PyLanguageModel *self, PyObject *args)
     if (!PyArg_ParseTuple(args, "s:load", &filename))
         return NULL;
 
+    // Let other python threads run while loading, models may load
+    // in the background. The pool allocator is thread-safe, other
+    // models may load, learn or shrink meanwhile, but this model
+    // mustn't be used concurrently.
     LMError e;
-    //Py_BEGIN_ALLOW_THREADS;
-    e = (*self)->load(filename);
-    //Py_END_ALLOW_THREADS;
+    LanguageModel* model = self->o;
+    Py_BEGIN_ALLOW_THREADS;
+    e = model->load(filename);
+    Py_END_ALLOW_THREADS;
 
     if (check_error(e, filename))
         return NULL;
@@ -630,7 +791,13 @@ LanguageModel_save(PyLanguageModel *self, PyObject *args)
     if (!PyArg_ParseTuple(args, "s:save", &filename))
         return NULL;
 
-    if (check_error((*self)->save(filename), filename))
+    LMError e;
+    LanguageModel* model = self->o;
+    Py_BEGIN_ALLOW_THREADS;
+    e = model->save(filename);
+    Py_END_ALLOW_THREADS;
+
+    if (check_error(e, filename))
         return NULL;
 
     Py_RETURN_NONE;
@@ -653,6 +820,9 @@ static PyMethodDef LanguageModel_methods[] = {
     {"lookup_word", (PyCFunction)LanguageModel_lookup_word, METH_O,
      ""
     },
+    {"lookup_words", (PyCFunction)LanguageModel_lookup_words, METH_O,
+     ""
+    },
     {"load", (PyCFunction)LanguageModel_load, METH_VARARGS,
      ""
     },
@@ -877,6 +1047,112 @@ static PyTypeObject NGramIterType = {
     0,             /* tp_new */
 };
 
+// Count the n-grams of a sequence of tokens in one call.
+static PyObject *
+learn_tokens(DynamicModelBase* model, PyObject *args)
+{
+    PyObject* otokens = NULL;
+    int allow_new_words = true;
+
+    if (!PyArg_ParseTuple(args, "O|i:learn_tokens",
+                          &otokens, &allow_new_words))
+        return NULL;
+
+    vector<wchar_t*> tokens;
+    if (!pyseqence_to_strings(otokens, tokens))
+        return NULL;
+
+    LMError e = model->learn_tokens(tokens, allow_new_words);
+
+    free_strings(tokens);
+
+    if (e)
+    {
+        PyErr_SetString(PyExc_MemoryError, "out of memory");
+        return NULL;
+    }
+
+    Py_RETURN_NONE;
+}
+
+// Find all n-grams that contain the word sequence context.
+// Returns a list of (ngram, count) tuples.
+static PyObject *
+find_context_ngrams(DynamicModelBase* model, PyObject* ocontext)
+{
+    vector<wchar_t*> words;
+    if (!pyseqence_to_strings(ocontext, words))
+        return NULL;
+
+    // unknown words can't be part of any n-gram
+    vector<WordId> context;
+    for (int i=0; i<(int)words.size(); i++)
+    {
+        WordId wid = model->dictionary.word_to_id(words[i]);
+        if (wid == WIDNONE)
+        {
+            context.clear();
+            break;
+        }
+        context.push_back(wid);
+    }
+    free_strings(words);
+
+    vector<DynamicModelBase::NGramCount> results;
+    if (!context.empty())
+        model->get_context_ngrams(context, results);
+
+    PyObject* result = PyList_New(results.size());
+    if (!result)
+        return NULL;
+
+    for (int i=0; i<(int)results.size(); i++)
+    {
+        const vector<WordId>& wids = results[i].wids;
+        PyObject* ongram = PyTuple_New(wids.size());
+        if (!ongram)
+        {
+            Py_DECREF(result);
+            return NULL;
+        }
+        for (int j=0; j<(int)wids.size(); j++)
+        {
+            const wchar_t* word = model->id_to_word(wids[j]);
+            PyTuple_SetItem(ongram, j,
+                            PyUnicode_FromWideChar(word, wcslen(word)));
+        }
+        PyObject* otuple = Py_BuildValue("(Ni)", ongram, results[i].count);
+        if (!otuple)
+        {
+            Py_DECREF(result);
+            return NULL;
+        }
+        PyList_SetItem(result, i, otuple);
+    }
+
+    return result;
+}
+
+// Write the model in compiled binary format, for CompiledModel.
+static PyObject *
+save_compiled(DynamicModelBase* model, PyObject *args)
+{
+    char* filename = NULL;
+
+    if (!PyArg_ParseTuple(args, "s:save_compiled", &filename))
+        return NULL;
+
+    LMError e;
+    Py_BEGIN_ALLOW_THREADS;
+    e = CompiledModel::write_compiled(model, filename);
+    Py_END_ALLOW_THREADS;
+
+    if (check_error(e, filename))
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
 //------------------------------------------------------------------------
 // UnigramModel - python interface for UnigramModel
 //------------------------------------------------------------------------
@@ -984,6 +1260,24 @@ UnigramModel_iter_ngrams(PyUnigramModel *self)
     return (PyObject*) iter;
 }
 
+static PyObject *
+UnigramModel_find_context_ngrams(PyUnigramModel *self, PyObject *context)
+{
+    return find_context_ngrams(self->o, context);
+}
+
+static PyObject *
+UnigramModel_learn_tokens(PyUnigramModel *self, PyObject *args)
+{
+    return learn_tokens(self->o, args);
+}
+
+static PyObject *
+UnigramModel_save_compiled(PyUnigramModel *self, PyObject *args)
+{
+    return save_compiled(self->o, args);
+}
+
 static PyObject *
 UnigramModel_get_order(PyUnigramModel *self, void *closure)
 {
@@ -1006,6 +1300,13 @@ static PyMethodDef UnigramModel_methods[] = {
     {"count_ngram", (PyCFunction)UnigramModel_count_ngram, METH_VARARGS,
      ""
     },
+    {"learn_tokens", (PyCFunction)UnigramModel_learn_tokens, METH_VARARGS,
+     "Count the n-grams of a sequence of tokens"
+    },
+    {"find_context_ngrams", (PyCFunction)UnigramModel_find_context_ngrams,
+     METH_O,
+     "Find all n-grams containing the given word sequence"
+    },
     {"get_ngram_count", (PyCFunction)UnigramModel_get_ngram_count, METH_O,
      ""
     },
@@ -1015,6 +1316,9 @@ static PyMethodDef UnigramModel_methods[] = {
     {"memory_size", (PyCFunction)UnigramModel_memory_size, METH_NOARGS,
      ""
     },
+    {"save_compiled", (PyCFunction)UnigramModel_save_compiled, METH_VARARGS,
+     ""
+    },
     {NULL}  /* Sentinel */
 };
 
@@ -1190,6 +1494,59 @@ DynamicModel_iter_ngrams(PyDynamicModel *self)
     return (PyObject*) iter;
 }
 
+static PyObject *
+DynamicModel_find_context_ngrams(PyDynamicModel *self, PyObject *context)
+{
+    return find_context_ngrams(self->o, context);
+}
+
+static PyObject *
+DynamicModel_learn_tokens(PyDynamicModel *self, PyObject *args)
+{
+    return learn_tokens(self->o, args);
+}
+
+static PyObject *
+DynamicModel_save_compiled(PyDynamicModel *self, PyObject *args)
+{
+    return save_compiled(self->o, args);
+}
+
+static PyObject *
+DynamicModel_get_num_ngrams(PyDynamicModel *self)
+{
+    return PyInt_FromLong((*self)->get_num_ngrams_total());
+}
+
+static PyObject *
+DynamicModel_shrink(PyDynamicModel *self, PyObject *args)
+{
+    int max_ngrams;
+    int target_ngrams = -1;
+    double recency_halflife = 0.0;
+
+    if (!PyArg_ParseTuple(args, "i|id:shrink",
+                          &max_ngrams, &target_ngrams, &recency_halflife))
+        return NULL;
+    if (target_ngrams < 0)
+        target_ngrams = max_ngrams;
+
+    // Shrinking frees and rebuilds nodes, let other python threads run
+    // meanwhile. Models loading in the background allocate from the
+    // same, thread-safe, pool allocator.
+    LMError e;
+    int num_removed = 0;
+    Py_BEGIN_ALLOW_THREADS;
+    e = (*self)->shrink(max_ngrams, target_ngrams, recency_halflife,
+                        num_removed);
+    Py_END_ALLOW_THREADS;
+
+    if (check_error(e))
+        return NULL;
+
+    return PyInt_FromLong(num_removed);
+}
+
 static PyObject *
 DynamicModel_get_order(PyDynamicModel *self, void *closure)
 {
@@ -1324,6 +1681,13 @@ static PyMethodDef DynamicModel_methods[] = {
     {"count_ngram", (PyCFunction)DynamicModel_count_ngram, METH_VARARGS,
      ""
     },
+    {"learn_tokens", (PyCFunction)DynamicModel_learn_tokens, METH_VARARGS,
+     "Count the n-grams of a sequence of tokens"
+    },
+    {"find_context_ngrams", (PyCFunction)DynamicModel_find_context_ngrams,
+     METH_O,
+     "Find all n-grams containing the given word sequence"
+    },
     {"get_ngram_count", (PyCFunction)DynamicModel_get_ngram_count, METH_O,
      ""
     },
@@ -1333,6 +1697,19 @@ static PyMethodDef DynamicModel_methods[] = {
     {"memory_size", (PyCFunction)DynamicModel_memory_size, METH_NOARGS,
      ""
     },
+    {"save_compiled", (PyCFunction)DynamicModel_save_compiled, METH_VARARGS,
+     ""
+    },
+    {"get_num_ngrams", (PyCFunction)DynamicModel_get_num_ngrams,
+     METH_NOARGS,
+     "Number of n-grams of all levels"
+    },
+    {"shrink", (PyCFunction)DynamicModel_shrink, METH_VARARGS,
+     "shrink(max_ngrams, target_ngrams=max_ngrams, recency_halflife=0)\n"
+     "Drop the least frequent and least recently used n-grams until "
+     "target_ngrams remain, if there are more than max_ngrams. "
+     "Returns the number of dropped n-grams."
+    },
     {NULL}  /* Sentinel */
 };
 
@@ -1645,44 +2022,248 @@ static PyTypeObject CachedDynamicModelType = {
 
 
 //------------------------------------------------------------------------
-// OverlayModel - python interface for OverlayModel
+// CompiledModel - python interface for CompiledModel
 //------------------------------------------------------------------------
 
+static PyObject *
+CompiledModel_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    PyCompiledModel *self;
+
+    self = (PyCompiledModel*)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self = new(self) PyCompiledModel;   // placement new
+    }
+    return (PyObject *)self;
+}
+
 static void
-OverlayModel_dealloc(PyOverlayModel* self)
+CompiledModel_dealloc(PyCompiledModel* self)
 {
-    self->~PyOverlayModel();   // call destructor
+    self->~PyCompiledModel();   // call destructor
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
-static PyMethodDef OverlayModel_methods[] = {
-    {NULL}  /* Sentinel */
-};
+static PyObject *
+CompiledModel_get_ngram_count(PyCompiledModel* self, PyObject* ngram)
+{
+    int n;
+    wchar_t** words = pyseqence_to_strings(ngram, &n);
+    if (!words)
+        return NULL;
 
-static PyTypeObject OverlayModelType = {
-    PyVarObject_HEAD_INIT(&PyType_Type, 0)
-    "lm.OverlayModel",             /*tp_name*/
-    sizeof(PyOverlayModel),             /*tp_basicsize*/
-    0,                         /*tp_itemsize*/
-    (destructor)OverlayModel_dealloc, /*tp_dealloc*/
-    0,                         /*tp_print*/
-    0,                         /*tp_getattr*/
-    0,                         /*tp_setattr*/
-    0,                         /*tp_compare*/
-    0,                         /*tp_repr*/
-    0,                         /*tp_as_number*/
-    0,                         /*tp_as_sequence*/
-    0,                         /*tp_as_mapping*/
-    0,                         /*tp_hash */
-    0,                         /*tp_call*/
-    0,                         /*tp_str*/
-    0,                         /*tp_getattro*/
-    0,                         /*tp_setattro*/
-    0,                         /*tp_as_buffer*/
-    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /*tp_flags*/
-    "OverlayModel objects",           /* tp_doc */
-    0,		               /* tp_traverse */
-    0,		               /* tp_clear */
+    int count = (*self)->get_ngram_count((const wchar_t**) words, n);
+    PyObject* result = PyInt_FromLong(count);
+
+    free_strings(words, n);
+
+    return result;
+}
+
+static PyObject *
+CompiledModel_memory_size(PyCompiledModel* self)
+{
+    vector<long> values;
+    (*self)->get_memory_sizes(values);
+
+    PyObject* result = PyTuple_New(values.size());
+    if (!result)
+    {
+        PyErr_SetString(PyExc_MemoryError, "failed to allocate tuple");
+        return NULL;
+    }
+    for (int i=0; i<(int)values.size(); i++)
+        PyTuple_SetItem(result, i, PyInt_FromLong(values[i]));
+
+    return result;
+}
+
+// Freeze a copy of any dynamic model in memory.
+static PyObject *
+CompiledModel_compile(PyCompiledModel* self, PyObject* omodel)
+{
+    DynamicModelBase* model = NULL;
+    if (PyObject_TypeCheck(omodel, &CachedDynamicModelType))
+        model = ((PyCachedDynamicModel*)omodel)->o;
+    else
+    if (PyObject_TypeCheck(omodel, &DynamicModelKNType))
+        model = ((PyDynamicModelKN*)omodel)->o;
+    else
+    if (PyObject_TypeCheck(omodel, &DynamicModelType))
+        model = ((PyDynamicModel*)omodel)->o;
+    else
+    if (PyObject_TypeCheck(omodel, &UnigramModelType))
+        model = ((PyUnigramModel*)omodel)->o;
+
+    if (!model)
+    {
+        PyErr_SetString(PyExc_TypeError, "expected a dynamic n-gram model");
+        return NULL;
+    }
+
+    if (check_error((*self)->compile(model)))
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
+// returns an object implementing pythons iterator interface
+static PyObject *
+CompiledModel_iter_ngrams(PyCompiledModel *self)
+{
+    NGramIter* iter = PyObject_New(NGramIter, &NGramIterType);
+    if (!iter)
+        return NULL;
+    iter = new(iter) NGramIter(self->o);   // placement new
+
+    return (PyObject*) iter;
+}
+
+static PyObject *
+CompiledModel_get_order(PyCompiledModel *self, void *closure)
+{
+    return PyInt_FromLong((*self)->get_order());
+}
+
+static PyObject *
+CompiledModel_get_smoothing(PyCompiledModel *self, void *closure)
+{
+    const wchar_t* s = smoothing_to_string((*self)->get_smoothing());
+    if (s)
+        return PyUnicode_FromWideChar(s, wcslen(s));
+    Py_RETURN_NONE;
+}
+
+static int
+CompiledModel_set_smoothing(PyCompiledModel *self, PyObject *value,
+                            void *closure)
+{
+    Smoothing sm = pystring_to_smoothing(value);
+    if (!sm)
+        return -1;
+
+    vector<Smoothing> smoothings = (*self)->get_smoothings();
+    if (!count(smoothings.begin(), smoothings.end(), sm))
+    {
+        PyErr_SetString(PyExc_ValueError, "unsupported smoothing option, "
+                                          "try a different model type");
+        return -1;
+    }
+
+    (*self)->set_smoothing(sm);
+
+    return 0;
+}
+
+static PyGetSetDef CompiledModel_getsetters[] = {
+    {(char*)"order",
+     (getter)CompiledModel_get_order, (setter)NULL,
+     (char*)"order of the language model, known after loading",
+     NULL},
+    {(char*)"smoothing",
+     (getter)CompiledModel_get_smoothing, (setter)CompiledModel_set_smoothing,
+     (char*)"ngram smoothing: 'abs-disc' (default) or 'witten-bell'",
+     NULL},
+    {NULL}  /* Sentinel */
+};
+
+static PyMethodDef CompiledModel_methods[] = {
+    {"get_ngram_count", (PyCFunction)CompiledModel_get_ngram_count, METH_O,
+     ""
+    },
+    {"iter_ngrams", (PyCFunction)CompiledModel_iter_ngrams, METH_NOARGS,
+     ""
+    },
+    {"memory_size", (PyCFunction)CompiledModel_memory_size, METH_NOARGS,
+     ""
+    },
+    {"compile", (PyCFunction)CompiledModel_compile, METH_O,
+     ""
+    },
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject CompiledModelType = {
+    PyVarObject_HEAD_INIT(&PyType_Type, 0)
+    "lm.CompiledModel",             /*tp_name*/
+    sizeof(PyCompiledModel),             /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)CompiledModel_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /*tp_flags*/
+    "CompiledModel objects",           /* tp_doc */
+    0,		               /* tp_traverse */
+    0,		               /* tp_clear */
+    0,		               /* tp_richcompare */
+    0,		               /* tp_weaklistoffset */
+    0,		               /* tp_iter */
+    0,		               /* tp_iternext */
+    CompiledModel_methods,     /* tp_methods */
+    0,     /* tp_members */
+    CompiledModel_getsetters,   /* tp_getset */
+    &LanguageModelType,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    0,      /* tp_init */
+    0,                         /* tp_alloc */
+    CompiledModel_new,                 /* tp_new */
+};
+
+
+//------------------------------------------------------------------------
+// OverlayModel - python interface for OverlayModel
+//------------------------------------------------------------------------
+
+static void
+OverlayModel_dealloc(PyOverlayModel* self)
+{
+    self->~PyOverlayModel();   // call destructor
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyMethodDef OverlayModel_methods[] = {
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject OverlayModelType = {
+    PyVarObject_HEAD_INIT(&PyType_Type, 0)
+    "lm.OverlayModel",             /*tp_name*/
+    sizeof(PyOverlayModel),             /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)OverlayModel_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /*tp_flags*/
+    "OverlayModel objects",           /* tp_doc */
+    0,		               /* tp_traverse */
+    0,		               /* tp_clear */
     0,		               /* tp_richcompare */
     0,		               /* tp_weaklistoffset */
     0,		               /* tp_iter */
@@ -1861,6 +2442,604 @@ parse_params(const char* func_name, PyDynamicModel *self, PyObject* args,
 }
 
 
+//------------------------------------------------------------------------
+// Tokenizer - native versions of split_sentences, tokenize_sentence,
+// tokenize_text and tokenize_context. They return the same results as
+// the regular expressions of the *_py reference functions in
+// lm_wrapper.py, which the comments below quote.
+//------------------------------------------------------------------------
+
+typedef vector<Py_UCS4> UCS4String;
+
+enum TokenType
+{
+    TOKEN_UNKNOWN,
+    TOKEN_NUMBER,
+    TOKEN_WORD,
+};
+
+struct Token
+{
+    TokenType type;
+    Py_ssize_t begin;
+    Py_ssize_t end;
+};
+
+struct Sentence
+{
+    UCS4String text;
+    Py_ssize_t begin;
+    Py_ssize_t end;
+};
+
+// Character classes as python's re module defines them for str patterns.
+static inline bool is_space(Py_UCS4 c)   // \s
+{
+    return Py_UNICODE_ISSPACE(c);
+}
+
+static inline bool is_digit(Py_UCS4 c)   // \d
+{
+    return Py_UNICODE_ISDECIMAL(c);
+}
+
+static inline bool is_word(Py_UCS4 c)    // \w
+{
+    return Py_UNICODE_ISALNUM(c) || c == '_';
+}
+
+static inline bool is_letter(Py_UCS4 c)  // [^\W\d]
+{
+    return is_word(c) && !is_digit(c);
+}
+
+static inline bool is_apostrophe(Py_UCS4 c)  // ['´΄]
+{
+    return c == '\'' || c == 0xb4 || c == 0x384;
+}
+
+static inline bool is_sentence_end(Py_UCS4 c)  // [.;:!?]
+{
+    return c == '.' || c == ';' || c == ':' || c == '!' || c == '?';
+}
+
+// (?=\s|$), $ may match before a final newline, which is \s too
+static inline bool at_separator(const Py_UCS4* s, Py_ssize_t len,
+                                Py_ssize_t i)
+{
+    return i >= len || is_space(s[i]);
+}
+
+// (?:^|(?<=\s))
+static inline bool after_separator(const Py_UCS4* s, Py_ssize_t i)
+{
+    return i == 0 || is_space(s[i-1]);
+}
+
+static bool starts_with(const Py_UCS4* s, Py_ssize_t len, Py_ssize_t i,
+                        const char* prefix)
+{
+    for (; *prefix; prefix++, i++)
+        if (i >= len || s[i] != (Py_UCS4)*prefix)
+            return false;
+    return true;
+}
+
+static Py_ssize_t skip_digits(const Py_UCS4* s, Py_ssize_t len,
+                              Py_ssize_t i)
+{
+    while (i < len && is_digit(s[i]))
+        i++;
+    return i;
+}
+
+static Py_ssize_t skip_word_chars(const Py_UCS4* s, Py_ssize_t len,
+                                  Py_ssize_t i)
+{
+    while (i < len && is_word(s[i]))
+        i++;
+    return i;
+}
+
+// End of the sentence fragment starting at begin, SENTENCE_PATTERN:
+//  .*?(?: [.;:!?](?:(?=\s)|") | (?:\s*\n\s*)+(?=\n) | <s> ) | .+$
+static Py_ssize_t
+match_sentence(const Py_UCS4* s, Py_ssize_t len, Py_ssize_t begin)
+{
+    Py_ssize_t i = begin;
+    while (i < len)
+    {
+        Py_UCS4 c = s[i];
+        if (is_space(c))
+        {
+            // Multiple newlines end before the last newline of the
+            // whitespace run. Later starting points within the run
+            // can't see more newlines, skip them.
+            Py_ssize_t last_newline = -1;
+            int newlines = 0;
+            for (; i < len && is_space(s[i]); i++)
+                if (s[i] == '\n')
+                {
+                    newlines++;
+                    last_newline = i;
+                }
+            if (newlines >= 2)
+                return last_newline;
+            continue;
+        }
+
+        if (is_sentence_end(c) && i + 1 < len)
+        {
+            if (is_space(s[i+1]))
+                return i + 1;
+            if (s[i+1] == '"')
+                return i + 2;
+        }
+
+        if (starts_with(s, len, i, "<s>"))
+            return i + 3;
+
+        i++;
+    }
+    return len;   // last sentence fragment
+}
+
+static void
+find_sentences(const Py_UCS4* text, Py_ssize_t len, bool disambiguate,
+                vector<Sentence>& sentences)
+{
+    // Remove carriage returns, keep the length in sync with spans.
+    UCS4String filtered(text, text + len);
+    for (Py_ssize_t i = 0; i < len; i++)
+        if (filtered[i] == '\r')
+            filtered[i] = ' ';
+    const Py_UCS4* s = filtered.data();
+
+    Py_ssize_t match_begin = 0;
+    while (match_begin < len)
+    {
+        Py_ssize_t match_end = match_sentence(s, len, match_begin);
+        Py_ssize_t begin = match_begin;
+        Py_ssize_t end = match_end;
+
+        // strip whitespace including newlines
+        while (begin < end && is_space(s[begin]))
+            begin++;
+        while (end > begin && is_space(s[end-1]))
+            end--;
+
+        // remove <s>
+        UCS4String sentence(s + begin, s + end);
+        Py_ssize_t n = end - begin;
+        for (Py_ssize_t i = 0; i < n; i++)
+            if (starts_with(sentence.data(), n, i, "<s>"))
+            {
+                sentence[i] = sentence[i+1] = sentence[i+2] = ' ';
+                i += 2;
+            }
+
+        // strip whitespace from the cuts, rstrip first like the
+        // reference, in case nothing remains
+        Py_ssize_t first = 0;
+        Py_ssize_t last = n;
+        while (last > first && is_space(sentence[last-1]))
+            last--;
+        while (first < last && is_space(sentence[first]))
+            first++;
+
+        Sentence result;
+        result.text.assign(sentence.begin() + first,
+                           sentence.begin() + last);
+        result.begin = begin + first;
+        result.end = end - (n - last);
+
+        // mark ambiguous sentence ends for the split_corpus tool
+        if (disambiguate)
+        {
+            const UCS4String& t = result.text;
+            size_t m = t.size();
+            if (!((m >= 1 && is_sentence_end(t[m-1])) ||
+                  (m >= 2 && t[m-1] == '"' && is_sentence_end(t[m-2]))))
+            {
+                const char* mark = " <s>";
+                result.text.insert(result.text.end(), mark, mark + 4);
+            }
+        }
+
+        sentences.push_back(result);
+        match_begin = match_end;
+    }
+}
+
+// <unk> group of the token pattern:
+//    (?:^|(?<=\s)) \S*(\S)\1{3,}\S*
+//  | [-]{3} (?=\s|$)
+//  | :[^\s:@]+?@
+static Py_ssize_t
+match_unknown(const Py_UCS4* s, Py_ssize_t len, Py_ssize_t i)
+{
+    if (after_separator(s, i))
+    {
+        // any character repeated more than 3 times
+        bool repeated = false;
+        int count = 0;
+        Py_ssize_t j;
+        for (j = i; j < len && !is_space(s[j]); j++)
+        {
+            count = (j > i && s[j] == s[j-1]) ? count + 1 : 1;
+            if (count >= 4)
+                repeated = true;
+        }
+        if (repeated)
+            return j;
+    }
+
+    if (starts_with(s, len, i, "---") &&
+        at_separator(s, len, i + 3))
+        return i + 3;
+
+    // password in URL
+    if (s[i] == ':')
+    {
+        Py_ssize_t j = i + 1;
+        while (j < len && !is_space(s[j]) && s[j] != ':' && s[j] != '@')
+            j++;
+        if (j > i + 1 && j < len && s[j] == '@')
+            return j + 1;
+    }
+
+    return i;
+}
+
+// <num> group of the token pattern:
+//    [-+]?\d+(?:[.,]\d+)*
+//  | [.,]\d+
+static Py_ssize_t
+match_number(const Py_UCS4* s, Py_ssize_t len, Py_ssize_t i)
+{
+    Py_ssize_t j = i;
+    if (s[j] == '-' || s[j] == '+')
+        j++;
+    if (j < len && is_digit(s[j]))
+    {
+        j = skip_digits(s, len, j);
+        while (j + 1 < len && (s[j] == '.' || s[j] == ',') &&
+               is_digit(s[j+1]))
+            j = skip_digits(s, len, j + 1);
+        return j;
+    }
+
+    if ((s[i] == '.' || s[i] == ',') &&
+        i + 1 < len && is_digit(s[i+1]))
+        return skip_digits(s, len, i + 1);
+
+    return i;
+}
+
+// word group of the token pattern:
+//    [-]{0,2}[^\W\d]\w*(?:[-'´΄]\w+)*[{trailing_characters}'´΄]?
+//  | <unk> | <s> | </s> | <num>
+//  | <bot:[a-z]*>
+//  | (?:^|(?<=\s)) (?:\| {standalone_operators}) (?=\s|$)
+// with trailing_characters "-" and standalone_operators "| [-]{1,2}"
+// in contexts.
+static Py_ssize_t
+match_word(const Py_UCS4* s, Py_ssize_t len, Py_ssize_t i,
+           bool is_context)
+{
+    // command line options may start with up to two dashes
+    Py_ssize_t j = -1;
+    if (s[i] == '-' && i + 2 < len && s[i+1] == '-' && is_letter(s[i+2]))
+        j = i + 2;
+    else if (s[i] == '-' && i + 1 < len && is_letter(s[i+1]))
+        j = i + 1;
+    else if (is_letter(s[i]))
+        j = i;
+
+    if (j >= 0)
+    {
+        j = skip_word_chars(s, len, j + 1);
+        while (j + 1 < len && (s[j] == '-' || is_apostrophe(s[j])) &&
+               is_word(s[j+1]))
+            j = skip_word_chars(s, len, j + 1);
+        if (j < len && (is_apostrophe(s[j]) || (is_context && s[j] == '-')))
+            j++;
+        return j;
+    }
+
+    // pass through control words
+    static const char* control_words[] = {"<unk>", "<s>", "</s>", "<num>"};
+    for (int k = 0; k < ALEN(control_words); k++)
+        if (starts_with(s, len, i, control_words[k]))
+            return i + strlen(control_words[k]);
+
+    // pass through begin of text markers
+    if (starts_with(s, len, i, "<bot:"))
+    {
+        j = i + 5;
+        while (j < len && s[j] >= 'a' && s[j] <= 'z')
+            j++;
+        if (j < len && s[j] == '>')
+            return j + 1;
+    }
+
+    // common space delimited operators
+    if (after_separator(s, i))
+    {
+        if (s[i] == '|' && at_separator(s, len, i + 1))
+            return i + 1;
+        if (is_context && s[i] == '-')
+        {
+            if (i + 1 < len && s[i+1] == '-' && at_separator(s, len, i + 2))
+                return i + 2;
+            if (at_separator(s, len, i + 1))
+                return i + 1;
+        }
+    }
+
+    return i;
+}
+
+static void
+find_tokens(const Py_UCS4* s, Py_ssize_t len, bool is_context,
+                  vector<Token>& tokens)
+{
+    Py_ssize_t i = 0;
+    while (i < len)
+    {
+        Token token = {TOKEN_UNKNOWN, i, i};
+        if ((token.end = match_unknown(s, len, i)) > i)
+            token.type = TOKEN_UNKNOWN;
+        else if ((token.end = match_number(s, len, i)) > i)
+            token.type = TOKEN_NUMBER;
+        else if ((token.end = match_word(s, len, i, is_context)) > i)
+            token.type = TOKEN_WORD;
+        else
+        {
+            i++;
+            continue;
+        }
+        tokens.push_back(token);
+        i = token.end;
+    }
+}
+
+// Does the context end in something that is completed, i.e. does the
+// reference's pattern match?
+//    ^$
+//  | .*[-'´΄\w]$
+//  | (?:^|.*\s)[|]=?$
+//  | .*(\S)\1{3,}$
+static bool
+context_ends_in_token(const Py_UCS4* s, Py_ssize_t len)
+{
+    // $ matches at the end and before a final newline
+    Py_ssize_t ends[] = {len, len - 1};
+    int num_ends = (len > 0 && s[len-1] == '\n') ? 2 : 1;
+
+    for (int k = 0; k < num_ends; k++)
+    {
+        Py_ssize_t end = ends[k];
+        if (end == 0)
+            return true;
+
+        Py_UCS4 c = s[end-1];
+        if (c == '-' || is_apostrophe(c) || is_word(c))
+            return true;
+
+        Py_ssize_t j = c == '=' ? end - 2 : end - 1;
+        if (j >= 0 && s[j] == '|' && after_separator(s, j))
+            return true;
+
+        if (end >= 4 && !is_space(c) &&
+            s[end-2] == c && s[end-3] == c && s[end-4] == c)
+            return true;
+    }
+    return false;
+}
+
+static PyObject*
+new_span(Py_ssize_t begin, Py_ssize_t end, bool as_tuple)
+{
+    if (as_tuple)
+        return Py_BuildValue("(nn)", begin, end);
+    return Py_BuildValue("[nn]", begin, end);
+}
+
+static PyObject*
+new_token_string(const Py_UCS4* s, const Token& token)
+{
+    switch (token.type)
+    {
+        case TOKEN_UNKNOWN: return PyUnicode_FromString("<unk>");
+        case TOKEN_NUMBER:  return PyUnicode_FromString("<num>");
+        default:
+            return PyUnicode_FromKindAndData(PyUnicode_4BYTE_KIND,
+                                             s + token.begin,
+                                             token.end - token.begin);
+    }
+}
+
+// Append a token and its span to the result lists.
+static bool
+append_token(PyObject* tokens, PyObject* spans, PyObject* token,
+             PyObject* span)
+{
+    bool success = token && span &&
+                   PyList_Append(tokens, token) == 0 &&
+                   PyList_Append(spans, span) == 0;
+    Py_XDECREF(token);
+    Py_XDECREF(span);
+    return success;
+}
+
+// Copy of the code points of a str, free with PyMem_Free.
+static Py_UCS4*
+get_ucs4(PyObject* text, Py_ssize_t& len)
+{
+    len = PyUnicode_GetLength(text);
+    if (len < 0)
+        return NULL;
+    return PyUnicode_AsUCS4Copy(text);
+}
+
+static PyObject *
+split_sentences(PyObject *self, PyObject* args)
+{
+    PyObject* otext = NULL;
+    int disambiguate = 0;
+    if (!PyArg_ParseTuple(args, "U|i:split_sentences", &otext,
+                          &disambiguate))
+        return NULL;
+
+    Py_ssize_t len;
+    Py_UCS4* text = get_ucs4(otext, len);
+    if (!text)
+        return NULL;
+
+    vector<Sentence> sentences;
+    find_sentences(text, len, disambiguate, sentences);
+    PyMem_Free(text);
+
+    PyObject* osentences = PyList_New(0);
+    PyObject* ospans = PyList_New(0);
+    bool success = osentences && ospans;
+    for (size_t i = 0; success && i < sentences.size(); i++)
+    {
+        const Sentence& sentence = sentences[i];
+        success = append_token(osentences, ospans,
+                      PyUnicode_FromKindAndData(PyUnicode_4BYTE_KIND,
+                                                sentence.text.data(),
+                                                sentence.text.size()),
+                      new_span(sentence.begin, sentence.end, false));
+    }
+
+    if (!success)
+    {
+        Py_XDECREF(osentences);
+        Py_XDECREF(ospans);
+        return NULL;
+    }
+    return Py_BuildValue("(NN)", osentences, ospans);
+}
+
+static PyObject *
+tokenize_sentence(PyObject *self, PyObject* args)
+{
+    PyObject* otext = NULL;
+    int is_context = 0;
+    if (!PyArg_ParseTuple(args, "U|i:tokenize_sentence", &otext,
+                          &is_context))
+        return NULL;
+
+    Py_ssize_t len;
+    Py_UCS4* text = get_ucs4(otext, len);
+    if (!text)
+        return NULL;
+
+    vector<Token> tokens;
+    find_tokens(text, len, is_context, tokens);
+
+    PyObject* otokens = PyList_New(0);
+    PyObject* ospans = PyList_New(0);
+    bool success = otokens && ospans;
+    for (size_t i = 0; success && i < tokens.size(); i++)
+        success = append_token(otokens, ospans,
+                               new_token_string(text, tokens[i]),
+                               new_span(tokens[i].begin, tokens[i].end,
+                                        true));
+    PyMem_Free(text);
+
+    if (!success)
+    {
+        Py_XDECREF(otokens);
+        Py_XDECREF(ospans);
+        return NULL;
+    }
+    return Py_BuildValue("(NN)", otokens, ospans);
+}
+
+// Tokens of all sentences, sentence begins marked with <s>.
+static bool
+find_text_tokens(const Py_UCS4* text, Py_ssize_t len, bool is_context,
+              PyObject* otokens, PyObject* ospans)
+{
+    vector<Sentence> sentences;
+    find_sentences(text, len, false, sentences);
+
+    vector<Token> tokens;
+    for (size_t i = 0; i < sentences.size(); i++)
+    {
+        const Sentence& sentence = sentences[i];
+        const Py_UCS4* s = sentence.text.data();
+        Py_ssize_t offset = sentence.begin;
+
+        if (i > 0 &&
+            !append_token(otokens, ospans, PyUnicode_FromString("<s>"),
+                          new_span(offset, offset, false)))
+            return false;
+
+        tokens.clear();
+        find_tokens(s, sentence.text.size(), is_context, tokens);
+        for (size_t j = 0; j < tokens.size(); j++)
+        {
+            const Token& token = tokens[j];
+            if (!append_token(otokens, ospans, new_token_string(s, token),
+                              new_span(token.begin + offset,
+                                       token.end + offset, false)))
+                return false;
+        }
+    }
+    return true;
+}
+
+static PyObject *
+tokenize(PyObject *self, PyObject* args, bool is_context,
+         const char* format)
+{
+    PyObject* otext = NULL;
+    int context = is_context;
+    if (!PyArg_ParseTuple(args, format, &otext, &context))
+        return NULL;
+
+    Py_ssize_t len;
+    Py_UCS4* text = get_ucs4(otext, len);
+    if (!text)
+        return NULL;
+
+    PyObject* otokens = PyList_New(0);
+    PyObject* ospans = PyList_New(0);
+    bool success = otokens && ospans &&
+                   find_text_tokens(text, len, context, otokens, ospans);
+
+    // completion prefix of the context
+    if (success && is_context && !context_ends_in_token(text, len))
+        success = append_token(otokens, ospans, PyUnicode_FromString(""),
+                               new_span(len, len, false));
+    PyMem_Free(text);
+
+    if (!success)
+    {
+        Py_XDECREF(otokens);
+        Py_XDECREF(ospans);
+        return NULL;
+    }
+    return Py_BuildValue("(NN)", otokens, ospans);
+}
+
+static PyObject *
+tokenize_text(PyObject *self, PyObject* args)
+{
+    return tokenize(self, args, false, "U|i:tokenize_text");
+}
+
+static PyObject *
+tokenize_context(PyObject *self, PyObject* args)
+{
+    return tokenize(self, args, true, "U:tokenize_context");
+}
+
+
 //------------------------------------------------------------------------
 // Module methods
 //------------------------------------------------------------------------
@@ -1939,6 +3118,18 @@ static PyMethodDef module_methods[] = {
     {"loglinint", (PyCFunction)loglinint, METH_VARARGS,
      ""
     },
+    {"split_sentences", (PyCFunction)split_sentences, METH_VARARGS,
+     ""
+    },
+    {"tokenize_sentence", (PyCFunction)tokenize_sentence, METH_VARARGS,
+     ""
+    },
+    {"tokenize_text", (PyCFunction)tokenize_text, METH_VARARGS,
+     ""
+    },
+    {"tokenize_context", (PyCFunction)tokenize_context, METH_VARARGS,
+     ""
+    },
     {NULL}  /* Sentinel */
 };
 
@@ -1977,6 +3168,8 @@ moduleinit (void)
         // finalize type objects
         if (PyType_Ready(&NGramIterType) < 0)
             return NULL;
+        if (PyType_Ready(&PredictionSessionType) < 0)
+            return NULL;
         if (PyType_Ready(&LanguageModelType) < 0)
             return NULL;
         if (PyType_Ready(&UnigramModelType) < 0)
@@ -1987,6 +3180,8 @@ moduleinit (void)
             return NULL;
         if (PyType_Ready(&CachedDynamicModelType) < 0)
             return NULL;
+        if (PyType_Ready(&CompiledModelType) < 0)
+            return NULL;
         if (PyType_Ready(&OverlayModelType) < 0)
             return NULL;
         if (PyType_Ready(&LinintModelType) < 0)
@@ -1997,6 +3192,8 @@ moduleinit (void)
         // add top level objects to be instantiated from python
         Py_INCREF(&LanguageModelType);
         PyModule_AddObject(module, "LanguageModel", (PyObject *)&LanguageModelType);
+        Py_INCREF(&PredictionSessionType);
+        PyModule_AddObject(module, "PredictionSession", (PyObject *)&PredictionSessionType);
         Py_INCREF(&UnigramModelType);
         PyModule_AddObject(module, "UnigramModel", (PyObject *)&UnigramModelType);
         Py_INCREF(&DynamicModelType);
@@ -2005,6 +3202,8 @@ moduleinit (void)
         PyModule_AddObject(module, "DynamicModelKN", (PyObject *)&DynamicModelKNType);
         Py_INCREF(&CachedDynamicModelType);
         PyModule_AddObject(module, "CachedDynamicModel", (PyObject *)&CachedDynamicModelType);
+        Py_INCREF(&CompiledModelType);
+        PyModule_AddObject(module, "CompiledModel", (PyObject *)&CompiledModelType);
 
         // add constants
         PyDict_SetItemString(LanguageModelType.tp_dict, "CASE_INSENSITIVE",
@@ -2025,6 +3224,12 @@ moduleinit (void)
                              PyInt_FromLong(LanguageModel::NORMALIZE));
         PyDict_SetItemString(LanguageModelType.tp_dict, "NO_SORT",
                              PyInt_FromLong(LanguageModel::NO_SORT));
+        PyDict_SetItemString(LanguageModelType.tp_dict, "MAX_EDIT_DISTANCE_1",
+                             PyInt_FromLong(LanguageModel::MAX_EDIT_DISTANCE_1));
+        PyDict_SetItemString(LanguageModelType.tp_dict, "MAX_EDIT_DISTANCE_2",
+                             PyInt_FromLong(LanguageModel::MAX_EDIT_DISTANCE_2));
+        PyDict_SetItemString(LanguageModelType.tp_dict, "DROP_CAPITALIZED",
+                             PyInt_FromLong(LanguageModel::DROP_CAPITALIZED));
         PyDict_SetItemString(LanguageModelType.tp_dict, "NUM_CONTROL_WORDS",
                              PyInt_FromLong(NUM_CONTROL_WORDS));
     }
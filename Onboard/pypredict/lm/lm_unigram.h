@@ -50,6 +50,9 @@ class UnigramModel : public DynamicModelBase
                 virtual void operator++(int unused) // postfix operator
                 { it++; }
 
+                virtual void next_node()
+                { it++; }
+
                 virtual void get_ngram(std::vector<WordId>& ngram)
                 {
                     WordId wid = it - model->m_counts.begin();
@@ -119,6 +122,7 @@ class UnigramModel : public DynamicModelBase
                 m_counts.push_back(0);
 
             m_counts.at(wid) += increment;
+            set_changed();
 
             node.word_id = wid;
             node.count = m_counts[wid];
@@ -24,6 +24,7 @@
 #include <set>
 #include <map>
 #include <algorithm>
+#include <mutex>
 
 #ifndef ALEN
 #define ALEN(a) ((int)(sizeof(a)/sizeof(*a)))
@@ -272,6 +273,7 @@ class ItemPool
 // Manages multiple fixed size pools for arbitrary allocation sizes.
 // Uses ItemPools for smallish items and falls back to heap
 // allocation for larger ones.
+// Thread-safe, models may load, learn and shrink in parallel.
 class PoolAllocator
 {
     public:
@@ -302,6 +304,8 @@ class PoolAllocator
             size_t bin = size;          // items of any size allowed
             if (bin < ALEN(pools))
             {
+                std::lock_guard<std::mutex> lock(mutex);
+
                 // Minimum allocation size is the size of a pointer.
                 // (ItemPool uses pointers to store the free list)
                 // Wasteful for the smallest items, but still
@@ -332,8 +336,9 @@ class PoolAllocator
         void free(void* p)
         {
             // try to find a slab containing the address p
-            if(!slabmap.empty())
             {
+                std::lock_guard<std::mutex> lock(mutex);
+
                 map<Slab*, ItemPool*>::iterator it;
                 it = slabmap.upper_bound((Slab*)p);
                 if (it != slabmap.begin())
@@ -355,6 +360,7 @@ class PoolAllocator
     private:
         ItemPool* pools[4096];  // max number of bins
         map<Slab*, ItemPool*> slabmap;  // find slab from pointer
+        std::mutex mutex;               // guards pools and slabmap
 };
 
 #ifdef USE_POOL_ALLOCATOR
@@ -26,6 +26,7 @@ from math import log
 
 import pypredict.lm as lm
 from pypredict.lm import overlay, linint, loglinint  # exported symbols
+from pypredict.lm import PredictionSession  # noqa: F401, exported symbol
 
 class _BaseModel:
 
@@ -33,16 +34,32 @@ class _BaseModel:
     load_error = False
     load_error_msg = ""
 
+    # Changes since the last save, for appending to a journal.
+    # None while changes aren't journaled.
+    journal = None
+
     def learn_tokens(self, tokens, allow_new_words=True):
-        """ Extract n-grams from tokens and count them. """
-        for ngram in self._extract_ngrams(tokens):
-            self.count_ngram(ngram, 1, allow_new_words)
+        """
+        Extract n-grams from tokens and count them.
 
+        Doctests:
+        >>> m = DynamicModel(3)
+        >>> m.learn_tokens(["word1", "word2", "<unk>", "word3"])
+        >>> [ng for ng, count, n1prx in sorted(m.iter_ngrams())][-4:]
+        [('word1',), ('word1', 'word2'), ('word2',), ('word3',)]
+        """
+        # windowing and counting happen in the lm module
+        super(_BaseModel, self).learn_tokens(tokens, allow_new_words)
         self.modified = True
 
+        if self.journal is not None:
+            self.journal.append(("learn", bool(allow_new_words),
+                                 list(tokens)))
+
     def _extract_ngrams(self, tokens):
         """
-        Extract n-grams from tokens.
+        Extract n-grams from tokens. Reference for the native
+        learn_tokens, which counts the same n-grams.
 
         Doctests:
         >>> m = DynamicModel(3)
@@ -135,6 +152,38 @@ class _BaseModel:
 
         return model
 
+    def shrink(self, max_ngrams, target_ngrams=None, recency_halflife=0):
+        """
+        Drop the least frequent and least recently used n-grams until
+        target_ngrams remain, but only if there are more than max_ngrams.
+        Runs natively, in place. Returns the number of dropped n-grams.
+
+        Doctests:
+        >>> m = CachedDynamicModel(2)
+        >>> m.learn_tokens(["a", "b", "a", "b", "c", "d"])
+        >>> m.get_num_ngrams()
+        12
+        >>> m.shrink(8, 7)
+        5
+        >>> sorted(it[0] for it in m.iter_ngrams() if len(it[0]) > 1)
+        [('a', 'b')]
+        >>> m.get_ngram_count(["<s>"]), m.modified
+        (1, True)
+        """
+        if target_ngrams is None:
+            target_ngrams = max_ngrams
+        num_removed = super(_BaseModel, self).shrink(max_ngrams,
+                                                     target_ngrams,
+                                                     recency_halflife)
+        if num_removed:
+            self.modified = True
+
+            # The journal can't express removals,
+            # the whole model has to be saved next time.
+            if self.journal is not None:
+                self.journal = []
+        return num_removed
+
     def load(self, filename):
         self.load_error = False
         self.load_error_msg = ""
@@ -156,6 +205,9 @@ class _BaseModel:
             for ngram, count in changes.items():
                 self.count_ngram(ngram, count)
 
+                if self.journal is not None:
+                    self.journal.append(("count", count, list(ngram)))
+
             self.modified = True
 
         return changes
@@ -165,6 +217,14 @@ class _BaseModel:
         Simulate removal of context.
         Returns a dict of affected n-grams and their count changes (negative).
         """
+        # The lm module searches only the relevant parts of the trie.
+        return {ngram : -count
+                for ngram, count in self.find_context_ngrams(context)}
+
+    def _get_remove_context_changes_scan(self, context):
+        """
+        Reference for find_context_ngrams, scans all n-grams.
+        """
         changes = {}
 
         for it in self.iter_ngrams():
@@ -208,6 +268,14 @@ class CachedDynamicModel(_BaseModel, lm.CachedDynamicModel):
     pass
 
 
+class CompiledModel(_BaseModel, lm.CompiledModel):
+    """
+    Read-only model, memory mapped from a file written by save_compiled(),
+    or compiled in memory from another model with compile().
+    """
+    pass
+
+
 def split_tokens(tokens, separator, keep_separator = False):
     """
     Split list of tokens at separator token.
@@ -310,6 +378,13 @@ SENTENCE_PATTERN = re.compile( \
 
 def split_sentences(text, disambiguate=False):
     """ Split text into sentences. """
+    return lm.split_sentences(text, disambiguate)
+
+def split_sentences_py(text, disambiguate=False):
+    """
+    Reference implementation of split_sentences, the native
+    version in the lm extension returns the same results.
+    """
 
     # Remove carriage returns from Moby Dick.
     # Don't change the text's length, keep it in sync with spans.
@@ -402,7 +477,11 @@ CONTEXT_PATTERN = re.compile(tokenize_pattern.format(
                           re.UNICODE|re.DOTALL|re.VERBOSE)
 
 def tokenize_sentence(sentence, is_context = False):
+    """ Split a single sentence into word tokens. """
+    return lm.tokenize_sentence(sentence, is_context)
 
+def tokenize_sentence_py(sentence, is_context = False):
+    """ Reference implementation of tokenize_sentence. """
     if is_context:
         matches = CONTEXT_PATTERN.finditer(sentence)
     else:
@@ -440,12 +519,15 @@ def tokenize_text(text, is_context = False):
                              -> ["Hello", "there", "<s>",
                                  "We", "saw", "<num>", "whales"]
     """
+    return lm.tokenize_text(text, is_context)
 
+def tokenize_text_py(text, is_context = False):
+    """ Reference implementation of tokenize_text. """
     tokens = []
     spans = []
-    sentences, sentence_spans = split_sentences(text)
+    sentences, sentence_spans = split_sentences_py(text)
     for i, sentence in enumerate(sentences):
-        ts, ss = tokenize_sentence(sentence, is_context)
+        ts, ss = tokenize_sentence_py(sentence, is_context)
 
         sbegin = sentence_spans[i][0]
         ss = [[s[0]+sbegin, s[1]+sbegin] for s in ss]
@@ -463,7 +545,11 @@ def tokenize_context(text):
     """ Split text into word tokens + completion prefix.
         The result is ready for use in predict().
     """
-    tokens, spans = tokenize_text(text, is_context = True)
+    return lm.tokenize_context(text)
+
+def tokenize_context_py(text):
+    """ Reference implementation of tokenize_context. """
+    tokens, spans = tokenize_text_py(text, is_context = True)
     if not re.match("""
                   ^$                             # empty string?
                 | .*[-'´΄\w]$                    # word at the end?
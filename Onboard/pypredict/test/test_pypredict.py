@@ -18,7 +18,9 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import random
 import tempfile
+import threading
 import unittest
 from Onboard.pypredict import *
 
@@ -62,6 +64,50 @@ class _TestTokenization(unittest.TestCase):
                          "test '%s': '%s' != '%s'" %
                          (self.training_text, repr(sentences), repr(self.result)))
 
+    def test_native_tokenizer(self):
+        text = self.training_text
+        self.assertEqual(tokenize_text(text), tokenize_text_py(text))
+        self.assertEqual(tokenize_context(text), tokenize_context_py(text))
+        self.assertEqual(split_sentences(text), split_sentences_py(text))
+
+
+class _TestNativeTokenizer(unittest.TestCase):
+    """ The native tokenizer has to agree with the regex based one. """
+
+    # fragments that exercise the alternatives of the patterns
+    FRAGMENTS = list("aAé1٣-+.,;:!?\"'´΄|=@<>_ \n\r\t") + \
+                ["<s>", "<unk>", "</s>", "<num>", "<bot:txt>", "---",
+                 "aaaa", "--", " \n \n ", "ftp://user:pw@host", "1.000,5",
+                 "co-op", "it's", "Ⅷ", "²"]
+
+    def _random_texts(self, count, max_fragments):
+        rnd = random.Random(42)
+        for i in range(count):
+            yield "".join(rnd.choice(self.FRAGMENTS)
+                          for k in range(rnd.randint(0, max_fragments)))
+
+    def test_random_texts(self):
+        for text in self._random_texts(3000, 25):
+            self.assertEqual(split_sentences(text), split_sentences_py(text),
+                             repr(text))
+            self.assertEqual(split_sentences(text, True),
+                             split_sentences_py(text, True), repr(text))
+            self.assertEqual(tokenize_sentence(text, True),
+                             tokenize_sentence_py(text, True), repr(text))
+            self.assertEqual(tokenize_text(text), tokenize_text_py(text),
+                             repr(text))
+            self.assertEqual(tokenize_context(text),
+                             tokenize_context_py(text), repr(text))
+
+    def test_long_text(self):
+        text = " ".join(self._random_texts(300, 10))
+        self.assertEqual(tokenize_text(text), tokenize_text_py(text))
+        self.assertEqual(tokenize_context(text), tokenize_context_py(text))
+
+    def test_type_error(self):
+        with self.assertRaises(TypeError):
+            tokenize_text(b"bytes")
+
 
 class _TestMultiOrder(unittest.TestCase):
     def __init__(self, test, order):
@@ -173,6 +219,18 @@ class _TestMultiOrderMisc(_TestMultiOrder):
         model.learn_tokens(self.training_tokens)
         self.probability_sum(model)
 
+    def test_psum_compiled_model(self):
+        model = DynamicModel(self.order)
+        model.learn_tokens(self.training_tokens)
+        with tempfile.TemporaryDirectory(prefix="test_onboard_") as dir:
+            fn = os.path.join(dir, "model.lmc")
+            model.save_compiled(fn)
+            for smoothing in ["witten-bell", "abs-disc"]:
+                compiled = CompiledModel()
+                compiled.load(fn)
+                compiled.smoothing = smoothing
+                self.probability_sum(compiled)
+
     def test_psum_overlay_model(self): # this sums to 1.0 only for identical models
         model = DynamicModel(self.order)
         model.learn_tokens(self.training_tokens)
@@ -212,6 +270,43 @@ class _TestMultiOrderMisc(_TestMultiOrder):
             m.smoothing = "kneser-ney"
             self.probability_sum(m)
 
+    def test_shrink_cached_dynamic_model(self):
+        model = CachedDynamicModel(self.order)
+        model.learn_tokens(self.training_tokens)
+        num_ngrams = model.get_num_ngrams()
+
+        # within budget, nothing to do
+        self.assertEqual(model.shrink(num_ngrams), 0)
+        self.assertEqual(model.get_num_ngrams(), num_ngrams)
+
+        with tempfile.TemporaryDirectory(prefix="test_onboard_") as dir:
+            fn = os.path.join(dir, "user.lm")
+            for max_ngrams in [num_ngrams * 3 // 4, num_ngrams // 3, 0]:
+                model = CachedDynamicModel(self.order)
+                model.learn_tokens(self.training_tokens)
+                model.learn_tokens(["recent", "words"])
+                a_count = model.get_ngram_count(["a"])   # most frequent
+                target_ngrams = max_ngrams * 9 // 10
+                num_removed = model.shrink(max_ngrams, target_ngrams, 1000)
+
+                self.assertEqual(model.get_num_ngrams(),
+                                 num_ngrams + 3 - num_removed)
+                self.assertLessEqual(model.get_num_ngrams(),
+                                     max(target_ngrams, 4))
+                for word in ["<unk>", "<s>", "</s>", "<num>"]:
+                    self.assertGreaterEqual(model.get_ngram_count([word]), 1)
+                if max_ngrams:
+                    self.assertEqual(model.get_ngram_count(
+                                        ["recent", "words"]), 1)
+                    self.assertEqual(model.get_ngram_count(["a"]), a_count)
+                self.probability_sum(model)
+
+                model.save(fn)
+                loaded = CachedDynamicModel(self.order)
+                loaded.load(fn)
+                self.assertEqual(sorted(loaded.iter_ngrams()),
+                                 sorted(model.iter_ngrams()))
+
 
 class _TestMultiOrderLoadingRobustness(_TestMultiOrder):
 
@@ -548,6 +643,34 @@ class _TestMultiOrderRemove(_TestMultiOrder):
                     self.order, "test #{}".format(itest))
                 itest += 1
 
+    def test_find_context_ngrams(self):
+        """
+        The indexed search must find the same n-grams as a full scan,
+        also after learning and removing n-grams.
+        """
+        tokens = tokenize_text("<s>We saw whales. We saw dolphins, "
+                               "we saw dolphins and whales. "
+                               "Whales saw us.")[0]
+        contexts = [["saw"], ["We", "saw"], ["saw", "dolphins"],
+                    ["saw", "dolphins", "and"], ["<s>"], ["unknown"],
+                    ["whales", "unknown"], ["us", "<s>", "We", "saw"]]
+
+        models = [UnigramModel(), CachedDynamicModel()]
+        for order in range(2, 5):
+            models.append(DynamicModel(order))
+
+        for model in models:
+            model.learn_tokens(tokens)
+            for i, context in enumerate(contexts):
+                self.assertEqual(
+                    model.get_remove_context_changes(context),
+                    model._get_remove_context_changes_scan(context),
+                    (model.order, context))
+
+                # keep the reverse index busy
+                model.learn_tokens(tokens[i:])
+                model.remove_context(contexts[i - 1])
+
     def test_remove_context_witten_bell(self):
         """
         Witten-bell predictions must sum to zero after removal.
@@ -755,6 +878,226 @@ class _TestModel(unittest.TestCase):
         choices = model.predict(['frü'], options = model.ACCENT_INSENSITIVE_SMART)
         self.assertEqual(choices, ['früh'])
 
+    def test_prefix_search_after_learning(self):
+        model = DynamicModel()
+        model.learn_tokens(['Über', 'uber', 'abc'], 1)
+
+        options = model.CASE_INSENSITIVE | model.ACCENT_INSENSITIVE
+        choices = model.predict(['ub'], options = options)
+        self.assertEqual(choices, ['Über', 'uber'])
+
+        # words learned after the first search have to be found too
+        model.learn_tokens(['Übung', 'ubiquitous', 'zzz'], 1)
+        choices = model.predict(['ub'], options = options)
+        self.assertEqual(choices, ['Über', 'uber', 'Übung', 'ubiquitous'])
+
+        choices = model.predict(['Üb'])
+        self.assertEqual(choices, ['Über', 'Übung'])
+
+    def test_fuzzy_prediction(self):
+        model = DynamicModel()
+        model.learn_tokens(tokenize_text("the them then there bear beer "
+                                         "Theo the ümlaut")[0])
+
+        def predict(context, options):
+            return sorted(model.predict(context, options=options))
+
+        d1 = model.MAX_EDIT_DISTANCE_1
+        d2 = model.MAX_EDIT_DISTANCE_2
+        self.assertEqual(predict(["teh"], d1), ['the'])  # transposition
+        self.assertEqual(predict(["thex"], d1), ['the', 'them', 'then'])
+        self.assertEqual(predict(["thex"], d2),
+                         ['Theo', 'the', 'them', 'then', 'there'])
+        self.assertEqual(predict(["bexr"], d1), ['bear', 'beer'])
+        self.assertEqual(predict(["umlaut"], d1), ['ümlaut'])
+        self.assertEqual(predict(["xyz"], d2), [])
+        self.assertEqual(predict(["Teh"], d1), [])
+        self.assertEqual(predict(["Teh"], d1 | model.CASE_INSENSITIVE),
+                         ['the'])
+        self.assertEqual(predict(["Theq"], d1), ['Theo'])
+        self.assertEqual(predict(["Theq"], d1 | model.IGNORE_CAPITALIZED), [])
+
+        # closer words rank higher, then the more probable ones
+        choices = model.predict(["thex"], options=d2)
+        self.assertEqual(choices[:3], ['the', 'them', 'then'])
+
+        # same results with all model types
+        for m in [DynamicModelKN(), CachedDynamicModel()]:
+            m.learn_tokens(tokenize_text("the them then there")[0])
+            self.assertEqual(sorted(m.predict(["thex"], options=d1)),
+                             ['the', 'them', 'then'])
+        compiled = CompiledModel()
+        compiled.compile(model)
+        self.assertEqual(compiled.predictp(["thex"], options=d2),
+                         model.predictp(["thex"], options=d2))
+
+    def test_drop_capitalized(self):
+        model = DynamicModel()
+        model.learn_tokens(tokenize_text("The the Them Then then Zoe")[0])
+        drop = model.DROP_CAPITALIZED
+        caps = model.IGNORE_NON_CAPITALIZED
+
+        self.assertEqual(model.predict(["Th"], options=drop), ['Them'])
+        self.assertEqual(sorted(model.predict(["th"],
+                                options=drop | model.CASE_INSENSITIVE)),
+                         ['Them', 'the', 'then'])
+
+        # dropped words don't count towards the limit
+        self.assertEqual(sorted(model.predict([""], limit=2,
+                                              options=drop | caps)),
+                         ['Them', 'Zoe'])
+
+        # the lower case spelling may come from another model
+        other = DynamicModel()
+        other.learn_tokens(tokenize_text("them")[0])
+        merged = overlay([model, other])
+        self.assertEqual(merged.predict(["Th"], options=drop), [])
+        self.assertEqual(merged.predict([""], limit=1, options=drop | caps),
+                         ['Zoe'])
+
+    def test_lookup_words(self):
+        model = DynamicModel()
+        model.learn_tokens(tokenize_text("the them then there")[0])
+        self.assertEqual(model.lookup_words(["the", "th", "thx", "then"]),
+                         [1, -4, 0, 1])
+        self.assertEqual(model.lookup_words([]), [])
+
+        other = DynamicModel()
+        other.learn_tokens(tokenize_text("thus")[0])
+        merged = overlay([model, other])
+        self.assertEqual(merged.lookup_words(["thus", "the", "xyz"]),
+                         [1, 1, 0])
+
+    def test_prediction_session(self):
+        model = DynamicModel()
+        model.learn_tokens(tokenize_text("the them then there bear beer")[0])
+        session = PredictionSession()
+
+        def predict(context):
+            choices = model.predictp(context, session=session)
+            self.assertEqual(choices, model.predictp(context))
+            return [c[0] for c in choices]
+
+        self.assertEqual(predict(["t"]), ['the', 'them', 'then', 'there'])
+        self.assertEqual(predict(["th"]), ['the', 'them', 'then', 'there'])
+        self.assertEqual(predict(["the"]), ['the', 'them', 'then', 'there'])
+        self.assertEqual(predict(["ther"]), ['there'])
+        self.assertEqual((session.num_searched, session.num_reused), (1, 3))
+
+        # backspace
+        self.assertEqual(predict(["the"]), ['the', 'them', 'then', 'there'])
+        self.assertEqual((session.num_searched, session.num_reused), (2, 3))
+
+        # learning new words must not be missed
+        model.learn_tokens(["theme"])
+        self.assertEqual(predict(["them"]), ['them', 'theme'])
+        self.assertEqual((session.num_searched, session.num_reused), (3, 3))
+
+        # overlay passes the session on to its components
+        session.clear()
+        model2 = DynamicModel()
+        model2.learn_tokens(["bee"])
+        merged = overlay([model, model2])
+        for context in [["b"], ["be"], ["bee"]]:
+            self.assertEqual(merged.predictp(context, session=session),
+                             merged.predictp(context))
+        self.assertEqual((session.num_searched, session.num_reused), (2, 4))
+
+    def test_predict_threads(self):
+        # predictions release the GIL, models in other threads
+        # must give the same results as without threads
+        tokens = tokenize_text("the them then there bear beer")[0]
+        expected = []
+        results = []
+
+        def predict(model):
+            for i in range(100):
+                choices = model.predictp(["th"])
+            results.append(choices)
+
+        threads = []
+        for i in range(4):
+            model = DynamicModel()
+            model.learn_tokens(tokens)
+            expected.append(model.predictp(["th"]))
+            threads.append(threading.Thread(target=predict, args=(model,)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, expected)
+
+    def test_load_learn_shrink_threads(self):
+        # loading and shrinking release the GIL, models in other threads
+        # allocate from the same pool meanwhile
+        words = tokenize_text("the them then there bear beer")[0]
+        errors = []
+
+        def load(fn, expected):
+            for i in range(5):
+                model = CachedDynamicModel()
+                model.load(fn)
+                if sorted(model.iter_ngrams()) != expected:
+                    errors.append(fn)
+
+        def learn_and_shrink():
+            model = CachedDynamicModel()
+            for i in range(50):
+                model.learn_tokens([random.choice(words) + str(j)
+                                    for j in range(200)])
+                model.shrink(500)
+            if model.get_num_ngrams() > 500:
+                errors.append("shrink")
+
+        with tempfile.TemporaryDirectory(prefix="test_onboard_") as dir:
+            threads = []
+            for i in range(3):
+                model = CachedDynamicModel()
+                model.learn_tokens([random.choice(words) + str(j)
+                                    for j in range(5000)])
+                fn = os.path.join(dir, "model{}.lm".format(i))
+                model.save(fn)
+                expected = sorted(model.iter_ngrams())
+                threads.append(threading.Thread(target=load,
+                                                args=(fn, expected)))
+            for i in range(2):
+                threads.append(threading.Thread(target=learn_and_shrink))
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(errors, [])
+
+    def test_learn_tokens_native(self):
+        # the native learn_tokens must count the same n-grams as
+        # the python reference _extract_ngrams
+        tokens_list = [
+            [],
+            ["<unk>"],
+            ["<s>"],
+            ["<s>", "<s>"],
+            ["a", "<s>", "<s>", "b", "<s>"],
+            ["<unk>", "a", "<s>", "<unk>", "b", "c", "<unk>"],
+            tokenize_text("<s>We saw whales. We saw dolphins, "
+                          "we saw-dolphins and whales. "
+                          "Nothing new here.")[0],
+        ]
+        for model_type in [UnigramModel, DynamicModel, CachedDynamicModel]:
+            for allow_new_words in [True, False]:
+                for tokens in tokens_list:
+                    model = model_type()
+                    model.learn_tokens(["a", "c"])
+                    model.learn_tokens(tokens, allow_new_words)
+
+                    reference = model_type()
+                    reference.learn_tokens(["a", "c"])
+                    for ngram in reference._extract_ngrams(tokens):
+                        reference.count_ngram(ngram, 1, allow_new_words)
+
+                    self.assertEqual(list(model.iter_ngrams()),
+                                     list(reference.iter_ngrams()),
+                                     (model_type, tokens))
+
     def test_ignore_capitalized(self):
         model = DynamicModel()
         model.learn_tokens(['ABCDE'], 1)
@@ -874,6 +1217,111 @@ class _TestModel(unittest.TestCase):
              (('uu', 'fff', 'ccc'), 1, 0)]
         )
 
+    def test_save_load_compiled_model(self):
+        fn = os.path.join(self._dir, "model.lmc")
+        tokens = tokenize_text("ccc bbb uu fff ccc ee ccc bbb")[0]
+        contexts = [[""], ["c"], ["ccc", ""], ["ccc", "b"],
+                    ["bbb", "uu", ""], ["xxx", ""], ["<s>", ""]]
+
+        models = [UnigramModel(), DynamicModel(2), DynamicModel(3)]
+        for model in models:
+            model.learn_tokens(tokens)
+        models[2].remove_context(["uu"])  # keep removed n-grams around
+
+        for model in models:
+            model.save_compiled(fn)
+            loaded = CompiledModel()
+            loaded.load(fn)
+
+            # same layout, compiled in memory
+            frozen = CompiledModel()
+            frozen.compile(model)
+            self.assertEqual(frozen.memory_size()[1], os.path.getsize(fn))
+
+            for compiled in [loaded, frozen]:
+                self.assertEqual(compiled.order, model.order)
+                self.assertEqual(list(compiled.iter_ngrams()),
+                                 list(model.iter_ngrams()))
+                self.assertEqual(compiled.get_ngram_count(["ccc"]), 3)
+                self.assertEqual(compiled.get_ngram_count(["xxx"]), 0)
+
+                smoothings = ["witten-bell", "abs-disc"] \
+                             if model.order > 1 else [None]
+                for smoothing in smoothings:
+                    if smoothing:
+                        model.smoothing = smoothing
+                        compiled.smoothing = smoothing
+                    for context in contexts:
+                        self.assertEqual(compiled.predictp(context),
+                                         model.predictp(context))
+                        options = model.NORMALIZE | \
+                                  model.INCLUDE_CONTROL_WORDS
+                        self.assertEqual(compiled.predictp(context,
+                                                           options=options),
+                                         model.predictp(context,
+                                                        options=options))
+
+        with self.assertRaises(TypeError):
+            CompiledModel().compile(loaded)
+
+    def test_load_model_contents(self):
+        fn = os.path.join(self._dir, "model.lm")
+
+        def write(data):
+            with open(fn, "wb") as f:
+                f.write(data)
+
+        # non-ascii words, zero counts and times
+        write("\n\\data\\\nngram 1=7\nngram 2=2\n\n"
+              "\\1-grams:\n1 <unk>\n1 <s>\n1 </s>\n1 <num>\n"
+              "0 zero\n3 5 Häuser\n2 bäume\n\n"
+              "\\2-grams:\n2 7 Häuser bäume\n0 bäume bäume\n"
+              "\\end\\\n".encode("UTF-8"))
+        model = CachedDynamicModel(2)
+        model.load(fn)
+        self.assertEqual(sorted((x[0], x[1], x[-1])  # n-gram, count, time
+                                for x in model.iter_ngrams()
+                                if x[0][-1] == 'bäume'),
+                         [(('Häuser', 'bäume'), 2, 7),
+                          (('bäume',), 2, 0)])
+        self.assertEqual(model.get_ngram_count(['Häuser']), 3)
+        self.assertEqual(model.get_ngram_count(['zero']), 0)
+
+        # encoding error, truncated file, too few tokens
+        for data in [b"\n\\data\\\nngram 1=1\n\n\\1-grams:\n1 \xff\n\\end\\\n",
+                     b"\n\\data\\\nngram 1=1\n\n\\1-grams:\n1 a\n",
+                     b"\n\\data\\\nngram 1=1\nngram 2=1\n\n\\1-grams:\n"
+                     b"1 a\n\\2-grams:\n1 a\n\\end\\\n"]:
+            write(data)
+            with self.assertRaises(IOError):
+                model.load(fn)
+            self.assertTrue(model.load_error)
+
+    def test_load_compiled_model_errors(self):
+        fn = os.path.join(self._dir, "model.lmc")
+
+        model = CompiledModel()
+        with self.assertRaises(IOError):
+            model.load(fn)  # file not found
+        self.assertTrue(model.load_error)
+
+        with open(fn, "wb") as f:
+            f.write(b"\\data\\\nngram 1=1\n" * 10)
+        with self.assertRaises(IOError):
+            model.load(fn)
+
+        # truncated file
+        dynamic_model = DynamicModel()
+        dynamic_model.learn_tokens(tokenize_text("aaa bbb ccc")[0])
+        dynamic_model.save_compiled(fn)
+        with open(fn, "rb") as f:
+            data = f.read()
+        with open(fn, "wb") as f:
+            f.write(data[:len(data)//2])
+        with self.assertRaises(IOError):
+            model.load(fn)
+        self.assertEqual(model.predict([""]), [])
+
     def test_read_order(self):
         """ Test reading the order of a language model """
         fn = os.path.join(self._dir, "model.lm")
@@ -1068,6 +1516,7 @@ def suite():
         suite.addTest(_TestTokenization('test_tokenize_text', a[0], a[1]))
         suite.addTest(_TestTokenization('test_tokenize_context', a[0], a[2]))
         suite.addTest(_TestTokenization('test_split_sentences', a[0], a[3]))
+        suite.addTest(_TestTokenization('test_native_tokenizer', a[0], a[3]))
     suites.append(suite)
 
     suite = unittest.TestSuite()
@@ -1088,6 +1537,9 @@ def suite():
     suite = unittest.TestLoader().loadTestsFromTestCase(_TestModel)
     suites.append(suite)
 
+    suite = unittest.TestLoader().loadTestsFromTestCase(_TestNativeTokenizer)
+    suites.append(suite)
+
     alltests = unittest.TestSuite(suites)
     return alltests
 
@@ -29,8 +29,10 @@ import re
 import colorsys
 import gettext
 import subprocess
+import threading
 from math import pi, sin, cos, sqrt, log
 from contextlib import contextmanager
+from collections import OrderedDict, deque
 
 import logging
 from functools import reduce
@@ -955,6 +957,95 @@ def drop_shadow(cr, pattern, bounds, blur_radius = 4.0, offset = (0, 0),
         cr.mask(pattern)
         cr.restore()
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def box_blur_radii(sigma, passes):
+    """
+    Radii of successive box blurs approximating a gaussian
+    of standard deviation sigma.
+    """
+    if sigma <= 0 or passes < 1:
+        return []
+    n = passes
+    w_ideal = sqrt(12.0 * sigma * sigma / n + 1.0)
+    wl = int(w_ideal)
+    if wl % 2 == 0:
+        wl -= 1
+    wu = wl + 2
+    m = round((12.0 * sigma * sigma - n * wl * wl - 4 * n * wl - 3 * n) /
+              (-4.0 * wl - 4.0))
+    return [(wl - 1) // 2 if i < m else (wu - 1) // 2 for i in range(n)]
+
+def blur_alpha(data, width, height, stride, sigma, passes = 3):
+    """
+    Blur 8 bit alpha values in place, e.g. the data of a cairo
+    FORMAT_A8 image surface. Separable box blurs with running sums,
+    the cost doesn't depend on the blur radius. Pixels outside
+    the image count as transparent.
+    Vectorized with numpy when available.
+    """
+    radii = [r for r in box_blur_radii(sigma, passes) if r > 0]
+    if not radii or width <= 0 or height <= 0:
+        return
+    if numpy is not None:
+        _blur_alpha_numpy(data, width, height, stride, radii)
+    else:
+        _blur_alpha_python(data, width, height, stride, radii)
+
+def _blur_alpha_numpy(data, width, height, stride, radii):
+    image = numpy.ndarray((height, stride), numpy.uint8, buffer=data)
+    a = image[:, :width].astype(numpy.float64)
+    for r in radii:
+        for axis in (1, 0):
+            a = _box_blur_axis_numpy(a, r, axis)
+    image[:, :width] = numpy.clip(a + 0.5, 0, 255).astype(numpy.uint8)
+
+def _box_blur_axis_numpy(a, r, axis):
+    n = a.shape[axis]
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (r + 1, r)
+    c = numpy.cumsum(numpy.pad(a, pad), axis=axis)
+    hi = [slice(None), slice(None)]
+    lo = [slice(None), slice(None)]
+    hi[axis] = slice(2 * r + 1, 2 * r + 1 + n)
+    lo[axis] = slice(0, n)
+    return (c[tuple(hi)] - c[tuple(lo)]) * (1.0 / (2 * r + 1))
+
+def _blur_alpha_python(data, width, height, stride, radii):
+    rows = [list(data[y * stride : y * stride + width])
+            for y in range(height)]
+    for r in radii:
+        rows = [_box_blur_line(row, r) for row in rows]
+        columns = [_box_blur_line(list(column), r) for column in zip(*rows)]
+        rows = [list(row) for row in zip(*columns)]
+    for y, row in enumerate(rows):
+        data[y * stride : y * stride + width] = \
+            bytes(min(255, int(v + 0.5)) for v in row)
+
+def _box_blur_line(line, r):
+    n = len(line)
+    scale = 1.0 / (2 * r + 1)
+    result = [0.0] * n
+    s = sum(line[:r])
+    for i in range(n):
+        if i + r < n:
+            s += line[i + r]
+        if i > r:
+            s -= line[i - r - 1]
+        result[i] = s * scale
+    return result
+
+def blur_image_surface(surface, sigma, passes = 3):
+    """ Blur a cairo FORMAT_A8 image surface in place. """
+    surface.flush()
+    blur_alpha(surface.get_data(),
+               surface.get_width(), surface.get_height(),
+               surface.get_stride(), sigma, passes)
+    surface.mark_dirty()
+
 @contextmanager
 def timeit(s, out=sys.stdout):
     import time, gc
@@ -1341,6 +1432,189 @@ class EventSource(object):
         self._event_queue = None
 
 
+class LRUCache:
+    """
+    Cache that drops the least recently used items beyond max_size.
+
+    Doctests:
+    >>> c = LRUCache(2)
+    >>> c.set("a", 1)
+    >>> c.set("b", 2)
+    >>> c.get("a")
+    1
+    >>> c.set("c", 3)  # drops "b", the least recently used
+    >>> c.get("b") is None
+    True
+    >>> c.get("a"), c.get("c")
+    (1, 3)
+    >>> c.clear()
+    >>> c.get("a") is None
+    True
+    """
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._items = OrderedDict()
+
+    def clear(self):
+        self._items.clear()
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+
+class BackgroundWorker(object):
+    """
+    Background thread for tasks and queries.
+
+    Tasks run in order of submission, without results. Queries run
+    after pending tasks, so they see the effects of earlier tasks,
+    and their results are passed to a callback in the main thread.
+    Queries are submitted to slots, e.g. for word predictions and
+    spelling corrections. Only the most recent query per slot is
+    kept, results of superseded queries are dropped.
+
+    Doctests:
+    >>> results = []
+    >>> w = BackgroundWorker(idle_add=lambda func, *args: func(*args))
+    >>> w.start()
+    >>> w.submit_task(results.append, "learned")
+    >>> w.submit_task(results.append, "saved")
+    >>> w.stop()
+    >>> results
+    ['learned', 'saved']
+
+    # stale results aren't delivered
+    >>> w._request_ids["a"] = 2
+    >>> w._deliver("a", 1, results.append, "stale")
+    False
+    >>> w._deliver("a", 2, results.append, "current")
+    False
+    >>> results
+    ['learned', 'saved', 'current']
+
+    # slots don't supersede each other
+    >>> w.start()
+    >>> w.submit_query(lambda: "prediction", results.append, "a")
+    >>> w.submit_query(lambda: "correction", results.append, "b")
+    >>> w.submit_task(lambda: None)
+    >>> import time; time.sleep(0.1)
+    >>> w.stop()
+    >>> results[3:]
+    ['prediction', 'correction']
+    """
+
+    def __init__(self, idle_add=None):
+        self._idle_add = idle_add if idle_add else GLib.idle_add
+        self._condition = threading.Condition()
+        self._tasks = deque()
+        self._queries = OrderedDict()  # slot -> (request_id, func,
+                                       #          callback)
+        self._request_ids = {}         # slot -> most recent request id
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        self._stop = False
+        self._thread = threading.Thread(name=self.__class__.__name__,
+                                        target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """
+        Finish pending tasks and end the thread.
+        Pending queries are dropped.
+        """
+        with self._condition:
+            self._stop = True
+            self._cancel_queries()
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                _logger.warning("BackgroundWorker: thread didn't stop "
+                                "within {}s".format(timeout))
+            self._thread = None
+
+    def submit_task(self, func, *args):
+        with self._condition:
+            self._tasks.append((func, args))
+            self._condition.notify()
+
+    def submit_query(self, func, callback, slot=None):
+        with self._condition:
+            request_id = self._request_ids.get(slot, 0) + 1
+            self._request_ids[slot] = request_id
+            self._queries.pop(slot, None)
+            self._queries[slot] = (request_id, func, callback)
+            self._condition.notify()
+
+    def cancel_queries(self):
+        with self._condition:
+            self._cancel_queries()
+
+    def _cancel_queries(self):
+        for slot in self._request_ids:
+            self._request_ids[slot] += 1
+        self._queries.clear()
+
+    def _run(self):
+        _logger.info("BackgroundWorker: thread start")
+
+        while True:
+            task = None
+            query = None
+            with self._condition:
+                while not self._tasks and \
+                      not self._queries and \
+                      not self._stop:
+                    self._condition.wait()
+
+                if self._tasks:
+                    task = self._tasks.popleft()
+                elif self._stop:
+                    break
+                else:
+                    # oldest submitted slot first
+                    slot, query = self._queries.popitem(last=False)
+                    query = (slot,) + query
+
+            try:
+                if task:
+                    func, args = task
+                    func(*args)
+                elif query:
+                    slot, request_id, func, callback = query
+                    if self._is_current(slot, request_id):  # not stale yet?
+                        result = func()
+                        self._idle_add(self._deliver,
+                                       slot, request_id, callback, result)
+            except Exception as ex:
+                _logger.exception("BackgroundWorker: " + unicode_str(ex))
+
+        _logger.info("BackgroundWorker: thread exit")
+
+    def _is_current(self, slot, request_id):
+        with self._condition:
+            return request_id == self._request_ids.get(slot)
+
+    def _deliver(self, slot, request_id, callback, result):
+        """ Runs in the main thread. """
+        if self._is_current(slot, request_id):
+            callback(result)
+        return False
+
+
 class XDGDirs:
     """
     Build paths compliant with XDG Base Directory Specification.
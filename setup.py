@@ -249,6 +249,7 @@ class Extension_lm(Extension):
                'lm_unigram.cpp',
                'lm_dynamic.cpp',
                'lm_merged.cpp',
+               'lm_compiled.cpp',
                'lm_python.cpp',
                'pool_allocator.cpp']
 
@@ -258,7 +259,8 @@ class Extension_lm(Extension):
                'lm_dynamic_impl.h',
                'lm_dynamic_kn.h',
                'lm_dynamic_cached.h',
-               'lm_merged.h']
+               'lm_merged.h',
+               'lm_compiled.h']
 
     def __init__(self, root = "", module_root = ""):
         path = join(root, 'pypredict', 'lm')
@@ -277,6 +279,9 @@ class Extension_lm(Extension):
                            library_dirs = [],
                            libraries = [],
                            define_macros=[('NDEBUG', '1')],
+                           # threads for parallel loading of models
+                           extra_compile_args = ["-pthread"],
+                           extra_link_args = ["-pthread"],
                           )
 
 extension_lm = Extension_lm("Onboard", "Onboard")
@@ -419,7 +424,8 @@ DistUtilsExtra.auto.setup(
                   ('share/onboard/layouts/images', glob.glob('layouts/images/*')),
                   ('share/onboard/themes', glob.glob('themes/*')),
                   ('share/onboard/scripts', glob.glob('scripts/*')),
-                  ('share/onboard/models', glob.glob('models/*.lm')),
+                  ('share/onboard/models', glob.glob('models/*.lm') +
+                                           glob.glob('models/*.lmc')),
                   ('share/onboard/tools', glob.glob('Onboard/pypredict/tools/checkmodels')),
 
                   ('share/gnome-shell/extensions/Onboard_Indicator@onboard.org',